@@ -0,0 +1,205 @@
+"""
+Benchmarks for the dataframe profiling in `utilities.df_utils`.
+
+Generates synthetic dataframes for every combination of row count, column count and null rate, with columns
+cycling through the requested dtypes, and measures the wall-clock time and peak traced memory (via `tracemalloc`)
+of profiling every column with `compute_df_metadata`, with and without sampling, and of `check_if_id_like` on
+the columns it is used for (integers and strings). Results are printed and optionally written as JSON, and can be
+compared against a previous run:
+
+    python benchmarks/bench_df_utils.py --rows 1e3 1e5 --output before.json
+    python benchmarks/bench_df_utils.py --rows 1e3 1e5 --compare before.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import List, Dict, Callable, Any
+
+import numpy as np
+import pandas as pd
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from utilities import df_utils  # noqa: E402
+
+DTYPES = ('int', 'float_nan', 'string_id', 'categorical', 'datetime', 'mixed')
+
+
+def _apply_nulls(values: pd.Series, null_rate: float, rng: np.random.RandomState) -> pd.Series:
+    if null_rate <= 0:
+        return values
+
+    return values.mask(rng.rand(len(values)) < null_rate)
+
+
+def generate_column(dtype: str, num_rows: int, null_rate: float, rng: np.random.RandomState) -> pd.Series:
+    """
+    A synthetic column of `num_rows` values of kind `dtype` (one of `DTYPES`). Integer columns never have nulls, as
+    pandas turns integer columns with nulls into float ones, which `float_nan` covers.
+    :param dtype:
+    :param num_rows:
+    :param null_rate:
+    :param rng:
+    :return:
+    """
+    if dtype == 'int':
+        return pd.Series(rng.randint(0, max(1, num_rows // 10), num_rows))
+    elif dtype == 'float_nan':
+        return _apply_nulls(pd.Series(rng.rand(num_rows)), null_rate, rng)
+    elif dtype == 'string_id':
+        ids = 'ID-' + pd.Series(rng.permutation(num_rows)).astype(str).str.zfill(8)
+        return _apply_nulls(ids.astype(object), null_rate, rng)
+    elif dtype == 'categorical':
+        codes = rng.randint(0, 20, num_rows)
+        if null_rate > 0:
+            codes[rng.rand(num_rows) < null_rate] = -1
+        return pd.Series(pd.Categorical.from_codes(codes, categories=[f"category-{i}" for i in range(20)]))
+    elif dtype == 'datetime':
+        timestamps = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.randint(0, 10 ** 8, num_rows), unit='s')
+        return _apply_nulls(pd.Series(timestamps), null_rate, rng)
+    elif dtype == 'mixed':
+        pool = [1, 2.5, 'text', True, None, [1, 2], (3, 4), pd.Timestamp('2021-01-01')]
+        pool_array = np.empty(len(pool), dtype=object)
+        pool_array[:] = pool
+        return _apply_nulls(pd.Series(pool_array[rng.randint(0, len(pool), num_rows)]), null_rate, rng)
+
+    raise ValueError(f"Unknown dtype {dtype}")
+
+
+def generate_frame(num_rows: int, num_columns: int, dtypes: List[str], null_rate: float,
+                   seed: int = 0) -> pd.DataFrame:
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({f"{dtypes[i % len(dtypes)]}_{i}": generate_column(dtypes[i % len(dtypes)], num_rows,
+                                                                            null_rate, rng)
+                         for i in range(num_columns)})
+
+
+def profile_all_columns(df: pd.DataFrame, sampling: df_utils.SamplingConfig = None):
+    metadata = df_utils.compute_df_metadata(df, sampling=sampling)
+    #  Metadata is computed lazily, so force every column.
+    metadata.compute_columns()
+    return metadata
+
+
+def check_id_like_columns(df: pd.DataFrame):
+    columns = [c for c in df.columns if c.startswith(('int_', 'string_id_'))]
+    cardinalities = {c: df[c].nunique(dropna=False) for c in columns}
+    return [df_utils.check_if_id_like(df, cardinalities, c) for c in columns]
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Dict:
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    #  Tracing allocations slows the code down, so peak memory is measured in a separate run.
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'median_seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'peak_memory_bytes': peak,
+    }
+
+
+def run(rows: List[int], columns: List[int], dtypes: List[str], null_rates: List[float],
+        repeat: int, seed: int) -> List[Dict]:
+    benchmarks = {
+        'compute_df_metadata': lambda df: profile_all_columns(df),
+        'compute_df_metadata_sampled': lambda df: profile_all_columns(df, df_utils.SamplingConfig()),
+        'check_if_id_like': check_id_like_columns,
+    }
+
+    results = []
+    for num_rows in rows:
+        for num_columns in columns:
+            for null_rate in null_rates:
+                df = generate_frame(num_rows, num_columns, dtypes, null_rate, seed=seed)
+                for name, benchmark in benchmarks.items():
+                    result = {
+                        'benchmark': name,
+                        'rows': num_rows,
+                        'columns': num_columns,
+                        'dtypes': list(dtypes),
+                        'null_rate': null_rate,
+                    }
+                    try:
+                        result.update(measure(lambda: benchmark(df), repeat))
+                    except Exception as e:
+                        result['error'] = f"{type(e).__name__}: {e}"
+
+                    print(json.dumps(result), flush=True)
+                    results.append(result)
+
+                del df
+
+    return results
+
+
+def _get_result_key(result: Dict):
+    return result['benchmark'], result['rows'], result['columns'], tuple(result['dtypes']), result['null_rate']
+
+
+def compare(results: List[Dict], baseline: List[Dict]):
+    baseline = {_get_result_key(r): r for r in baseline}
+    for result in results:
+        old = baseline.get(_get_result_key(result))
+        if old is None or 'error' in old or 'error' in result:
+            continue
+
+        print(f"{result['benchmark']:<30} rows={result['rows']:<9} cols={result['columns']:<4} "
+              f"nulls={result['null_rate']:<5} "
+              f"time x{result['median_seconds'] / max(old['median_seconds'], 1e-9):.2f} "
+              f"memory x{result['peak_memory_bytes'] / max(old['peak_memory_bytes'], 1):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', nargs='+', type=float, default=[1e3, 1e4, 1e5, 1e6, 1e7])
+    parser.add_argument('--columns', nargs='+', type=int, default=[len(DTYPES)])
+    parser.add_argument('--dtypes', nargs='+', choices=DTYPES, default=list(DTYPES))
+    parser.add_argument('--null-rates', nargs='+', type=float, default=[0.0, 0.1])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this path.')
+    parser.add_argument('--compare', default=None, help='Compare against the JSON results of a previous run.')
+    args = parser.parse_args()
+
+    results = run([int(r) for r in args.rows], args.columns, args.dtypes, args.null_rates, args.repeat, args.seed)
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Import-time benchmark for `interface.viz_app`.
+
+Measures the wall-clock time of importing the module in fresh interpreters and checks that none of the heavy
+dependencies that are only needed once a searcher or instantiator is selected get imported along with it.
+Exits with a non-zero status if either check fails, so it can be used to catch regressions:
+
+    python benchmarks/import_time.py --max-seconds 1.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+#  Modules that must only be imported once `get_searcher`, `get_instantiator` or `App` actually need them.
+LAZY_MODULES = [
+    'gensim',
+    'nltk',
+    'whoosh',
+    'pygments',
+    'ipywidgets',
+    'seaborn',
+    'matplotlib.pyplot',
+    'utilities.render_pool',
+    'viz_synthesis_widget',
+    'synthesis.nl_searcher',
+    'synthesis.simple_code_searcher',
+    'synthesis.simple_nl_plus_code_searcher',
+    'synthesis.simple_instantiator',
+]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'loaded': [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, repeat: int):
+    results = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, lazy=LAZY_MODULES)],
+                             cwd=PROJECT_DIR, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='interface.viz_app')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help='Fail if the median import time exceeds this many seconds.')
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this path.')
+    args = parser.parse_args()
+
+    results = measure(args.module, args.repeat)
+    timings = [r['elapsed'] for r in results]
+    loaded = sorted(set().union(*(r['loaded'] for r in results)))
+    summary = {
+        'module': args.module,
+        'median_seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'max_seconds': max(timings),
+        'eagerly_loaded': loaded,
+    }
+
+    print(json.dumps(summary, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    failed = False
+    if loaded:
+        print(f"FAIL: {args.module} eagerly imports {', '.join(loaded)}", file=sys.stderr)
+        failed = True
+
+    if args.max_seconds is not None and summary['median_seconds'] > args.max_seconds:
+        print(f"FAIL: median import time {summary['median_seconds']:.3f}s exceeds {args.max_seconds:.3f}s",
+              file=sys.stderr)
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
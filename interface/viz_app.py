@@ -1,41 +1,31 @@
 import base64
 import itertools
 import multiprocessing
-import os
-import pickle
 import sys
 import threading
 import time
-from typing import List, Dict, Union, Callable
+from typing import List, Dict, Union, Callable, Optional
 
 import attr
-import ipywidgets as widgets
 import pandas as pd
-import matplotlib as mpl
-from IPython.core.display import display, Javascript
-from ipywidgets import Button, Layout
-from pygments import highlight
-from pygments import lexers
-from pygments.formatters import HtmlFormatter
-from pygments.styles import get_style_by_name
-from viz_synthesis_widget import VizSynthesisWidget
-
-import common
+
 from synthesis.base_instantiator import BaseInstantiator
+from synthesis import search_server, searchers
 from synthesis.base_searcher import BaseSearcher
-from synthesis.nl_searcher import NaturalLanguageSearcher
 from synthesis.query import Query
-from synthesis.simple_code_searcher import SimpleCodeSearcher
-from synthesis.simple_instantiator import SimpleInstantiator
-from synthesis.simple_nl_plus_code_searcher import SimpleNLPlusCodeSearcher, WhooshNLPlusCodeSearcher
-from utilities.matplotlib_utils import turn_off_multiple_open_figure_warning, serialize_fig
+from utilities.mp_utils import get_num_available_cores, set_core_share
+from utilities.shm_utils import SharedDataFrame
 
-turn_off_multiple_open_figure_warning()
+#  Widgets, syntax highlighting, plotting libraries and the searchers (along with gensim, nltk and whoosh) are
+#  imported only where they are used, so that importing this module stays cheap. Run
+#  `python benchmarks/import_time.py` after touching the imports here.
 _searcher_cache = {}
 
 
 def create_expanded_button(description, button_style, icon='',
                            height='auto', width='auto'):
+    from ipywidgets import Button, Layout
+
     return Button(description=description,
                   button_style=button_style,
                   layout=Layout(height='auto', width='auto'),
@@ -48,6 +38,11 @@ def read_image(path: str):
 
 
 def get_html(code: str):
+    from pygments import highlight
+    from pygments import lexers
+    from pygments.formatters import HtmlFormatter
+    from pygments.styles import get_style_by_name
+
     lexer = lexers.get_lexer_by_name('python')
     style = get_style_by_name('default')
     html_formatter = HtmlFormatter(full=False, style=style, noclasses=True)
@@ -69,6 +64,8 @@ def create_code_cell(code='', where='below'):
             above
             below
     """
+    from IPython.core.display import display, Javascript
+
     encoded_code = (base64.b64encode(str.encode(code))).decode()
     display(Javascript("""
         var code = IPython.notebook.insert_cell_{0}('code');
@@ -82,6 +79,8 @@ def check_rules(fig):
     :param fig:
     :return:
     """
+    import matplotlib as mpl
+
     for ax in fig.axes:
         txts = {
             'xaxis_label': '',
@@ -134,6 +133,8 @@ def check_rules(fig):
 
 
 def _fig_serializer(fig):
+    from utilities.matplotlib_utils import serialize_fig
+
     png = serialize_fig(fig, format='png', tight=True)
     if not check_rules(fig):
         return None
@@ -144,9 +145,21 @@ def synthesize_worker(viz_functions_queue: multiprocessing.Queue,
                       results_queue: multiprocessing.Queue,
                       query: Query,
                       instantiator: BaseInstantiator,
-                      df_var_names: List[str]):
-    while not viz_functions_queue.empty():
-        viz_function = viz_functions_queue.get(block=True)
+                      df_var_names: List[str],
+                      num_workers: int = 1):
+    """
+    Instantiates the (rank, viz_function) pairs from `viz_functions_queue` until it gets a None, and puts
+    (rank, result) pairs in `results_queue`. `num_workers` is the number of workers running side by side.
+    """
+    #  Parallel profiling within a worker only gets the worker's share of the cores.
+    set_core_share(num_workers)
+
+    while True:
+        item = viz_functions_queue.get(block=True)
+        if item is None:
+            break
+
+        rank, viz_function = item
 
         sys.stdout.flush()
         for result in instantiator.instantiate(query, [viz_function], serializer=_fig_serializer):
@@ -160,11 +173,11 @@ def synthesize_worker(viz_functions_queue: multiprocessing.Queue,
             code_html = get_html(code)
 
             encoded_png = base64.b64encode(png).decode('utf-8')
-            results_queue.put({
+            results_queue.put((rank, {
                 'png': encoded_png,
                 'code': code,
                 'code_html': code_html,
-            })
+            }))
 
 
 @attr.s(cmp=False, repr=False)
@@ -176,34 +189,61 @@ class SynthesisTask:
     df_var_names: List[str] = attr.ib()
 
     polling_time: int = attr.ib(default=2)  # in seconds
+    #  Number of processes instantiating viz_functions. Defaults to the number of available cores.
+    num_workers: Optional[int] = attr.ib(default=None)
 
     _active: bool = attr.ib(init=False, default=True)
 
     #  Workers
     _viz_functions_queue = attr.ib(init=False)
     _results_queue = attr.ib(init=False)
-    _synthesis_worker = attr.ib(init=False)
+    _shared_dfs: List[SharedDataFrame] = attr.ib(init=False, factory=list)
+    #  `terminate` (on the UI thread) and the polling thread may both release the shared dataframes.
+    _shared_dfs_lock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+    _synthesis_workers = attr.ib(init=False)
     _polling_worker = attr.ib(init=False)
 
     def __attrs_post_init__(self):
         self.setup()
 
     def setup(self):
+        num_workers = self.num_workers or get_num_available_cores()
+        num_workers = max(1, min(num_workers, len(self.viz_functions)))
+
+        #  Profile the dataframes before the workers are forked, so they all inherit the process-wide metadata cache
+        #  and it outlives them for the next search, instead of every worker profiling the same dataframes again.
+        if self.instantiator.USES_DF_METADATA:
+            for index in range(len(self.query.provided_dfs)):
+                self.query.get_df_metadata(index)
+
+        #  Publish the dataframes in shared memory once, instead of pickling them for every render.
+        self._shared_dfs = [SharedDataFrame.publish(df) for df in self.query.provided_dfs]
+        query = attr.evolve(self.query, shared_dfs=self._shared_dfs)
+
+        #  Workers take viz_functions off the queue in the order of the search results, so the best ranked ones
+        #  are instantiated first. Every worker stops at its own sentinel.
         self._viz_functions_queue = multiprocessing.Queue()
         self._results_queue = multiprocessing.Queue()
-        for viz_function in self.viz_functions:
-            self._viz_functions_queue.put(obj=viz_function, block=True)
-
-        self._synthesis_worker = multiprocessing.Process(target=synthesize_worker,
-                                                         args=(self._viz_functions_queue,
-                                                               self._results_queue,
-                                                               self.query,
-                                                               self.instantiator,
-                                                               self.df_var_names))
+        for rank, viz_function in enumerate(self.viz_functions):
+            self._viz_functions_queue.put(obj=(rank, viz_function), block=True)
+
+        for _ in range(num_workers):
+            self._viz_functions_queue.put(obj=None, block=True)
+
+        self._synthesis_workers = [multiprocessing.Process(target=synthesize_worker,
+                                                           args=(self._viz_functions_queue,
+                                                                 self._results_queue,
+                                                                 query,
+                                                                 self.instantiator,
+                                                                 self.df_var_names,
+                                                                 num_workers))
+                                   for _ in range(num_workers)]
         self._polling_worker = threading.Thread(target=self.polling_func)
 
     def start(self):
-        self._synthesis_worker.start()
+        for worker in self._synthesis_workers:
+            worker.start()
+
         self._polling_worker.start()
 
     def is_active(self):
@@ -211,17 +251,32 @@ class SynthesisTask:
 
     def terminate(self):
         self._active = False
-        self._synthesis_worker.kill()
+        for worker in self._synthesis_workers:
+            worker.kill()
+
+        self.release_shared_dfs()
+
+    def release_shared_dfs(self):
+        with self._shared_dfs_lock:
+            shared_dfs, self._shared_dfs = self._shared_dfs, []
+
+        for shared_df in shared_dfs:
+            shared_df.close()
 
     def polling_func(self):
         while self._active:
+            #  Check before draining the queue, so results put just before the last worker exited are not missed.
+            alive = any(worker.is_alive() for worker in self._synthesis_workers)
             items = []
             while not self._results_queue.empty():
                 items.append(self._results_queue.get())
 
-            self.callback(items)
-            if not self._synthesis_worker.is_alive():
+            #  Workers finish at different times, so restore the order of the search results within every batch.
+            items.sort(key=lambda item: item[0])
+            self.callback([result for _, result in items])
+            if not alive:
                 self._active = False
+                self.release_shared_dfs()
                 break
 
             time.sleep(self.polling_time)
@@ -267,6 +322,13 @@ class App:
         self.build()
 
     def build(self):
+        import ipywidgets as widgets
+        from ipywidgets import Layout
+        from viz_synthesis_widget import VizSynthesisWidget
+        from utilities.matplotlib_utils import turn_off_multiple_open_figure_warning
+
+        turn_off_multiple_open_figure_warning()
+
         self._viz_search_bar = widgets.Text(
             placeholder='Type keywords to synthesize visualizations',
             description='Search',
@@ -421,6 +483,8 @@ class App:
         self._viz_display.num_cols = self._zoom_level
 
     def display(self):
+        from IPython.core.display import display
+
         self._page_navigation.layout.display = 'none'
         display(self._viz_search_bar)
         display(self._page_navigation)
@@ -436,21 +500,13 @@ def get_searcher(searcher_type: str):
     if searcher_type in _searcher_cache:
         return _searcher_cache[searcher_type]
 
-    path_viz_functions = f"{common.PROJECT_DIR}/visualization_functions.pkl"
-    if not os.path.exists(path_viz_functions):
-        raise FileNotFoundError(f"File {path_viz_functions} not found.")
+    if searcher_type not in searchers.SEARCHER_TYPES:
+        raise ValueError(f"Arg `searcher_type` must be one of {searchers.SEARCHER_TYPES}")
 
-    with open(path_viz_functions, 'rb') as f:
-        viz_functions = pickle.load(f)
-
-    if searcher_type == 'simple-code':
-        searcher = SimpleCodeSearcher(viz_functions)
-    elif searcher_type == 'nl':
-        searcher = NaturalLanguageSearcher(viz_functions)
-    elif searcher_type == 'nl+code':
-        searcher = WhooshNLPlusCodeSearcher(viz_functions)
-    else:
-        raise ValueError("Arg `searcher_type` must be one of ('simple-code', 'nl', 'nl+code')")
+    #  Use the search server shared by all the kernels on this host if one is running.
+    searcher = search_server.connect(searcher_type)
+    if searcher is None:
+        searcher = searchers.create_searcher(searcher_type)
 
     _searcher_cache[searcher_type] = searcher
     return searcher
@@ -458,6 +514,7 @@ def get_searcher(searcher_type: str):
 
 def get_instantiator(instantiator_type: str):
     if instantiator_type == 'simple-instantiator':
+        from synthesis.simple_instantiator import SimpleInstantiator
         return SimpleInstantiator()
     else:
         raise ValueError("Arg `instantiator_type` must be one of ('simple-instantiator', 'generality-instantiator').")
@@ -0,0 +1,59 @@
+from typing import Dict, List, Tuple
+
+import attr
+import numpy as np
+
+from synthesis.corpus import Corpus
+
+
+@attr.s(cmp=False, repr=False)
+class ArityIndex:
+    """
+    Buckets the viz_functions of a corpus by the number of dataframe and column args they take, so that searchers
+    can restrict scoring to the viz_functions that can be instantiated for a query at all.
+    Viz_functions that can visualize columns implicitly (i.e. have a non-empty `col_analysis['implicit_cols']`)
+    can additionally be included for queries with more columns than they have column args.
+    """
+    df_arity: np.ndarray = attr.ib()
+    col_arity: np.ndarray = attr.ib()
+    has_implicit_cols: np.ndarray = attr.ib()
+
+    _buckets: Dict[Tuple, np.ndarray] = attr.ib(init=False, factory=dict)
+
+    @classmethod
+    def build(cls, viz_functions: List[Dict]) -> 'ArityIndex':
+        if isinstance(viz_functions, Corpus):
+            return cls(viz_functions.df_arity, viz_functions.col_arity, viz_functions.has_implicit_cols)
+
+        df_arity = np.array([len(t['df_args']) for t in viz_functions], dtype=np.int64)
+        col_arity = np.array([len(t['col_args']) for t in viz_functions], dtype=np.int64)
+        has_implicit_cols = np.array([len((t.get('col_analysis') or {}).get('implicit_cols') or {}) > 0
+                                      for t in viz_functions], dtype=bool)
+        return cls(df_arity, col_arity, has_implicit_cols)
+
+    def get_candidates(self, num_dfs: int, num_cols: int = None, allow_implicit: bool = False) -> np.ndarray:
+        """
+        Sorted indices of the viz_functions taking exactly `num_dfs` dataframe args and, if `num_cols` is not None,
+        exactly `num_cols` column args. If `allow_implicit` is True, viz_functions with implicit column support
+        taking at most `num_cols` column args are included as well.
+        The returned array is shared across calls and must not be modified.
+        :param num_dfs:
+        :param num_cols:
+        :param allow_implicit:
+        :return:
+        """
+        key = (num_dfs, num_cols, allow_implicit)
+        if key not in self._buckets:
+            mask = self.df_arity == num_dfs
+            if num_cols is not None:
+                col_mask = self.col_arity == num_cols
+                if allow_implicit:
+                    col_mask |= self.has_implicit_cols & (self.col_arity <= num_cols)
+
+                mask &= col_mask
+
+            candidates = np.flatnonzero(mask)
+            candidates.setflags(write=False)
+            self._buckets[key] = candidates
+
+        return self._buckets[key]
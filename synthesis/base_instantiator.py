@@ -1,20 +1,25 @@
 from abc import abstractmethod, ABC
 
 import attr
-import matplotlib.pyplot as plt
-from typing import Dict, Optional, Iterator, Callable, Any, List
+from typing import Dict, Optional, Iterator, Callable, Any, List, TYPE_CHECKING
 
 from synthesis.query import Query
 
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
+
 
 @attr.s(cmp=False, repr=False)
 class BaseInstantiator(ABC):
+    #  Whether `instantiate` profiles the provided dataframes with `Query.get_df_metadata`.
+    USES_DF_METADATA = False
+
     @staticmethod
     @abstractmethod
     def instantiate(query: Query,
                     viz_functions: List[Dict],
                     timeout: Optional[int] = None,
-                    serializer: Callable[[plt.Figure], Any] = None) -> Iterator[Dict]:
+                    serializer: Callable[['plt.Figure'], Any] = None) -> Iterator[Dict]:
         """
         Should be a generator which yields a dictionary with at least the following entries:
         'fig': The figure object if serializer is None,
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from typing import List, Dict, Hashable
 
 from synthesis.query import Query
 
@@ -8,3 +8,20 @@ class BaseSearcher(ABC):
     @abstractmethod
     def search(self, query: Query) -> List[Dict]:
         pass
+
+    def get_query_key(self, query: Query) -> Hashable:
+        """
+        A key for the results of `query`, used to cache them. Queries with equal keys must produce the same results,
+        so searchers should normalize the query string the same way `search` does.
+        :param query:
+        :return:
+        """
+        return query.query_str, len(query.provided_dfs), len(query.requested_cols)
+
+    def get_index_version(self) -> Hashable:
+        """
+        Identifies the corpus and index the searcher's results are computed from. Cached results are discarded
+        whenever it changes.
+        :return:
+        """
+        return id(self)
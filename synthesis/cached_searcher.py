@@ -0,0 +1,60 @@
+import collections
+import threading
+from typing import List, Dict, Hashable
+
+import attr
+
+from synthesis.base_searcher import BaseSearcher
+from synthesis.query import Query
+
+
+@attr.s(cmp=False, repr=False)
+class CachedSearcher(BaseSearcher):
+    """
+    Wraps a searcher with a size-bounded LRU cache of search results keyed by `searcher.get_query_key`, so that
+    re-submitting the same (or an equivalently normalized) query does not search again. The cache is cleared
+    whenever `searcher.get_index_version()` changes.
+    """
+    searcher: BaseSearcher = attr.ib()
+    max_size: int = attr.ib(default=128)
+
+    hits: int = attr.ib(init=False, default=0)
+    misses: int = attr.ib(init=False, default=0)
+
+    _cache: 'collections.OrderedDict[Hashable, List[Dict]]' = attr.ib(init=False, factory=collections.OrderedDict)
+    _index_version: Hashable = attr.ib(init=False, default=None)
+    _lock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+
+    def search(self, query: Query) -> List[Dict]:
+        index_version = self.searcher.get_index_version()
+        key = self.searcher.get_query_key(query)
+        with self._lock:
+            if index_version != self._index_version:
+                self._cache.clear()
+                self._index_version = index_version
+
+            if key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return list(self._cache[key])
+
+            self.misses += 1
+
+        results = self.searcher.search(query)
+        with self._lock:
+            if index_version == self._index_version:
+                self._cache[key] = list(results)
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+
+        return results
+
+    def get_query_key(self, query: Query) -> Hashable:
+        return self.searcher.get_query_key(query)
+
+    def get_index_version(self) -> Hashable:
+        return self.searcher.get_index_version()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
@@ -1,68 +1,124 @@
 import collections
+import heapq
 import itertools
 import time
 from typing import List, Dict, Optional, Callable, Any, Iterator, Tuple
 
 import attr
+import numpy as np
 from matplotlib import pyplot as plt
 
 from synthesis.base_instantiator import BaseInstantiator
+from synthesis.col_compat import compute_compatibility_scores
+from synthesis.corpus import get_col_args_encoding
 from synthesis.query import Query
-from synthesis.utils import deepcopy_args
+from synthesis.static_profile import get_static_profile, check_static_profile
 from utilities.matplotlib_utils import run_viz_code_matplotlib_mp
 
 
-def _get_valid_assignments(candidates_map: List[Tuple[Any, List[Tuple[float, str]]]],
-                           _depth: int = 0,
-                           _cur_map: Optional[Dict] = None):
-    if _cur_map is None:
-        _cur_map = {'score': 0}
+def _to_exact_scores(candidates_map: List[Tuple[Any, List[Tuple[float, str]]]]) -> Tuple[List[List[int]], int]:
+    #  Floats are dyadic rationals, so scaling them by the largest denominator turns them into integers whose sums
+    #  are exact. Bounds can then be compared with the totals of the assignments they bound without any slack.
+    ratios = [[float(score).as_integer_ratio() for score, _ in cands] for _, cands in candidates_map]
+    scale = max((den for key_ratios in ratios for _, den in key_ratios), default=1)
+    return [[num * (scale // den) for num, den in key_ratios] for key_ratios in ratios], scale
 
-    if _depth == len(candidates_map):
-        m = _cur_map.copy()
-        yield m.pop('score') / max(1, len(m)), m
-        return
-
-    q_col = candidates_map[_depth][0]
-    for cand_score, cand in candidates_map[_depth][1]:
-        if cand not in _cur_map:
-            new_map = _cur_map.copy()
-            new_map[cand] = q_col
-            new_map['score'] += cand_score
-            yield from _get_valid_assignments(candidates_map, _depth=_depth + 1, _cur_map=new_map)
-
-
-def get_col_compatibility_score(df_col: Any, df_metadata: Dict, orig_metadata: Dict):
-    hl_dtype = df_metadata['high_level_data_types'][df_col]
-    ll_dtype = df_metadata['low_level_data_types'][df_col]
-    has_null = df_metadata['has_null'][df_col]
 
-    o_hl_dtype = orig_metadata['high_level_dtype']
-    o_ll_dtype = orig_metadata['low_level_dtype']
-    o_has_null = orig_metadata['has_null']
+def iter_best_assignments(candidates_map: List[Tuple[Any, List[Tuple[float, str]]]]) -> Iterator[Tuple[float, Dict]]:
+    """
+    Lazily generate the injective assignments of a candidate to every key of `candidates_map` in descending order
+    of their average candidate score, as (score, {candidate: key}) pairs. Ties come out in the order a depth-first
+    enumeration over the keys and candidates, in the given order, would produce them.
+    This is a best-first branch-and-bound search over partial assignments, bounded by the best candidate score of
+    each unassigned key, so only the partial assignments that can still beat the next assignment get expanded.
+    With all scores tied, the first assignment comes out after expanding O(num keys ** 2) partial assignments.
+    :param candidates_map: A list of (key, [(candidate score, candidate), ...]) pairs
+    :return:
+    """
+    num_keys = len(candidates_map)
+    if num_keys == 0:
+        yield 0.0, {}
+        return
 
-    score = 0
-    hl_dtype = set(hl_dtype.split("/")) if "/" in hl_dtype else {hl_dtype}
-    o_hl_dtype = set(o_hl_dtype.split("/")) if "/" in o_hl_dtype else {o_hl_dtype}
+    if any(len(cands) == 0 for _, cands in candidates_map):
+        return
 
-    if len(hl_dtype & o_hl_dtype) > 0:
-        score += 1.0
-    else:
-        return 0.0
+    exact_scores, scale = _to_exact_scores(candidates_map)
+
+    #  best_remaining[d] is an upper bound on the total score of the candidates for the keys from depth d onwards.
+    best_remaining = [0] * (num_keys + 1)
+    for depth in reversed(range(num_keys)):
+        best_remaining[depth] = best_remaining[depth + 1] + max(exact_scores[depth])
+
+    #  Entries are (-bound on the total score, candidate indices, total score, assignment). The candidate indices
+    #  are unique and order ties like the depth-first enumeration would: a partial assignment comes before the
+    #  assignments tied with it that it does not extend exactly when the enumeration would reach it first.
+    heap = [(-best_remaining[0], (), 0, {})]
+    while heap:
+        _, indices, total, asgn = heapq.heappop(heap)
+        depth = len(indices)
+        if depth == num_keys:
+            yield total / (scale * num_keys), asgn
+            continue
+
+        key = candidates_map[depth][0]
+        for cand_idx, (_, cand) in enumerate(candidates_map[depth][1]):
+            if cand in asgn:
+                continue
 
-    if len(ll_dtype) > 0 or len(o_ll_dtype) > 0:
-        score += len(ll_dtype & o_ll_dtype) / (len(ll_dtype | o_ll_dtype))
+            new_total = total + exact_scores[depth][cand_idx]
+            heapq.heappush(heap, (-(new_total + best_remaining[depth + 1]), indices + (cand_idx,), new_total,
+                                  {**asgn, cand: key}))
 
-    if has_null == o_has_null:
-        score += 0.1
 
-    return score
+def get_candidate_scores(query: Query, viz_function: Dict, req_cols_to_dfs: Dict[Any, List[str]],
+                         df_arg_to_index: Dict[str, int]) -> np.ndarray:
+    """
+    The matrix of compatibility scores between the requested columns (in the order of `req_cols_to_dfs`) and the
+    col args of `viz_function`, with the score of a column averaged over the df args it is requested for. Pairs
+    missing metadata for one of those df args get a score of 0. See `synthesis.col_compat` for the score of a pair.
+    :param query:
+    :param viz_function:
+    :param req_cols_to_dfs:
+    :param df_arg_to_index:
+    :return:
+    """
+    vocabulary, entry_rows, col_args_encoding = get_col_args_encoding(viz_function)
+    col_args = viz_function['col_args']
+    candidate_scores = np.zeros((len(req_cols_to_dfs), len(col_args)))
+    if len(entry_rows) == 0:
+        return candidate_scores
+
+    #  Scores of the requested columns of every df arg against every col arg, and whether metadata is available.
+    df_arg_scores = {}
+    for df_k in set(itertools.chain.from_iterable(req_cols_to_dfs.values())):
+        df_index = df_arg_to_index[df_k]
+        rows = [entry_rows.get((df_k, t_col), 0) for t_col in col_args]
+        available = np.array([(df_k, t_col) in entry_rows for t_col in col_args], dtype=bool)
+        scores = compute_compatibility_scores(query.get_col_encoding(df_index, vocabulary),
+                                              col_args_encoding.take(rows))
+        col_rows = {}
+        for row, col in enumerate(query.requested_cols[df_index]):
+            col_rows.setdefault(col, row)
+
+        df_arg_scores[df_k] = scores, col_rows, available
+
+    for q_idx, (q_col, df_keys) in enumerate(req_cols_to_dfs.items()):
+        score = 0
+        available = np.ones(len(col_args), dtype=bool)
+        for df_k in df_keys:
+            scores, col_rows, df_available = df_arg_scores[df_k]
+            score = score + scores[col_rows[q_col]]
+            available &= df_available
+
+        candidate_scores[q_idx] = np.where(available, score / len(df_keys), 0.0)
+
+    return candidate_scores
 
 
 def get_possible_column_assignments(query: Query, viz_function: Dict, df_index_to_arg: Dict[int, str]):
     df_arg_to_index = {v: k for k, v in df_index_to_arg.items()}
     implicit_cols = viz_function['col_analysis']['implicit_cols']
-    col_args_metadata = viz_function['col_analysis']['metadata_col_args']
 
     req_cols_to_dfs = collections.defaultdict(list)
     for df_index, cols in enumerate(query.requested_cols):
@@ -78,28 +134,18 @@ def get_possible_column_assignments(query: Query, viz_function: Dict, df_index_t
             yield 100.0, {}, False
             return
 
+        candidate_scores = get_candidate_scores(query, viz_function, req_cols_to_dfs, df_arg_to_index).tolist()
         candidates_map = collections.defaultdict(list)
-        for q_col, df_keys in req_cols_to_dfs.items():
-            for t_col in viz_function['col_args']:
-                if any((df_k, t_col) not in col_args_metadata for df_k in df_keys):
-                    continue
-
-                score = 0
-                for df_k in df_keys:
-                    orig_metadata = col_args_metadata[(df_k, t_col)]
-                    df_metadata = query.get_df_metadata(df_arg_to_index[df_k])
-                    score += get_col_compatibility_score(q_col, df_metadata, orig_metadata)
-
-                score /= len(df_keys)
+        for q_col, q_scores in zip(req_cols_to_dfs, candidate_scores):
+            for t_col, score in zip(viz_function['col_args'], q_scores):
                 if score > 0:
                     candidates_map[q_col].append((score, t_col))
 
             if len(candidates_map[q_col]) == 0:
                 return
 
-        #  Return all possible assignments in descending order of score, with ties broken in random order.
-        asgns = sorted(_get_valid_assignments(list(candidates_map.items())), key=lambda x: -x[0])
-        for score, asgn in asgns:
+        #  Return all possible assignments in descending order of score, generated lazily.
+        for score, asgn in iter_best_assignments(list(candidates_map.items())):
             yield score, asgn, False
     else:
         if len(viz_function['col_args']) > len(set(sum(query.requested_cols, []))):
@@ -128,28 +174,18 @@ def get_possible_column_assignments(query: Query, viz_function: Dict, df_index_t
                     forced_args.add(req_col)
 
         #  Decide what to put in the col args
+        candidate_scores = get_candidate_scores(query, viz_function, req_cols_to_dfs, df_arg_to_index).T.tolist()
         candidates_map = collections.defaultdict(list)
-        for t_col in viz_function['col_args']:
-            for q_col, df_keys in req_cols_to_dfs.items():
-                if any((df_k, t_col) not in col_args_metadata for df_k in df_keys):
-                    continue
-
-                score = 0
-                for df_k in df_keys:
-                    orig_metadata = col_args_metadata[(df_k, t_col)]
-                    df_metadata = query.get_df_metadata(df_arg_to_index[df_k])
-                    score += get_col_compatibility_score(q_col, df_metadata, orig_metadata)
-
-                score /= len(df_keys)
+        for t_col, t_scores in zip(viz_function['col_args'], candidate_scores):
+            for q_col, score in zip(req_cols_to_dfs, t_scores):
                 if score > 0:
                     candidates_map[t_col].append((score, q_col))
 
             if len(candidates_map[t_col]) == 0:
                 return
 
-        #  Return all possible assignments in descending order of score, with ties broken in random order.
-        asgns = sorted(_get_valid_assignments(list(candidates_map.items())), key=lambda x: -x[0])
-        for score, asgn in asgns:
+        #  Return all possible assignments in descending order of score, generated lazily.
+        for score, asgn in iter_best_assignments(list(candidates_map.items())):
             asgn = {v: k for k, v in asgn.items()}
             values = set(asgn.values())
             if not forced_args.issubset(values):
@@ -163,11 +199,38 @@ def get_possible_column_assignments(query: Query, viz_function: Dict, df_index_t
         # print(viz_function['key'])
 
 
+def _iter_viz_function_candidates(query: Query, viz_function: Dict, df_index_to_arg: Dict[int, str]):
+    code_length = len(viz_function['code'])
+    for score, col_asgn, take_subset in get_possible_column_assignments(query, viz_function, df_index_to_arg):
+        yield (-score, code_length), viz_function, df_index_to_arg, col_asgn, take_subset
+
+
+def iter_candidates(query: Query, viz_functions: List[Dict]) -> Iterator[Tuple]:
+    """
+    Lazily generate the (df, col) assignments of `viz_functions` for `query` in increasing order of
+    (-score, length of code), with ties in the order of `viz_functions`, df permutations and column assignments.
+    The assignments of each viz_function and df permutation already come out in descending order of score, so they
+    are merged with a heap instead of being collected and sorted, and only as many are generated as are consumed.
+    :param query:
+    :param viz_functions:
+    :return: An iterator over (sort key, viz_function, df_index_to_arg, col_asgn, take_subset) tuples
+    """
+    streams = []
+    for viz_function in viz_functions:
+        for df_asgn in itertools.permutations(list(viz_function['df_args'].keys())):
+            df_index_to_arg = dict(zip(list(range(len(query.provided_dfs))), df_asgn))
+            streams.append(_iter_viz_function_candidates(query, viz_function, df_index_to_arg))
+
+    #  heapq.merge is stable, so ties are broken exactly as a stable sort of all the candidates would.
+    return heapq.merge(*streams, key=lambda x: x[0])
+
+
 @attr.s(cmp=False, repr=False)
 class ColAnalysisInstantiator(BaseInstantiator):
     """
     Uses column-level analysis to better instantiate viz_functions
     """
+    USES_DF_METADATA = True
 
     @staticmethod
     def instantiate(query: Query,
@@ -182,32 +245,34 @@ class ColAnalysisInstantiator(BaseInstantiator):
 
         stats['num_failures'] = 0
         stats['num_successes'] = 0
+        stats['num_screened_out'] = 0
 
         start_time = time.time()
 
-        #  Get the best scoring df and col assignments, with ties broken by length of code in viz_function.
-        candidates = []
-        for viz_function in viz_functions:
-            for df_asgn in itertools.permutations(list(viz_function['df_args'].keys())):
-                df_index_to_arg = dict(zip(list(range(len(query.provided_dfs))), df_asgn))
-                df_arg_to_index = {v: k for k, v in df_index_to_arg.items()}
-                for score, col_asgn, take_subset in get_possible_column_assignments(query, viz_function, df_index_to_arg):
-                    if take_subset:
-                        provided_dfs = [df[query.requested_cols[idx]] for idx, df in enumerate(query.provided_dfs)]
-                    else:
-                        provided_dfs = query.provided_dfs
+        #  Go over the best scoring df and col assignments first, with ties broken by length of code in viz_function.
+        #  Candidates are generated lazily, so the number of viz_functions does not delay the first render.
+        stats['num_candidates'] = 0
+        for _, viz_function, df_index_to_arg, col_args_mapping, take_subset in iter_candidates(query, viz_functions):
+            if timeout is not None and time.time() - start_time > timeout:
+                break
 
-                    args = {
-                        **{v: provided_dfs[k] for k, v in df_index_to_arg.items()},
-                        **col_asgn,
-                    }
-                    candidates.append(([-score, len(viz_function['code'])], viz_function, args, df_arg_to_index, col_asgn))
+            stats['num_candidates'] += 1
+            df_args_mapping = {v: k for k, v in df_index_to_arg.items()}
 
-        stats['num_candidates'] = len(candidates)
+            #  Skip candidates that would certainly fail without spawning a render process for them.
+            args = {
+                **{v: query.provided_dfs[k] for k, v in df_index_to_arg.items()},
+                **col_args_mapping,
+            }
+            if check_static_profile(get_static_profile(viz_function), args) is not None:
+                stats['num_screened_out'] += 1
+                continue
 
-        for _, viz_function, args, df_args_mapping, col_args_mapping in sorted(candidates, key=lambda x: x[0]):
-            if timeout is not None and time.time() - start_time > timeout:
-                break
+            #  Render processes get their own copy of the dataframes, or attach to them copy-on-write.
+            render_args = {
+                **{v: query.get_render_df(k, take_subset) for k, v in df_index_to_arg.items()},
+                **col_args_mapping,
+            }
 
             try:
                 #  We opt to return the png directly as pickling figure objects
@@ -215,7 +280,7 @@ class ColAnalysisInstantiator(BaseInstantiator):
                 if serializer is not None:
                     run_start = time.time()
                     result = run_viz_code_matplotlib_mp(viz_function['code'],
-                                                        deepcopy_args(args),
+                                                        render_args,
                                                         serializer=serializer,
                                                         timeout=per_run_timeout)
                     run_end = time.time()
@@ -235,7 +300,7 @@ class ColAnalysisInstantiator(BaseInstantiator):
                 else:
                     run_start = time.time()
                     fig = run_viz_code_matplotlib_mp(viz_function['code'],
-                                                     deepcopy_args(args),
+                                                     render_args,
                                                      timeout=per_run_timeout)
                     run_end = time.time()
 
@@ -0,0 +1,157 @@
+"""
+Bitmask encoding of column dtypes, for computing column-compatibility scores with vectorized bitwise operations.
+
+The high-level dtypes ('categorical/quantitative', ...) and low-level dtypes (sets of raw value types) of columns are
+encoded as bitmasks over a `DtypeVocabulary`, one bit per dtype. The vocabulary of the corpus is closed, so dtypes of
+query columns that are not in it can never match a column arg and are only counted, for the size of the union in the
+low-level dtype similarity.
+"""
+from typing import List, Dict, Any, Tuple, Iterable, Hashable
+
+import attr
+import numpy as np
+
+_WORD_BITS = 64
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+
+def get_low_level_dtype_key(dtype: Any) -> str:
+    """
+    A stable name for a low-level dtype (a type or a string such as 'array'), so the vocabulary can be stored
+    without pickling types.
+    :param dtype:
+    :return:
+    """
+    if isinstance(dtype, type):
+        return f"{dtype.__module__}.{dtype.__qualname__}"
+
+    return str(dtype)
+
+
+@attr.s(frozen=True, repr=False, cache_hash=True)
+class DtypeVocabulary:
+    """
+    The high-level dtype names and low-level dtype keys (see `get_low_level_dtype_key`) that get a bit.
+    Vocabularies with the same contents compare and hash equal, so encodings can be memoized per vocabulary.
+    """
+    high_level: Tuple[str, ...] = attr.ib(converter=tuple)
+    low_level: Tuple[str, ...] = attr.ib(converter=tuple)
+
+    _hl_bits: Dict[str, int] = attr.ib(init=False, cmp=False)
+    _ll_bits: Dict[str, int] = attr.ib(init=False, cmp=False)
+
+    @_hl_bits.default
+    def _init_hl_bits(self):
+        return {name: bit for bit, name in enumerate(self.high_level)}
+
+    @_ll_bits.default
+    def _init_ll_bits(self):
+        return {key: bit for bit, key in enumerate(self.low_level)}
+
+    @classmethod
+    def from_col_args_metadata(cls, metadata_col_args_list: Iterable[Dict]) -> 'DtypeVocabulary':
+        high_level: Dict[str, None] = {}
+        low_level: Dict[str, None] = {}
+        for metadata_col_args in metadata_col_args_list:
+            for orig_metadata in metadata_col_args.values():
+                high_level.update(dict.fromkeys(orig_metadata['high_level_dtype'].split('/')))
+                low_level.update(dict.fromkeys(map(get_low_level_dtype_key, orig_metadata['low_level_dtype'])))
+
+        return cls(high_level, low_level)
+
+    @property
+    def num_hl_words(self) -> int:
+        return max(1, -(-len(self.high_level) // _WORD_BITS))
+
+    @property
+    def num_ll_words(self) -> int:
+        return max(1, -(-len(self.low_level) // _WORD_BITS))
+
+
+@attr.s(cmp=False, repr=False)
+class EncodedColumns:
+    """
+    The dtypes of a list of columns (or column args) encoded over a `DtypeVocabulary`, one row per column.
+    """
+    #  (num_columns, vocabulary.num_hl_words) bitmasks of the high-level dtypes.
+    high_level: np.ndarray = attr.ib()
+    #  (num_columns, vocabulary.num_ll_words) bitmasks of the low-level dtypes.
+    low_level: np.ndarray = attr.ib()
+    #  Number of low-level dtypes of each column, including the ones not in the vocabulary.
+    num_low_level: np.ndarray = attr.ib()
+    has_null: np.ndarray = attr.ib()
+
+    def __len__(self):
+        return len(self.has_null)
+
+    def take(self, rows) -> 'EncodedColumns':
+        return EncodedColumns(self.high_level[rows], self.low_level[rows], self.num_low_level[rows],
+                              self.has_null[rows])
+
+
+def _set_bits(masks: np.ndarray, row: int, bits: Iterable[int]):
+    for bit in bits:
+        masks[row, bit // _WORD_BITS] |= np.uint64(1) << np.uint64(bit % _WORD_BITS)
+
+
+def encode_columns(columns: List[Tuple[str, Any, bool]], vocabulary: DtypeVocabulary) -> EncodedColumns:
+    """
+    Encode columns given as (high-level dtype, low-level dtypes, has null) triples.
+    :param columns:
+    :param vocabulary:
+    :return:
+    """
+    high_level = np.zeros((len(columns), vocabulary.num_hl_words), dtype=np.uint64)
+    low_level = np.zeros((len(columns), vocabulary.num_ll_words), dtype=np.uint64)
+    num_low_level = np.zeros(len(columns), dtype=np.int64)
+    has_null = np.zeros(len(columns), dtype=bool)
+    for row, (hl_dtype, ll_dtype, null) in enumerate(columns):
+        _set_bits(high_level, row, (vocabulary._hl_bits[name] for name in hl_dtype.split('/')
+                                    if name in vocabulary._hl_bits))
+        ll_keys = set(map(get_low_level_dtype_key, ll_dtype))
+        _set_bits(low_level, row, (vocabulary._ll_bits[key] for key in ll_keys if key in vocabulary._ll_bits))
+        num_low_level[row] = len(ll_keys)
+        has_null[row] = null
+
+    return EncodedColumns(high_level, low_level, num_low_level, has_null)
+
+
+def encode_df_columns(df_metadata: Dict, columns: List[Hashable], vocabulary: DtypeVocabulary) -> EncodedColumns:
+    return encode_columns([(df_metadata['high_level_data_types'][col],
+                            df_metadata['low_level_data_types'][col],
+                            df_metadata['has_null'][col]) for col in columns], vocabulary)
+
+
+def get_col_args_dtypes(metadata_col_args: Dict) -> List[Tuple[str, Any, bool]]:
+    """
+    The entries of the `metadata_col_args` of a viz_function as input to `encode_columns`, in the order of the
+    dictionary.
+    :param metadata_col_args:
+    :return:
+    """
+    return [(m['high_level_dtype'], m['low_level_dtype'], m['has_null']) for m in metadata_col_args.values()]
+
+
+def _popcount(masks: np.ndarray) -> np.ndarray:
+    masks = np.ascontiguousarray(masks)
+    return _POPCOUNT_TABLE[masks.view(np.uint8)].sum(axis=-1)
+
+
+def compute_compatibility_scores(columns: EncodedColumns, col_args: EncodedColumns) -> np.ndarray:
+    """
+    The (len(columns), len(col_args)) matrix of compatibility scores between columns and column args encoded over
+    the same vocabulary: 0 if the high-level dtypes are disjoint, and otherwise 1 plus the Jaccard similarity of the
+    low-level dtypes plus 0.1 if both or neither have nulls.
+    :param columns:
+    :param col_args:
+    :return:
+    """
+    hl_match = (columns.high_level[:, None, :] & col_args.high_level[None, :, :]).any(axis=-1)
+
+    intersection = _popcount(columns.low_level[:, None, :] & col_args.low_level[None, :, :])
+    #  Dtypes outside the vocabulary never intersect, so the union follows from the sizes of the sets.
+    union = columns.num_low_level[:, None] + col_args.num_low_level[None, :] - intersection
+    similarity = np.divide(intersection, union, out=np.zeros(union.shape), where=union > 0)
+
+    null_bonus = np.where(columns.has_null[:, None] == col_args.has_null[None, :], 0.1, 0.0)
+    return np.where(hl_match, (1.0 + similarity) + null_bonus, 0.0)
@@ -0,0 +1,310 @@
+"""
+Compact on-disk format for the viz_functions corpus.
+
+A corpus directory holds the fields needed at search time in compact arrays that are loaded eagerly (df/col
+arity, implicit-column capability, API names, column-arg dtype signatures, keys and the `reusable` flag), the
+column-arg metadata encoded as dtype bitmasks (see `synthesis.col_compat`), and everything else (`code`, `nl`,
+`col_analysis`, ...) as one pickled payload per viz_function in a memory-mapped blob. Payloads also hold the
+`static_profile` of the code of every viz_function (see `synthesis.static_profile`), computed during conversion.
+Payloads are only unpickled when a field that lives in them is accessed, which in practice means only for the
+viz_functions that make it to instantiation.
+
+Records are exposed as `VizFunctionRecord` objects which behave like the dictionaries the rest of the code base
+expects, so a `Corpus` can be used anywhere a list of viz_functions is accepted.
+"""
+import mmap
+import os
+import pickle
+import weakref
+from collections.abc import Mapping, Sequence
+from typing import List, Dict, Any, FrozenSet, Tuple
+
+import numpy as np
+
+from synthesis import index_store
+from synthesis.col_compat import DtypeVocabulary, EncodedColumns, encode_columns, get_col_args_dtypes
+from synthesis.static_profile import compute_static_profile
+
+CORPUS_FORMAT_VERSION = 4
+INDEX_KIND = 'corpus'
+
+#  Fields stored in the eager section of the corpus if every viz_function has them.
+_EAGER_FIELDS = ('key', 'reusable', 'api_names')
+#  Arrays of the `EncodedColumns` of the column-arg metadata entries of all viz_functions.
+_ENCODING_FIELDS = ('high_level', 'low_level', 'num_low_level', 'has_null')
+
+
+def get_col_arg_dtype_signature(viz_function: Dict) -> Tuple[FrozenSet[str], ...]:
+    """
+    The high-level dtypes accepted by each column arg of `viz_function`, in the order of `viz_function['col_args']`.
+    An empty frozenset means nothing is known about the arg.
+    :param viz_function:
+    :return:
+    """
+    col_analysis = viz_function.get('col_analysis') or {}
+    metadata_col_args = col_analysis.get('metadata_col_args') or {}
+    accepted = {t_col: set() for t_col in viz_function['col_args']}
+    for (df_key, t_col), orig_metadata in metadata_col_args.items():
+        if t_col in accepted:
+            accepted[t_col].update(orig_metadata['high_level_dtype'].split('/'))
+
+    return tuple(frozenset(accepted[t_col]) for t_col in viz_function['col_args'])
+
+
+def _get_metadata_col_args(viz_function: Dict) -> Dict:
+    return (viz_function.get('col_analysis') or {}).get('metadata_col_args') or {}
+
+
+def get_col_args_encoding(viz_function: Dict) -> Tuple[DtypeVocabulary, Dict[Tuple[str, str], int], EncodedColumns]:
+    """
+    The entries of the `metadata_col_args` of `viz_function` encoded as dtype bitmasks, along with the vocabulary
+    they are encoded over and the row of every (df arg, col arg) entry. Pre-encoded for viz_functions in a `Corpus`.
+    :param viz_function:
+    :return:
+    """
+    metadata_col_args = _get_metadata_col_args(viz_function)
+    entry_rows = {entry: row for row, entry in enumerate(metadata_col_args)}
+    if isinstance(viz_function, VizFunctionRecord):
+        corpus = viz_function.corpus
+        return corpus.dtype_vocabulary, entry_rows, corpus.get_col_args_encoding(viz_function.index)
+
+    vocabulary = DtypeVocabulary.from_col_args_metadata([metadata_col_args])
+    return vocabulary, entry_rows, encode_columns(get_col_args_dtypes(metadata_col_args), vocabulary)
+
+
+def get_num_df_args(viz_function: Dict) -> int:
+    if isinstance(viz_function, VizFunctionRecord):
+        return int(viz_function.corpus.df_arity[viz_function.index])
+
+    return len(viz_function['df_args'])
+
+
+def get_num_col_args(viz_function: Dict) -> int:
+    if isinstance(viz_function, VizFunctionRecord):
+        return int(viz_function.corpus.col_arity[viz_function.index])
+
+    return len(viz_function['col_args'])
+
+
+def write_corpus(viz_functions: List[Dict], path: str):
+    """
+    Write `viz_functions` to the (existing, empty) directory `path` in the compact corpus format.
+    :param viz_functions:
+    :param path:
+    :return:
+    """
+    eager_fields = [f for f in _EAGER_FIELDS if all(f in t for t in viz_functions)]
+
+    df_arity = np.array([len(t['df_args']) for t in viz_functions], dtype=np.uint8)
+    col_arity = np.array([len(t['col_args']) for t in viz_functions], dtype=np.uint8)
+    has_implicit_cols = np.array([len((t.get('col_analysis') or {}).get('implicit_cols') or {}) > 0
+                                  for t in viz_functions], dtype=bool)
+
+    #  API names and dtype signatures repeat a lot across the corpus, so store them as ids into a vocabulary.
+    api_vocab: Dict[str, int] = {}
+    api_indptr = [0]
+    api_ids = []
+    signature_vocab: Dict[Tuple, int] = {}
+    signature_ids = []
+    #  Column-arg metadata entries of all viz_functions, encoded over a single vocabulary.
+    dtype_vocabulary = DtypeVocabulary.from_col_args_metadata(_get_metadata_col_args(t) for t in viz_functions)
+    col_args_indptr = [0]
+    col_args_dtypes = []
+    for t in viz_functions:
+        col_args_dtypes.extend(get_col_args_dtypes(_get_metadata_col_args(t)))
+        col_args_indptr.append(len(col_args_dtypes))
+
+        if 'api_names' in eager_fields:
+            api_ids.extend(api_vocab.setdefault(a_name, len(api_vocab)) for a_name in t['api_names'])
+            api_indptr.append(len(api_ids))
+
+        signature = get_col_arg_dtype_signature(t)
+        signature_ids.append(signature_vocab.setdefault(signature, len(signature_vocab)))
+
+    meta = {
+        'version': CORPUS_FORMAT_VERSION,
+        'length': len(viz_functions),
+        'eager_fields': eager_fields,
+        'keys': [t['key'] for t in viz_functions] if 'key' in eager_fields else None,
+        'api_vocab': list(api_vocab),
+        'signature_vocab': list(signature_vocab),
+        'dtype_vocabulary': (dtype_vocabulary.high_level, dtype_vocabulary.low_level),
+    }
+
+    with open(os.path.join(path, 'meta.pkl'), 'wb') as f:
+        pickle.dump(meta, f)
+
+    np.save(os.path.join(path, 'df_arity.npy'), df_arity)
+    np.save(os.path.join(path, 'col_arity.npy'), col_arity)
+    np.save(os.path.join(path, 'has_implicit_cols.npy'), has_implicit_cols)
+    np.save(os.path.join(path, 'api_indptr.npy'), np.array(api_indptr, dtype=np.int64))
+    np.save(os.path.join(path, 'api_ids.npy'), np.array(api_ids, dtype=np.int32))
+    np.save(os.path.join(path, 'signature_ids.npy'), np.array(signature_ids, dtype=np.int32))
+    np.save(os.path.join(path, 'col_args_indptr.npy'), np.array(col_args_indptr, dtype=np.int64))
+    col_args_encoding = encode_columns(col_args_dtypes, dtype_vocabulary)
+    for field in _ENCODING_FIELDS:
+        np.save(os.path.join(path, f'col_args_{field}.npy'), getattr(col_args_encoding, field))
+
+    if 'reusable' in eager_fields:
+        np.save(os.path.join(path, 'reusable.npy'), np.array([bool(t['reusable']) for t in viz_functions]))
+
+    offsets = [0]
+    with open(os.path.join(path, 'payload.bin'), 'wb') as f:
+        for t in viz_functions:
+            payload = {k: v for k, v in t.items() if k not in eager_fields}
+            if 'static_profile' not in payload:
+                payload['static_profile'] = compute_static_profile(t['code'])
+
+            offsets.append(offsets[-1] + f.write(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    np.save(os.path.join(path, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+
+
+def load_corpus(path: str) -> 'Corpus':
+    return Corpus(path)
+
+
+def open_or_convert(path_viz_functions: str, corpus_hash: str) -> 'Corpus':
+    """
+    Load the compact version of the pickled corpus at `path_viz_functions`, converting it the first time it is seen.
+    :param path_viz_functions:
+    :param corpus_hash:
+    :return:
+    """
+    def convert(dirname: str):
+        with open(path_viz_functions, 'rb') as f:
+            write_corpus(pickle.load(f), dirname)
+
+    return load_corpus(index_store.open_or_build(INDEX_KIND, CORPUS_FORMAT_VERSION, corpus_hash, convert))
+
+
+class Corpus(Sequence):
+    def __init__(self, path: str):
+        with open(os.path.join(path, 'meta.pkl'), 'rb') as f:
+            meta = pickle.load(f)
+
+        if meta['version'] != CORPUS_FORMAT_VERSION:
+            raise ValueError(f"Corpus at {path} has format version {meta['version']}, "
+                             f"expected {CORPUS_FORMAT_VERSION}.")
+
+        self.path = path
+        self.eager_fields = frozenset(meta['eager_fields'])
+        self.keys = meta['keys']
+        self.api_vocab: List[str] = meta['api_vocab']
+        self.signature_vocab: List[Tuple[FrozenSet[str], ...]] = meta['signature_vocab']
+        self.dtype_vocabulary = DtypeVocabulary(*meta['dtype_vocabulary'])
+
+        self.df_arity = np.load(os.path.join(path, 'df_arity.npy'))
+        self.col_arity = np.load(os.path.join(path, 'col_arity.npy'))
+        self.has_implicit_cols = np.load(os.path.join(path, 'has_implicit_cols.npy'))
+        self.api_indptr = np.load(os.path.join(path, 'api_indptr.npy'))
+        self.api_ids = np.load(os.path.join(path, 'api_ids.npy'))
+        self.signature_ids = np.load(os.path.join(path, 'signature_ids.npy'))
+        self.col_args_indptr = np.load(os.path.join(path, 'col_args_indptr.npy'))
+        self.col_args_encoding = EncodedColumns(
+            *(np.load(os.path.join(path, f'col_args_{field}.npy'))
+              for field in _ENCODING_FIELDS))
+        self.reusable = np.load(os.path.join(path, 'reusable.npy')) if 'reusable' in self.eager_fields else None
+        self._offsets = np.load(os.path.join(path, 'offsets.npy'))
+
+        self._length = meta['length']
+        with open(os.path.join(path, 'payload.bin'), 'rb') as f:
+            #  mmap does not support empty files.
+            self._payload = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets[-1] > 0 else b''
+
+        #  Hand out the same record object for an index while it is alive, so identity-based de-duplication
+        #  of search results keeps working.
+        self._records = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Corpus index out of range")
+
+        record = self._records.get(index)
+        if record is None:
+            record = VizFunctionRecord(self, index)
+            self._records[index] = record
+
+        return record
+
+    def get_api_names(self, index: int) -> List[str]:
+        ids = self.api_ids[self.api_indptr[index]:self.api_indptr[index + 1]]
+        return [self.api_vocab[i] for i in ids]
+
+    def get_col_arg_dtype_signature(self, index: int) -> Tuple[FrozenSet[str], ...]:
+        return self.signature_vocab[self.signature_ids[index]]
+
+    def get_col_args_encoding(self, index: int) -> EncodedColumns:
+        return self.col_args_encoding.take(slice(self.col_args_indptr[index], self.col_args_indptr[index + 1]))
+
+    def get_eager_field(self, index: int, field: str) -> Any:
+        if field == 'key':
+            return self.keys[index]
+        elif field == 'reusable':
+            return bool(self.reusable[index])
+        elif field == 'api_names':
+            return self.get_api_names(index)
+
+        raise KeyError(field)
+
+    def load_payload(self, index: int) -> Dict:
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return pickle.loads(self._payload[start:end])
+
+
+class VizFunctionRecord(Mapping):
+    """
+    A read-only, dictionary-like view of a single viz_function in a `Corpus`. Fields outside the eager section are
+    loaded from the payload blob on first access. Pickling a record produces a plain dictionary, so records can be
+    sent to worker processes that have no access to the corpus.
+    """
+
+    __slots__ = ('corpus', 'index', '_payload', '__weakref__')
+
+    def __init__(self, corpus: Corpus, index: int):
+        self.corpus = corpus
+        self.index = index
+        self._payload = None
+
+    def _get_payload(self) -> Dict:
+        if self._payload is None:
+            self._payload = self.corpus.load_payload(self.index)
+
+        return self._payload
+
+    def __getitem__(self, field: str):
+        if field in self.corpus.eager_fields:
+            return self.corpus.get_eager_field(self.index, field)
+
+        return self._get_payload()[field]
+
+    def __contains__(self, field):
+        return field in self.corpus.eager_fields or field in self._get_payload()
+
+    def __iter__(self):
+        yield from self.corpus.eager_fields
+        yield from self._get_payload()
+
+    def __len__(self):
+        return len(self.corpus.eager_fields) + len(self._get_payload())
+
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
+
+    def __reduce__(self):
+        return dict, (dict(self.items()),)
+
+    def __repr__(self):
+        return f"VizFunctionRecord(index={self.index})"
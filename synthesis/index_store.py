@@ -0,0 +1,120 @@
+"""
+Versioned on-disk store for the search indexes built over the viz_functions corpus.
+
+Indexes live under `common.CACHE_DIR/indexes` in directories named after the kind of index, its version and the
+hash of the corpus they were built from. A directory is only ever published once it is complete, so searchers can
+open an existing one read-only and only pay the cost of building it the first time a corpus is seen.
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from typing import Callable, List, Dict, Any
+
+import common
+
+INDEX_STORE_DIR = f"{common.CACHE_DIR}/indexes"
+_COMPLETE_MARKER = "COMPLETE"
+_FILE_HASHES_PATH = f"{common.CACHE_DIR}/file_hashes.json"
+
+
+def compute_corpus_hash(viz_functions: List[Dict]) -> str:
+    """
+    Hash an in-memory corpus. Prefer `compute_file_hash` when the corpus was loaded from disk as it avoids
+    re-serializing the whole corpus.
+    :param viz_functions:
+    :return:
+    """
+    return hashlib.sha256(pickle.dumps(viz_functions)).hexdigest()
+
+
+def compute_file_hash(path: str) -> str:
+    """
+    Hash the contents of the file at `path`. The digest is remembered alongside the size and modification time of
+    the file so that unchanged files are not re-read on every startup.
+    :param path:
+    :return:
+    """
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+
+    known = _read_file_hashes()
+    if path in known and known[path]['stamp'] == stamp:
+        return known[path]['hash']
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+
+    digest = sha.hexdigest()
+    known[path] = {'stamp': stamp, 'hash': digest}
+    _write_file_hashes(known)
+    return digest
+
+
+def get_index_path(kind: str, version: int, corpus_hash: str) -> str:
+    return f"{INDEX_STORE_DIR}/{kind}-v{version}-{corpus_hash}"
+
+
+def is_index_complete(path: str) -> bool:
+    return os.path.exists(os.path.join(path, _COMPLETE_MARKER))
+
+
+def open_or_build(kind: str, version: int, corpus_hash: str, build_func: Callable[[str], Any]) -> str:
+    """
+    Return the path of the index identified by `kind`, `version` and `corpus_hash`, building it first with
+    `build_func` if it does not exist yet. `build_func` is called with an empty scratch directory which is moved
+    into place only after it returns, so concurrent kernels never observe a half-written index.
+    :param kind:
+    :param version:
+    :param corpus_hash:
+    :param build_func:
+    :return:
+    """
+    path = get_index_path(kind, version, corpus_hash)
+    if is_index_complete(path):
+        return path
+
+    os.makedirs(INDEX_STORE_DIR, exist_ok=True)
+    scratch_dir = tempfile.mkdtemp(prefix=f".{kind}-", dir=INDEX_STORE_DIR)
+    try:
+        build_func(scratch_dir)
+        with open(os.path.join(scratch_dir, _COMPLETE_MARKER), 'w') as f:
+            f.write(corpus_hash)
+
+        if os.path.exists(path) and not is_index_complete(path):
+            #  Left behind by an interrupted build from an older version of this code.
+            shutil.rmtree(path, ignore_errors=True)
+
+        try:
+            os.rename(scratch_dir, path)
+        except OSError:
+            #  Another process published the same index in the meantime.
+            if not is_index_complete(path):
+                raise
+
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return path
+
+
+def _read_file_hashes() -> Dict:
+    try:
+        with open(_FILE_HASHES_PATH, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_file_hashes(known: Dict):
+    os.makedirs(common.CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=common.CACHE_DIR, suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(known, f)
+
+    os.replace(tmp_path, _FILE_HASHES_PATH)
@@ -1,8 +1,10 @@
 import attr
 import pandas as pd
-from typing import List, Any, Optional
+from typing import List, Any, Optional, Union
 
-from utilities.df_utils import compute_df_metadata
+from synthesis.col_compat import DtypeVocabulary, EncodedColumns, encode_df_columns
+from utilities.df_utils import get_cached_df_metadata, SamplingConfig
+from utilities.shm_utils import SharedDataFrame
 
 
 @attr.s(cmp=False, repr=False)
@@ -10,12 +12,65 @@ class Query:
     query_str: str = attr.ib()
     provided_dfs: List[pd.DataFrame] = attr.ib()
     requested_cols: List[List] = attr.ib()
+    #  Large dataframes are profiled on a bounded sample. Set to None to always profile the full dataframes.
+    sampling: Optional[SamplingConfig] = attr.ib(factory=SamplingConfig)
+    #  Columns with more profiled rows than this have their distinct values counted approximately.
+    approximate_cardinality_above: Optional[int] = attr.ib(default=None)
+    #  Keep metadata up to date with rows appended to the dataframes between queries instead of recomputing it.
+    #  Profiles all rows, ignoring the sampling and approximation options.
+    incremental_metadata: bool = attr.ib(default=False)
+    #  Handles to `provided_dfs` published in shared memory, sent to render processes instead of the dataframes.
+    shared_dfs: Optional[List[SharedDataFrame]] = attr.ib(default=None)
 
     _df_metadata = attr.ib(init=False, factory=dict)
+    _col_encodings = attr.ib(init=False, factory=dict)
+    _render_dfs = attr.ib(init=False, factory=dict)
 
     def get_df_metadata(self, index: int):
         if index not in self._df_metadata:
-            self._df_metadata[index] = compute_df_metadata(self.provided_dfs[index])
+            #  Metadata is shared across queries over the same dataframe contents.
+            self._df_metadata[index] = get_cached_df_metadata(
+                self.provided_dfs[index],
+                sampling=self.sampling,
+                approximate_cardinality_above=self.approximate_cardinality_above,
+                incremental=self.incremental_metadata)
+            #  Profile the requested columns together, in parallel if there are many of them.
+            self._df_metadata[index].compute_columns(self.requested_cols[index])
 
         return self._df_metadata[index]
 
+    def get_col_encoding(self, index: int, vocabulary: DtypeVocabulary) -> EncodedColumns:
+        """
+        The dtypes of the requested columns of the dataframe at `index`, in order, encoded over `vocabulary`.
+        :param index:
+        :param vocabulary:
+        :return:
+        """
+        key = (index, vocabulary)
+        if key not in self._col_encodings:
+            self._col_encodings[key] = encode_df_columns(self.get_df_metadata(index), self.requested_cols[index],
+                                                         vocabulary)
+
+        return self._col_encodings[key]
+
+    def get_render_df(self, index: int, take_subset: bool = False) -> Union[pd.DataFrame, SharedDataFrame]:
+        """
+        The dataframe at `index` to pass to viz code, restricted to the requested columns if `take_subset` is True.
+        A `SharedDataFrame` handle if `shared_dfs` is set. Either way, the code runs on a copy of the dataframe.
+        :param index:
+        :param take_subset:
+        :return:
+        """
+        key = (index, take_subset)
+        if key not in self._render_dfs:
+            df = self.provided_dfs[index] if self.shared_dfs is None else self.shared_dfs[index]
+            if take_subset:
+                columns = self.requested_cols[index]
+                if self.shared_dfs is None or not self.provided_dfs[index].columns.is_unique:
+                    df = self.provided_dfs[index][columns]
+                else:
+                    df = df.take_columns(columns)
+
+            self._render_dfs[key] = df
+
+        return self._render_dfs[key]
@@ -0,0 +1,338 @@
+"""
+Optional local search server holding a single set of searchers per host.
+
+Every kernel that searches in-process loads its own copy of the search indexes. When a server is started with
+
+    python -m synthesis.search_server
+
+kernels instead talk to it over a Unix-domain socket through `RemoteSearcher`, a thin client that only sends the
+query string and arities and receives the indices of the results in the corpus. The corpus itself is memory-mapped
+by the client (see `synthesis.corpus`), so its pages are shared with the server through the page cache.
+If no server is running, `connect` returns None and callers fall back to searching in-process.
+"""
+import argparse
+import hashlib
+import os
+import socket
+import tempfile
+import threading
+import warnings
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import List, Dict, Hashable, Optional, Callable, Tuple, Any
+
+import attr
+
+import common
+from synthesis import searchers
+from synthesis.base_searcher import BaseSearcher
+from synthesis.corpus import Corpus
+from synthesis.query import Query
+
+PROTOCOL_VERSION = 1
+ADDRESS_ENV_VAR = 'VIZSMITH_SEARCH_SERVER'
+
+#  Seconds to wait for the server to answer a request before giving up on it and searching in-process.
+DEFAULT_TIMEOUT = 30.0
+
+#  Unix-domain socket paths are limited to ~108 bytes on Linux.
+_MAX_SOCKET_PATH_LENGTH = 100
+
+
+def get_server_address() -> str:
+    """
+    The path of the socket the search server listens on. Can be overridden with the `VIZSMITH_SEARCH_SERVER`
+    environment variable.
+    :return:
+    """
+    if os.environ.get(ADDRESS_ENV_VAR):
+        return os.environ[ADDRESS_ENV_VAR]
+
+    address = f"{common.CACHE_DIR}/search-server.sock"
+    if len(address) > _MAX_SOCKET_PATH_LENGTH:
+        project_hash = hashlib.sha256(common.PROJECT_DIR.encode()).hexdigest()[:12]
+        address = os.path.join(tempfile.gettempdir(), f"vizsmith-search-{project_hash}.sock")
+
+    return address
+
+
+def _get_authkey_path(address: str) -> str:
+    return f"{address}.key"
+
+
+def _read_authkey(address: str) -> Optional[bytes]:
+    try:
+        with open(_get_authkey_path(address), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _write_authkey(address: str) -> bytes:
+    #  Only processes that can read the key file (i.e. the same user by default) can talk to the server.
+    authkey = os.urandom(32)
+    path = _get_authkey_path(address)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(authkey)
+
+    return authkey
+
+
+def _recv(conn: Connection, timeout: Optional[float]) -> Any:
+    if not conn.poll(timeout):
+        raise TimeoutError(f"No response within {timeout} seconds")
+
+    return conn.recv()
+
+
+@attr.s(cmp=False, repr=False)
+class SearchServer:
+    """
+    Serves search requests for `searcher_types` on the Unix-domain socket at `address`, one thread per client
+    connection. Searchers are wrapped in `CachedSearcher`s, so cached results are shared by all the clients.
+    """
+    searcher_types: List[str] = attr.ib()
+    address: str = attr.ib(factory=get_server_address)
+
+    _searchers: Dict[str, BaseSearcher] = attr.ib(init=False, factory=dict)
+    _locks: Dict[str, threading.Lock] = attr.ib(init=False, factory=dict)
+    _corpus_hash: str = attr.ib(init=False, default=None)
+    _listener: Listener = attr.ib(init=False, default=None)
+
+    def build_searchers(self):
+        _, self._corpus_hash = searchers.get_corpus()
+        for searcher_type in self.searcher_types:
+            if searcher_type not in self._searchers:
+                self._searchers[searcher_type] = searchers.create_searcher(searcher_type)
+                self._locks[searcher_type] = threading.Lock()
+
+    def serve_forever(self):
+        self.build_searchers()
+
+        if os.path.exists(self.address):
+            pinged = _ping(self.address)
+            if pinged is not None:
+                pinged[0].close()
+                raise RuntimeError(f"A search server is already listening on {self.address}")
+
+            #  Left behind by a server that did not shut down cleanly.
+            os.unlink(self.address)
+
+        os.makedirs(os.path.dirname(self.address), exist_ok=True)
+        authkey = _write_authkey(self.address)
+        self._listener = Listener(self.address, family='AF_UNIX', authkey=authkey)
+        print(f"Search server listening on {self.address}")
+        try:
+            while True:
+                try:
+                    conn = self._listener.accept()
+                except (OSError, EOFError, AuthenticationError):
+                    continue
+
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+        finally:
+            self.close()
+
+    def close(self):
+        if self._listener is not None:
+            #  Also removes the socket file.
+            self._listener.close()
+            self._listener = None
+            try:
+                os.unlink(_get_authkey_path(self.address))
+            except OSError:
+                pass
+
+    def handle_request(self, request: Tuple) -> Any:
+        command, *args = request
+        if command == 'hello':
+            return {
+                'protocol': PROTOCOL_VERSION,
+                'corpus_hash': self._corpus_hash,
+                'searcher_types': tuple(self._searchers),
+            }
+
+        elif command == 'search':
+            searcher_type, query_str, num_dfs, num_cols = args
+            if searcher_type not in self._searchers:
+                raise ValueError(f"Searcher type {searcher_type} is not served")
+
+            #  Searchers only look at the number of dataframes and columns, not their contents.
+            query = Query(query_str, [None] * num_dfs, [None] * num_cols)
+            with self._locks[searcher_type]:
+                results = self._searchers[searcher_type].search(query)
+
+            return [t.index for t in results]
+
+        raise ValueError(f"Unknown command {command}")
+
+    def _serve_connection(self, conn: Connection):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (OSError, EOFError):
+                    return
+
+                try:
+                    response = ('ok', self.handle_request(request))
+                except Exception as e:
+                    response = ('error', f"{type(e).__name__}: {e}")
+
+                try:
+                    conn.send(response)
+                except OSError:
+                    return
+
+
+class SearchServerError(RuntimeError):
+    """
+    A request failed on the search server.
+    """
+
+
+@attr.s(cmp=False, repr=False)
+class RemoteSearcher(BaseSearcher):
+    """
+    Client for a `SearchServer`. The connection is kept open across searches and re-established once if it breaks.
+    If the server goes away, fails to answer a search or does not answer it within `timeout` seconds, this and later
+    searches are answered by a searcher created in-process with `fallback_factory`.
+    """
+    searcher_type: str = attr.ib()
+    viz_functions: Corpus = attr.ib()
+    corpus_hash: str = attr.ib()
+    address: str = attr.ib()
+    authkey: bytes = attr.ib()
+    fallback_factory: Callable[[], BaseSearcher] = attr.ib()
+    timeout: Optional[float] = attr.ib(default=DEFAULT_TIMEOUT)
+
+    _conn: Optional[Connection] = attr.ib(default=None)
+    _fallback: Optional[BaseSearcher] = attr.ib(init=False, default=None)
+    _lock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
+
+    def search(self, query: Query) -> List[Dict]:
+        if self._fallback is None:
+            request = ('search', self.searcher_type, query.query_str,
+                       len(query.provided_dfs), len(query.requested_cols))
+            try:
+                indices = self._request(request)
+                return [self.viz_functions[i] for i in indices]
+            except (OSError, EOFError, AuthenticationError, SearchServerError) as e:
+                warnings.warn(f"Search server at {self.address} failed ({type(e).__name__}: {e}), "
+                              f"searching in-process instead.")
+                self._fallback = self.fallback_factory()
+
+        return self._fallback.search(query)
+
+    def get_index_version(self) -> Hashable:
+        return self.corpus_hash, self.searcher_type, id(self._fallback)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _request(self, request: Tuple) -> Any:
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+
+                    self._conn.send(request)
+                    status, payload = _recv(self._conn, self.timeout)
+                    break
+
+                except (OSError, EOFError) as e:
+                    if self._conn is not None:
+                        #  A late answer to a timed out request must not be read as the answer to the next one.
+                        self._conn.close()
+                        self._conn = None
+
+                    #  The server may have been restarted since the last request, so retry once on a new connection.
+                    #  A server that is stuck on a request is not retried.
+                    if attempt > 0 or isinstance(e, TimeoutError):
+                        raise
+
+        if status != 'ok':
+            raise SearchServerError(payload)
+
+        return payload
+
+
+def _ping(address: str, timeout: Optional[float] = DEFAULT_TIMEOUT) -> Optional[Tuple[Connection, Dict]]:
+    authkey = _read_authkey(address)
+    if authkey is None:
+        return None
+
+    conn = None
+    try:
+        conn = Client(address, family='AF_UNIX', authkey=authkey)
+        conn.send(('hello',))
+        status, info = _recv(conn, timeout)
+    except (OSError, EOFError, AuthenticationError):
+        if conn is not None:
+            conn.close()
+
+        return None
+
+    if status != 'ok' or info.get('protocol') != PROTOCOL_VERSION:
+        conn.close()
+        return None
+
+    return conn, info
+
+
+def connect(searcher_type: str, address: str = None,
+            timeout: Optional[float] = DEFAULT_TIMEOUT) -> Optional[RemoteSearcher]:
+    """
+    Connect to the search server for `searcher_type`. Returns None if no compatible server is running, in which case
+    the caller should search in-process.
+    :param searcher_type:
+    :param address: Defaults to `get_server_address()`
+    :param timeout: Seconds to wait for each answer of the server. None waits indefinitely.
+    :return:
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    address = address or get_server_address()
+    if not os.path.exists(address):
+        return None
+
+    pinged = _ping(address, timeout)
+    if pinged is None:
+        return None
+
+    conn, info = pinged
+    viz_functions, corpus_hash = searchers.get_corpus()
+    #  Results are sent as indices into the corpus, so both sides must agree on it.
+    if info['corpus_hash'] != corpus_hash or searcher_type not in info['searcher_types']:
+        conn.close()
+        return None
+
+    return RemoteSearcher(searcher_type, viz_functions, corpus_hash, address, _read_authkey(address),
+                          fallback_factory=lambda: searchers.create_searcher(searcher_type),
+                          timeout=timeout, conn=conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve viz_function searches to all the kernels on this host.")
+    parser.add_argument('--searcher-types', nargs='+', choices=searchers.SEARCHER_TYPES,
+                        default=list(searchers.SEARCHER_TYPES))
+    parser.add_argument('--address', default=None,
+                        help=f"Socket path. Defaults to ${ADDRESS_ENV_VAR} or a path in the project cache directory.")
+    args = parser.parse_args()
+
+    server = SearchServer(args.searcher_types, address=args.address or get_server_address())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Construction of the searchers over the viz_functions corpus shipped with the project, shared by the in-process
+searchers of a kernel and the local search server.
+"""
+import os
+from typing import Optional, Tuple
+
+import common
+from synthesis import corpus, index_store
+from synthesis.base_searcher import BaseSearcher
+from synthesis.cached_searcher import CachedSearcher
+from synthesis.corpus import Corpus
+
+SEARCHER_TYPES = ('simple-code', 'nl', 'nl+code')
+
+_corpus: Optional[Tuple[Corpus, str]] = None
+
+
+def get_corpus() -> Tuple[Corpus, str]:
+    """
+    Load the viz_functions corpus in its compact format, along with the hash identifying it in the index store.
+    The corpus is shared by all the searchers created in this process.
+    """
+    global _corpus
+    if _corpus is not None:
+        return _corpus
+
+    path_viz_functions = f"{common.PROJECT_DIR}/visualization_functions.pkl"
+    if not os.path.exists(path_viz_functions):
+        raise FileNotFoundError(f"File {path_viz_functions} not found.")
+
+    #  Indexes are persisted in the index store keyed by this hash, so they are only built once per corpus.
+    corpus_hash = index_store.compute_file_hash(path_viz_functions)
+    _corpus = (corpus.open_or_convert(path_viz_functions, corpus_hash), corpus_hash)
+    return _corpus
+
+
+def create_searcher(searcher_type: str) -> BaseSearcher:
+    """
+    Build a new searcher of type `searcher_type` over the project corpus.
+    :param searcher_type: One of `SEARCHER_TYPES`
+    :return:
+    """
+    if searcher_type not in SEARCHER_TYPES:
+        raise ValueError(f"Arg `searcher_type` must be one of {SEARCHER_TYPES}")
+
+    viz_functions, corpus_hash = get_corpus()
+
+    if searcher_type == 'simple-code':
+        from synthesis.simple_code_searcher import SimpleCodeSearcher
+        searcher = SimpleCodeSearcher(viz_functions, corpus_hash=corpus_hash)
+    elif searcher_type == 'nl':
+        from synthesis.nl_searcher import NaturalLanguageSearcher
+        searcher = NaturalLanguageSearcher(viz_functions, corpus_hash=corpus_hash)
+    else:
+        from synthesis.simple_nl_plus_code_searcher import WhooshNLPlusCodeSearcher
+        searcher = WhooshNLPlusCodeSearcher(viz_functions, corpus_hash=corpus_hash)
+
+    #  Re-submitted queries are served from an LRU cache of search results.
+    return CachedSearcher(searcher)
@@ -1,14 +1,17 @@
 import atexit
 import shutil
 import tempfile
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Hashable
 
 import attr
 from whoosh.fields import TEXT, ID, Schema
-from whoosh.index import create_in
+from whoosh.index import create_in, open_dir
+from whoosh.query import Term
 from whoosh.qparser import QueryParser
 
+from synthesis import index_store
 from synthesis.base_searcher import BaseSearcher
+from synthesis.corpus import get_num_df_args
 from synthesis.query import Query
 
 
@@ -21,29 +24,44 @@ class SimpleCodeSearcher(BaseSearcher):
     2. 'df_args': A dictionary from strings corresponding to the dataframe args to their individual metadata, if any.
     3. 'col_args': A dictionary from strings corresponding to the column args to their individual metadata, if any.
     4. 'api_names': A collection of strings corresponding to the APIs used in the viz_function.
+
+    If `corpus_hash` is provided, the index is persisted in the index store and re-used by subsequent instances
+    built over the same corpus. Otherwise it is built in a temporary directory that is removed at exit.
     """
+    INDEX_KIND = 'simple-code'
+    INDEX_VERSION = 2
 
     viz_functions: List[Dict] = attr.ib()
+    corpus_hash: Optional[str] = attr.ib(default=None)
 
     _ix = attr.ib(init=False)
-    _temp_dir = attr.ib(init=False)
+    _temp_dir = attr.ib(init=False, default=None)
 
     def __attrs_post_init__(self):
-        self._temp_dir = tempfile.mkdtemp()
         self.build_index()
 
-        atexit.register(SimpleCodeSearcher._cleanup, self._temp_dir)
-
     def build_index(self):
-        schema = Schema(identifier=ID(stored=True), content=TEXT(stored=True))
-        ix = create_in(self._temp_dir, schema)
+        if self.corpus_hash is None:
+            self._temp_dir = tempfile.mkdtemp()
+            atexit.register(SimpleCodeSearcher._cleanup, self._temp_dir)
+            self._ix = self.create_index(self._temp_dir)
+        else:
+            path = index_store.open_or_build(self.INDEX_KIND, self.INDEX_VERSION, self.corpus_hash,
+                                             self.create_index)
+            self._ix = open_dir(path, readonly=True)
+
+    def create_index(self, dirname: str):
+        #  `df_arity` lets searches only score viz_functions taking as many dataframes as provided.
+        schema = Schema(identifier=ID(stored=True), content=TEXT(stored=True), df_arity=ID())
+        ix = create_in(dirname, schema)
         writer = ix.writer()
 
         for idx, viz_function in enumerate(self.viz_functions):
-            writer.add_document(identifier=str(idx), content=self.get_document_text(viz_function))
+            writer.add_document(identifier=str(idx), content=self.get_document_text(viz_function),
+                                df_arity=str(get_num_df_args(viz_function)))
 
         writer.commit()
-        self._ix = ix
+        return ix
 
     def get_document_text(self, viz_function):
         processed_api_names = []
@@ -55,26 +73,29 @@ class SimpleCodeSearcher(BaseSearcher):
 
         return " ".join(sorted(processed_api_names))
 
+    def parse_query(self, query_str: str):
+        return QueryParser("content", self._ix.schema).parse(query_str)
+
+    def get_query_key(self, query: Query) -> Hashable:
+        #  Results only depend on the parsed query and the number of dataframes.
+        return str(self.parse_query(query.query_str)), len(query.provided_dfs)
+
+    def get_index_version(self) -> Hashable:
+        return self.INDEX_KIND, self.INDEX_VERSION, self.corpus_hash or id(self)
+
     def search(self, query: Query):
         query_str = query.query_str
         num_dfs = len(query.provided_dfs)
 
         with self._ix.searcher() as searcher:
-            whoosh_query = QueryParser("content", self._ix.schema).parse(query_str)
-            results = searcher.search(whoosh_query, limit=None)
-            filtered = []
-            for r in results:
-                viz_function = self.viz_functions[int(r['identifier'])]
-                if num_dfs is not None and len(viz_function['df_args']) != num_dfs:
-                    continue
-
-                filtered.append(viz_function)
-
-            return filtered
+            whoosh_query = self.parse_query(query_str)
+            results = searcher.search(whoosh_query, limit=None, filter=Term('df_arity', str(num_dfs)))
+            return [self.viz_functions[int(r['identifier'])] for r in results]
 
     @staticmethod
     def _cleanup(path):
-        shutil.rmtree(path, ignore_errors=True)
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
 
     def __del__(self):
         self._cleanup(self._temp_dir)
@@ -6,7 +6,7 @@ import matplotlib.pyplot as plt
 
 from synthesis.base_instantiator import BaseInstantiator
 from synthesis.query import Query
-from synthesis.utils import deepcopy_args
+from synthesis.static_profile import get_static_profile, check_static_profile
 from utilities.matplotlib_utils import run_viz_code_matplotlib_mp, serialize_fig, run_viz_code_matplotlib
 
 
@@ -25,22 +25,29 @@ class SimpleInstantiator(BaseInstantiator):
             if len(col_args) != len(query.requested_cols):
                 continue
 
-            for df_asgn in itertools.permutations(list(query.provided_dfs)):
+            static_profile = get_static_profile(viz_function)
+
+            for df_asgn in itertools.permutations(range(len(query.provided_dfs))):
                 for col_asgn in itertools.permutations(query.requested_cols):
                     df_idxes = list(range(len(df_asgn)))
-                    df_m = dict(zip(df_args, df_asgn))
+                    df_m = {df_arg: query.provided_dfs[idx] for df_arg, idx in zip(df_args, df_asgn)}
+                    render_df_m = {df_arg: query.get_render_df(idx) for df_arg, idx in zip(df_args, df_asgn)}
                     col_m = dict(zip(col_args, col_asgn))
 
                     #  Get the variable name mapping for the df arguments
                     df_args_mapping = dict(zip(df_args, df_idxes))
                     col_arg_mapping = col_m.copy()
 
+                    #  Skip assignments that would certainly fail without spawning a render process for them.
+                    if check_static_profile(static_profile, {**df_m, **col_m}) is not None:
+                        continue
+
                     try:
                         #  We opt to return the png directly as pickling figure objects
                         #  can be tricky with different ipykernel backends.
                         if serializer is not None:
                             result = run_viz_code_matplotlib_mp(viz_function['code'],
-                                                                deepcopy_args({**df_m, **col_m}),
+                                                                {**render_df_m, **col_m},
                                                                 serializer=serializer)
 
                             if result is not None:
@@ -52,7 +59,7 @@ class SimpleInstantiator(BaseInstantiator):
                                 }
                         else:
                             fig = run_viz_code_matplotlib_mp(viz_function['code'],
-                                                             deepcopy_args({**df_m, **col_m}))
+                                                             {**render_df_m, **col_m})
                             if fig is not None:
                                 yield {
                                     'fig': fig,
@@ -3,31 +3,22 @@ import itertools
 import shutil
 import tempfile
 import ast
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Hashable
 
 import attr
+import numpy as np
 import astunparse
 from whoosh.fields import TEXT, ID, Schema
-from whoosh.index import create_in
+from whoosh.index import create_in, open_dir
+from whoosh.query import Term
 from whoosh.qparser import QueryParser, OrGroup
 
+from synthesis import index_store, tfidf_index
+from synthesis.arity_index import ArityIndex
 from synthesis.base_searcher import BaseSearcher
+from synthesis.corpus import get_num_df_args
 from synthesis.query import Query
-import atexit
-import shutil
-import tempfile
-from typing import Dict, List
-
-import attr
-import gensim
-import tqdm
-from gensim import corpora
-from nltk import WordNetLemmatizer
-from nltk.tag import pos_tag
-from nltk.tokenize import word_tokenize
-
-from synthesis.base_searcher import BaseSearcher
-from synthesis.query import Query
+from synthesis.tfidf_index import TfIdfIndex
 
 
 @attr.s(cmp=False, repr=False)
@@ -39,37 +30,61 @@ class SimpleNLPlusCodeSearcher(BaseSearcher):
     2. 'df_args': A dictionary from strings corresponding to the dataframe args to their individual metadata, if any.
     3. 'col_args': A dictionary from strings corresponding to the column args to their individual metadata, if any.
     4. 'api_names': A collection of strings corresponding to the APIs used in the viz_function.
+
+    If `corpus_hash` is provided, the code index and the TF-IDF artifact are persisted in the index store and re-used
+    by subsequent instances built over the same corpus.
+    `num_index_processes` is the number of processes used to tokenize the corpus if the TF-IDF index has to be built.
+    `similarity_mode` selects the memory-mapped, sharded similarity matrix ('sharded') or an in-memory sparse one
+    ('sparse'). `top_k` and `score_threshold` bound the NL matches that are ranked for a query.
     """
+    CODE_INDEX_KIND = 'simple-nl-plus-code'
+    CODE_INDEX_VERSION = 2
+
     viz_functions: List[Dict] = attr.ib()
+    corpus_hash: Optional[str] = attr.ib(default=None)
+    num_index_processes: Optional[int] = attr.ib(default=None)
+    similarity_mode: str = attr.ib(default='sharded')
+    top_k: Optional[int] = attr.ib(default=None)
+    score_threshold: float = attr.ib(default=0.0)
 
-    _temp_dir = attr.ib(init=False)
+    _temp_dir = attr.ib(init=False, default=None)
     _ix = attr.ib(init=False)
     _nlp = attr.ib(init=False)
-    _dictionary = attr.ib(init=False)
-    _tf_idf = attr.ib(init=False)
-    _sim_matrix = attr.ib(init=False)
+    _tfidf_index: TfIdfIndex = attr.ib(init=False)
+    _arity_index: ArityIndex = attr.ib(init=False)
 
     def __attrs_post_init__(self):
-        self._temp_dir = tempfile.mkdtemp()
-        self.wnl = WordNetLemmatizer()
-        self.build_index()
+        if self.corpus_hash is None:
+            self._temp_dir = tempfile.mkdtemp()
+            atexit.register(SimpleNLPlusCodeSearcher._cleanup, self._temp_dir)
 
-        atexit.register(SimpleNLPlusCodeSearcher._cleanup, self._temp_dir)
+        #  Load the NLTK models in the background so that they are ready by the time the first query arrives.
+        tfidf_index.warm_up_nltk()
+        self.build_index()
 
     def build_index(self):
         self.build_index_tfidf()
         self.build_code_index()
 
     def build_code_index(self):
-        schema = Schema(identifier=ID(stored=True), content=TEXT(stored=True))
-        ix = create_in(self._temp_dir, schema)
+        if self.corpus_hash is None:
+            self._ix = self.create_code_index(self._temp_dir)
+        else:
+            path = index_store.open_or_build(self.CODE_INDEX_KIND, self.CODE_INDEX_VERSION, self.corpus_hash,
+                                             self.create_code_index)
+            self._ix = open_dir(path, readonly=True)
+
+    def create_code_index(self, dirname: str):
+        schema = Schema(identifier=ID(stored=True), content=TEXT(stored=True), df_arity=ID())
+        ix = create_in(dirname, schema)
         writer = ix.writer()
 
         for idx, viz_function in enumerate(self.viz_functions):
-            writer.add_document(identifier=str(idx), content=self.get_document_text(viz_function))
+            writer.add_document(identifier=str(idx), content=self.get_document_text(viz_function),
+                                df_arity=str(get_num_df_args(viz_function)))
 
         writer.commit()
-        self._ix = ix
+        return ix
 
     def get_document_text(self, viz_function):
         processed_api_names = []
@@ -82,39 +97,26 @@ class SimpleNLPlusCodeSearcher(BaseSearcher):
         return " ".join(sorted(processed_api_names))
 
     def build_index_tfidf(self):
-        nl_docs = [t['nl'] or '' for t in self.viz_functions]
-        tokenized_docs = [self.tokenize_doc(doc) for doc in tqdm.tqdm(nl_docs)]
-        dictionary = corpora.Dictionary(tokenized_docs)
-        corpus = [dictionary.doc2bow(tok_doc) for tok_doc in tokenized_docs]
-        tf_idf = gensim.models.TfidfModel(corpus)
-        sims = gensim.similarities.Similarity(f"{self._temp_dir}/",
-                                              tf_idf[corpus],
-                                              num_features=len(dictionary))
-
-        self._dictionary = dictionary
-        self._tf_idf = tf_idf
-        self._sim_matrix = sims
+        self._arity_index = ArityIndex.build(self.viz_functions)
+        self._tfidf_index = TfIdfIndex.open_or_build(lambda: [t['nl'] or '' for t in self.viz_functions],
+                                                     corpus_hash=self.corpus_hash,
+                                                     temp_dir=self._temp_dir,
+                                                     num_processes=self.num_index_processes,
+                                                     similarity_mode=self.similarity_mode)
 
     def tokenize_doc(self, doc: str):
-        words = word_tokenize(doc)
-        pos_tagged_words = pos_tag(words)
+        return tfidf_index.tokenize_doc(doc)
 
-        tokens = []
-        for word, tag in pos_tagged_words:
-            if word == ',' or word == '.':
-                continue
+    def parse_code_query(self, query_str: str):
+        return QueryParser("content", self._ix.schema).parse(query_str)
 
-            if tag.startswith("NN"):
-                tokens.append(self.wnl.lemmatize(word, pos='n'))
-            elif tag.startswith('VB'):
-                tokens.append(self.wnl.lemmatize(word, pos='v'))
-            elif tag.startswith('JJ'):
-                tokens.append(self.wnl.lemmatize(word, pos='a'))
-            else:
-                tokens.append(word)
+    def get_query_key(self, query: Query) -> Hashable:
+        return (tuple(self.tokenize_doc(query.query_str)), str(self.parse_code_query(query.query_str)),
+                len(query.provided_dfs), len(query.requested_cols))
 
-        tokens = [i.lower() for i in tokens]
-        return tokens
+    def get_index_version(self) -> Hashable:
+        return (self.CODE_INDEX_KIND, self.CODE_INDEX_VERSION, tfidf_index.INDEX_KIND, tfidf_index.INDEX_VERSION,
+                self.similarity_mode, self.top_k, self.score_threshold, self.corpus_hash or id(self))
 
     def search(self, query: Query):
         nl_results = self.search_nl(query)
@@ -134,40 +136,29 @@ class SimpleNLPlusCodeSearcher(BaseSearcher):
         num_dfs = len(query.provided_dfs)
         num_cols = len(query.requested_cols)
 
-        picked_viz_functions = self.search_tfidf(query_str)
-        return [t for t in picked_viz_functions
-                if len(t['df_args']) == num_dfs and len(t['col_args']) == num_cols]
+        #  Only score the viz_functions that take exactly as many dataframes and columns as provided.
+        rows = self._arity_index.get_candidates(num_dfs, num_cols)
+        return self.search_tfidf(query_str, rows=rows, rows_key=(num_dfs, num_cols))
 
-    def search_tfidf(self, query_str: str):
+    def search_tfidf(self, query_str: str, rows: Optional[np.ndarray] = None, rows_key: Optional[Hashable] = None):
         tokens = self.tokenize_doc(query_str)
-        query_bow = self._dictionary.doc2bow(tokens)
-        query_tf_idf = self._tf_idf[query_bow]
-        viz_function_idxes = self._sim_matrix[query_tf_idf]
-        scored_viz_functions = sorted(zip(viz_function_idxes, self.viz_functions),
-                                      key=lambda x: -x[0])
-
-        return [viz_function for score, viz_function in scored_viz_functions if score > 0]
+        viz_function_idxes = self._tfidf_index.search(tokens, top_k=self.top_k, score_threshold=self.score_threshold,
+                                                      rows=rows, rows_key=rows_key)
+        return [self.viz_functions[idx] for idx in viz_function_idxes]
 
     def search_code(self, query: Query):
         query_str = query.query_str
         num_dfs = len(query.provided_dfs)
 
         with self._ix.searcher() as searcher:
-            whoosh_query = QueryParser("content", self._ix.schema).parse(query_str)
-            results = searcher.search(whoosh_query, limit=None)
-            filtered = []
-            for r in results:
-                viz_function = self.viz_functions[int(r['identifier'])]
-                if num_dfs is not None and len(viz_function['df_args']) != num_dfs:
-                    continue
-
-                filtered.append(viz_function)
-
-            return filtered
+            whoosh_query = self.parse_code_query(query_str)
+            results = searcher.search(whoosh_query, limit=None, filter=Term('df_arity', str(num_dfs)))
+            return [self.viz_functions[int(r['identifier'])] for r in results]
 
     @staticmethod
     def _cleanup(path):
-        shutil.rmtree(path, ignore_errors=True)
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
 
     def __del__(self):
         self._cleanup(self._temp_dir)
@@ -182,55 +173,74 @@ class WhooshNLPlusCodeSearcher(BaseSearcher):
     2. 'df_args': A dictionary from strings corresponding to the dataframe args to their individual metadata, if any.
     3. 'col_args': A dictionary from strings corresponding to the column args to their individual metadata, if any.
     4. 'api_names': A collection of strings corresponding to the APIs used in the viz_function.
+    5. 'nl': The natural language associated with the viz_function.
+
+    If `corpus_hash` is provided, the index is persisted in the index store and re-used by subsequent instances
+    built over the same corpus. Otherwise it is built in a temporary directory that is removed at exit.
     """
+    INDEX_KIND = 'whoosh-nl-plus-code'
+    INDEX_VERSION = 2
+
     viz_functions: List[Dict] = attr.ib()
+    corpus_hash: Optional[str] = attr.ib(default=None)
 
-    _temp_dir = attr.ib(init=False)
+    _temp_dir = attr.ib(init=False, default=None)
     _ix = attr.ib(init=False)
 
     def __attrs_post_init__(self):
-        self._temp_dir = tempfile.mkdtemp()
         self.build_index()
 
-        atexit.register(WhooshNLPlusCodeSearcher._cleanup, self._temp_dir)
-
     def build_index(self):
-        schema = Schema(identifier=ID(stored=True), content=TEXT(stored=True))
-        ix = create_in(self._temp_dir, schema)
+        if self.corpus_hash is None:
+            self._temp_dir = tempfile.mkdtemp()
+            atexit.register(WhooshNLPlusCodeSearcher._cleanup, self._temp_dir)
+            self._ix = self.create_index(self._temp_dir)
+        else:
+            path = index_store.open_or_build(self.INDEX_KIND, self.INDEX_VERSION, self.corpus_hash,
+                                             self.create_index)
+            self._ix = open_dir(path, readonly=True)
+
+    def create_index(self, dirname: str):
+        schema = Schema(identifier=ID(stored=True), content=TEXT(stored=True), df_arity=ID())
+        ix = create_in(dirname, schema)
         writer = ix.writer()
 
         for idx, viz_function in enumerate(self.viz_functions):
-            writer.add_document(identifier=str(idx), content=self.get_document_text(viz_function))
+            writer.add_document(identifier=str(idx), content=self.get_document_text(viz_function),
+                                df_arity=str(get_num_df_args(viz_function)))
 
         writer.commit()
-        self._ix = ix
+        return ix
 
     def get_document_text(self, viz_function):
         processed_code = self._strip_code(viz_function['code'])
         nl = viz_function['nl']
         return "\n".join([processed_code, nl])
 
+    def parse_query(self, query_str: str):
+        og = OrGroup.factory(0.9)
+        return QueryParser("content", self._ix.schema, group=og).parse(query_str)
+
+    def get_query_key(self, query: Query) -> Hashable:
+        #  Results only depend on the parsed query and the number of dataframes.
+        return str(self.parse_query(query.query_str)), len(query.provided_dfs)
+
+    def get_index_version(self) -> Hashable:
+        return self.INDEX_KIND, self.INDEX_VERSION, self.corpus_hash or id(self)
+
     def search(self, query: Query):
         query_str = query.query_str
         num_dfs = len(query.provided_dfs)
 
         with self._ix.searcher() as searcher:
-            og = OrGroup.factory(0.9)
-            whoosh_query = QueryParser("content", self._ix.schema, group=og).parse(query_str)
-            results = searcher.search(whoosh_query, limit=None)
-            filtered = []
-            for r in results:
-                viz_function = self.viz_functions[int(r['identifier'])]
-                if num_dfs is not None and len(viz_function['df_args']) != num_dfs:
-                    continue
-
-                filtered.append(viz_function)
-
-            return filtered
+            whoosh_query = self.parse_query(query_str)
+            results = searcher.search(whoosh_query, limit=None, filter=Term('df_arity', str(num_dfs)))
+            return [self.viz_functions[int(r['identifier'])] for r in results]
 
     @staticmethod
     def _cleanup(path):
-        shutil.rmtree(path, ignore_errors=True)
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
 
     def __del__(self):
         self._cleanup(self._temp_dir)
@@ -0,0 +1,300 @@
+"""
+Static profiles of viz_function code, for rejecting candidates that cannot run before they reach a render process.
+
+A profile records what can be told about the code from its AST alone: the modules it requires, the parameters of the
+visualization function, and which pandas accessors (`.str`, `.dt`, `.cat`) it applies to the column args of the
+df args, as in `df[col].str.lower()`. Profiles are computed once when the corpus is converted (see
+`synthesis.corpus`) and stored with every viz_function. The checks are conservative: a candidate is only rejected if
+running it would certainly raise, e.g. when a required module is not installed or `.dt` is used on a numeric column.
+"""
+import ast
+import functools
+import importlib.util
+from typing import Dict, Any, Optional, List
+
+import pandas as pd
+
+#  Name of the function defined by viz_function code, see `utilities.matplotlib_utils.run_viz_code_matplotlib`.
+VIZ_FUNC_NAME = 'visualization'
+
+_ACCESSORS = ('str', 'dt', 'cat')
+#  Dataframe methods that modify the dataframe they are called on.
+_MUTATING_METHODS = ('insert', 'update', 'pop', '__setitem__')
+_OPTIONAL_IMPORT_ERRORS = {'ImportError', 'ModuleNotFoundError', 'Exception', 'BaseException'}
+
+
+def _get_subscript_name(node: ast.Subscript) -> Optional[str]:
+    index = node.slice.value if isinstance(node.slice, ast.Index) else node.slice
+    return index.id if isinstance(index, ast.Name) else None
+
+
+def _catches_import_errors(node: ast.Try) -> bool:
+    for handler in node.handlers:
+        if handler.type is None:
+            return True
+
+        types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+        if any(isinstance(t, ast.Name) and t.id in _OPTIONAL_IMPORT_ERRORS for t in types):
+            return True
+
+    return False
+
+
+def _collect_required_imports(node: ast.AST, imports: set):
+    #  Imports guarded by a try that handles import errors are optional.
+    if isinstance(node, ast.Try) and _catches_import_errors(node):
+        for child in node.handlers + node.orelse + node.finalbody:
+            _collect_required_imports(child, imports)
+        return
+
+    if isinstance(node, ast.Import):
+        imports.update(alias.name.split('.')[0] for alias in node.names)
+    elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+        imports.add(node.module.split('.')[0])
+
+    for child in ast.iter_child_nodes(node):
+        _collect_required_imports(child, imports)
+
+
+def _find_viz_function(tree: ast.Module, func_name: str) -> Optional[ast.FunctionDef]:
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == func_name:
+            return node
+
+    return None
+
+
+def _get_root_name(node: ast.AST) -> Optional[str]:
+    #  The variable at the root of `df.loc[...]`, `df[col].fillna`, ...
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _iter_store_targets(node: ast.AST):
+    if isinstance(node, ast.Assign):
+        targets = list(node.targets)
+    elif isinstance(node, (ast.AugAssign, ast.AnnAssign, ast.For, ast.AsyncFor)):
+        targets = [node.target]
+    elif isinstance(node, ast.Delete):
+        targets = list(node.targets)
+    elif isinstance(node, ast.comprehension):
+        targets = [node.target]
+    elif isinstance(node, (ast.With, ast.AsyncWith)):
+        targets = [item.optional_vars for item in node.items if item.optional_vars is not None]
+    else:
+        targets = []
+
+    while targets:
+        target = targets.pop()
+        if isinstance(target, (ast.Tuple, ast.List)):
+            targets.extend(target.elts)
+        elif isinstance(target, ast.Starred):
+            targets.append(target.value)
+        else:
+            yield target
+
+
+def _is_inplace_call(node: ast.Call) -> bool:
+    for keyword in node.keywords:
+        if keyword.arg == 'inplace':
+            return getattr(keyword.value, 'value', None) is not False
+        if keyword.arg is None:
+            #  **kwargs may hold inplace=True.
+            return True
+
+    return False
+
+
+def _collect_mutated_params(func: ast.FunctionDef, params: List[str]) -> set:
+    """
+    The parameters whose values the body of `func` may modify in place, e.g. with `df[col] = ...`,
+    `df.loc[...] += ...` or `df[col].fillna(0, inplace=True)`. Over-approximates.
+    :param func:
+    :param params:
+    :return:
+    """
+    #  Names bound to a parameter, as in `data = df`, modify the parameter too.
+    aliases = {param: param for param in params}
+    for node in ast.walk(func):
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Name) and node.value.id in params:
+            for target in _iter_store_targets(node):
+                if isinstance(target, ast.Name):
+                    aliases[target.id] = node.value.id
+
+    mutated = set()
+    for node in ast.walk(func):
+        for target in _iter_store_targets(node):
+            if isinstance(target, (ast.Subscript, ast.Attribute)) and _get_root_name(target) in aliases:
+                mutated.add(aliases[_get_root_name(target)])
+
+        if not isinstance(node, ast.Call):
+            continue
+
+        root = _get_root_name(node.func)
+        if _is_inplace_call(node):
+            if root in aliases:
+                mutated.add(aliases[root])
+            else:
+                #  Could be a view of any of the dataframes, such as `series = df[col]`.
+                mutated.update(params)
+        elif isinstance(node.func, ast.Attribute) and node.func.attr in _MUTATING_METHODS and root in aliases:
+            mutated.add(aliases[root])
+
+    return mutated
+
+
+def _collect_col_accessors(func: ast.FunctionDef, params: List[str]) -> List[Dict[str, Any]]:
+    #  Parameters that get re-bound in the body may no longer hold the dataframes or column names passed in, and
+    #  columns of dataframes modified in the body may no longer have the dtype they were passed in with.
+    reassigned = {node.id for node in ast.walk(func) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store)}
+    stable_params = set(params) - reassigned - _collect_mutated_params(func, params)
+
+    accessors = {}
+    for node in ast.walk(func):
+        if not (isinstance(node, ast.Attribute) and node.attr in _ACCESSORS and isinstance(node.value, ast.Subscript)):
+            continue
+
+        subscript = node.value
+        df_arg = subscript.value.id if isinstance(subscript.value, ast.Name) else None
+        col_arg = _get_subscript_name(subscript)
+        if df_arg in stable_params and col_arg in stable_params:
+            usage = accessors.setdefault((df_arg, col_arg), {'df_arg': df_arg, 'col_arg': col_arg, 'accessors': []})
+            if node.attr not in usage['accessors']:
+                usage['accessors'].append(node.attr)
+
+    return list(accessors.values())
+
+
+def compute_static_profile(code: str, func_name: str = VIZ_FUNC_NAME) -> Dict[str, Any]:
+    """
+    The static profile of viz_function `code`, as a dictionary with the entries
+    'parse_error': Whether the code could not be parsed,
+    'imports': The sorted top-level modules imported outside of try blocks handling import errors,
+    'params': The parameter names of the function `func_name`, or None if it is not defined by a top-level def,
+    'required_params': The parameters without defaults,
+    'accepts_kwargs': Whether the function takes **kwargs,
+    'col_accessors': A list of {'df_arg', 'col_arg', 'accessors'} dictionaries, for every df arg and col arg
+        parameter pair the code applies pandas accessors to.
+    :param code:
+    :param func_name:
+    :return:
+    """
+    profile = {
+        'parse_error': False,
+        'imports': [],
+        'params': None,
+        'required_params': [],
+        'accepts_kwargs': False,
+        'col_accessors': [],
+    }
+
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        profile['parse_error'] = True
+        return profile
+
+    imports = set()
+    _collect_required_imports(tree, imports)
+    profile['imports'] = sorted(imports)
+
+    func = _find_viz_function(tree, func_name)
+    if func is None:
+        return profile
+
+    args = func.args
+    positional = getattr(args, 'posonlyargs', []) + args.args
+    params = [a.arg for a in positional + args.kwonlyargs]
+    num_positional_required = len(positional) - len(args.defaults)
+    required = [a.arg for a in positional[:num_positional_required]]
+    required.extend(a.arg for a, default in zip(args.kwonlyargs, args.kw_defaults) if default is None)
+
+    profile['params'] = params
+    profile['required_params'] = required
+    profile['accepts_kwargs'] = args.kwarg is not None
+    profile['col_accessors'] = _collect_col_accessors(func, params)
+    return profile
+
+
+@functools.lru_cache(maxsize=1024)
+def _compute_static_profile_cached(code: str) -> Dict[str, Any]:
+    return compute_static_profile(code)
+
+
+def get_static_profile(viz_function: Dict) -> Dict[str, Any]:
+    """
+    The static profile of `viz_function`, computed from its code if it was not stored with it.
+    :param viz_function:
+    :return:
+    """
+    if 'static_profile' in viz_function:
+        return viz_function['static_profile']
+
+    return _compute_static_profile_cached(viz_function['code'])
+
+
+@functools.lru_cache(maxsize=None)
+def is_module_available(name: str) -> bool:
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _check_accessor(series: pd.Series, accessor: str) -> bool:
+    dtype = series.dtype
+    if accessor == 'str':
+        #  The .str accessor rejects numeric, boolean and datetime-like columns outright.
+        return dtype.kind not in 'biufcmM'
+    elif accessor == 'dt':
+        return (pd.api.types.is_datetime64_any_dtype(dtype) or pd.api.types.is_timedelta64_dtype(dtype)
+                or pd.api.types.is_period_dtype(dtype) or pd.api.types.is_categorical_dtype(dtype))
+    elif accessor == 'cat':
+        return pd.api.types.is_categorical_dtype(dtype)
+
+    return True
+
+
+def check_static_profile(profile: Dict[str, Any], args: Dict[str, Any]) -> Optional[str]:
+    """
+    Check whether the viz_function with static profile `profile` can possibly run when called with `args`.
+    :param profile:
+    :param args: The keyword arguments the visualization function would be called with
+    :return: The reason the call would certainly fail, or None if it may succeed
+    """
+    if profile['parse_error']:
+        return "code does not parse"
+
+    for module in profile['imports']:
+        if not is_module_available(module):
+            return f"module {module} is not installed"
+
+    if profile['params'] is not None:
+        if not profile['accepts_kwargs']:
+            unexpected = [k for k in args if k not in profile['params']]
+            if unexpected:
+                return f"unexpected arguments {unexpected}"
+
+        missing = [p for p in profile['required_params'] if p not in args]
+        if missing:
+            return f"missing arguments {missing}"
+
+    for usage in profile['col_accessors']:
+        df = args.get(usage['df_arg'])
+        col = args.get(usage['col_arg'])
+        if not isinstance(df, pd.DataFrame) or not df.columns.is_unique:
+            continue
+
+        try:
+            if col not in df.columns:
+                continue
+        except TypeError:
+            continue
+
+        for accessor in usage['accessors']:
+            if not _check_accessor(df[col], accessor):
+                return f"cannot use .{accessor} on column {col!r} of dtype {df[col].dtype}"
+
+    return None
@@ -0,0 +1,341 @@
+"""
+TF-IDF index over the natural language associated with viz_functions, shared by the NL-based searchers.
+
+The gensim dictionary, TF-IDF model and similarity matrix are saved together as a single artifact in the index
+store, keyed by the corpus hash and `TOKENIZER_VERSION`. Re-opening an artifact memory-maps the similarity shards
+instead of re-running NLTK over the whole corpus.
+
+The similarity matrix is either gensim's sharded, memory-mapped `Similarity` (`'sharded'`) or a single in-memory
+`SparseMatrixSimilarity` (`'sparse'`) for corpora that comfortably fit in RAM. The sharded artifact also holds the
+TF-IDF vectors of the documents as a memory-mapped sparse matrix, so that searches restricted to a subset of the
+documents only score that subset.
+"""
+import copy
+import functools
+import multiprocessing
+import os
+import threading
+from typing import List, Optional, Callable, Tuple, Hashable, Dict, Any
+
+import attr
+import gensim
+import numpy as np
+import scipy.sparse
+import tqdm
+from gensim import corpora
+from nltk import WordNetLemmatizer
+from nltk.tag import pos_tag, pos_tag_sents
+from nltk.tokenize import word_tokenize
+
+from synthesis import index_store
+
+#  Must be bumped whenever `tokenize_doc` changes in a way that affects the produced tokens.
+TOKENIZER_VERSION = 1
+INDEX_KIND = f'tfidf-tok{TOKENIZER_VERSION}'
+INDEX_VERSION = 2
+SIMILARITY_MODES = ('sharded', 'sparse')
+#  Arrays of the CSR matrix of document vectors saved with sharded artifacts.
+_CORPUS_MATRIX_ARRAYS = ('data', 'indices', 'indptr')
+
+#  Corpora smaller than this many chunks are tokenized in-process, as starting the pool would dominate.
+_MIN_CHUNKS_FOR_POOL = 4
+
+_wnl: Optional[WordNetLemmatizer] = None
+_warm_up_thread: Optional[threading.Thread] = None
+_warm_up_lock = threading.Lock()
+
+
+def _get_lemmatizer() -> WordNetLemmatizer:
+    global _wnl
+    if _wnl is None:
+        _wnl = WordNetLemmatizer()
+
+    return _wnl
+
+
+def warm_up_nltk() -> threading.Thread:
+    """
+    Load the NLTK tokenizer, tagger and WordNet data in a background thread, as the first call to `tokenize_doc`
+    otherwise pays for it. Tokenization waits for the warm-up to finish, as NLTK's lazy loaders are not thread-safe.
+    :return:
+    """
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=_warm_up, name='nltk-warm-up', daemon=True)
+            _warm_up_thread.start()
+
+    return _warm_up_thread
+
+
+def _warm_up():
+    try:
+        _tokenize_doc('Warming up the tokenizers and taggers')
+    except Exception:
+        #  Missing NLTK data is reported by the first actual call instead.
+        pass
+
+
+def _wait_for_warm_up():
+    thread = _warm_up_thread
+    if thread is not None and thread is not threading.current_thread():
+        thread.join()
+
+
+def tokenize_doc(doc: str) -> List[str]:
+    """
+    Tokenize and lemmatize `doc`. Results are memoized, as the same queries tend to be submitted repeatedly.
+    :param doc:
+    :return:
+    """
+    _wait_for_warm_up()
+    return list(_tokenize_doc(doc))
+
+
+@functools.lru_cache(maxsize=1024)
+def _tokenize_doc(doc: str) -> Tuple[str, ...]:
+    words = word_tokenize(doc)
+    pos_tagged_words = pos_tag(words)
+    return tuple(_lemmatize_tagged_words(pos_tagged_words))
+
+
+def tokenize_docs(docs: List[str], num_processes: Optional[int] = None, chunk_size: int = 256) -> List[List[str]]:
+    """
+    Tokenize `docs` exactly as `tokenize_doc` would, splitting them into chunks of `chunk_size` documents that are
+    tagged in a batch by a pool of `num_processes` processes (defaults to the number of CPUs).
+    :param docs:
+    :param num_processes:
+    :param chunk_size:
+    :return:
+    """
+    if num_processes is None:
+        num_processes = os.cpu_count() or 1
+
+    chunks = [docs[i: i + chunk_size] for i in range(0, len(docs), chunk_size)]
+    tokenized_docs = []
+    with tqdm.tqdm(total=len(docs)) as pbar:
+        if num_processes <= 1 or len(chunks) < _MIN_CHUNKS_FOR_POOL:
+            for chunk in chunks:
+                tokenized_docs.extend(_tokenize_chunk(chunk))
+                pbar.update(len(chunk))
+
+        else:
+            #  Spawn instead of fork as this typically runs inside a Jupyter kernel with live threads.
+            with multiprocessing.get_context('spawn').Pool(min(num_processes, len(chunks))) as pool:
+                #  imap preserves the order of the chunks, and hence of the documents.
+                for tokenized_chunk in pool.imap(_tokenize_chunk, chunks):
+                    tokenized_docs.extend(tokenized_chunk)
+                    pbar.update(len(tokenized_chunk))
+
+    return tokenized_docs
+
+
+def _tokenize_chunk(docs: List[str]) -> List[List[str]]:
+    _wait_for_warm_up()
+    tagged_docs = pos_tag_sents([word_tokenize(doc) for doc in docs])
+    return [_lemmatize_tagged_words(pos_tagged_words) for pos_tagged_words in tagged_docs]
+
+
+def _lemmatize_tagged_words(pos_tagged_words: List[Tuple[str, str]]) -> List[str]:
+    tokens = []
+    for word, tag in pos_tagged_words:
+        if word == ',' or word == '.':
+            continue
+
+        if tag.startswith("NN"):
+            tokens.append(_lemmatize(word, pos='n'))
+        elif tag.startswith('VB'):
+            tokens.append(_lemmatize(word, pos='v'))
+        elif tag.startswith('JJ'):
+            tokens.append(_lemmatize(word, pos='a'))
+        else:
+            tokens.append(word)
+
+    tokens = [i.lower() for i in tokens]
+    return tokens
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _lemmatize(word: str, pos: str) -> str:
+    return _get_lemmatizer().lemmatize(word, pos=pos)
+
+
+def top_k_indices(scores: np.ndarray, top_k: Optional[int] = None, score_threshold: float = 0.0) -> np.ndarray:
+    """
+    Indices of the (at most `top_k`) entries of `scores` strictly above `score_threshold`, in descending order of
+    score with ties broken by index. Uses a partial sort, so the cost of ordering grows with `top_k` and not with
+    the size of `scores`.
+    :param scores:
+    :param top_k:
+    :param score_threshold:
+    :return:
+    """
+    candidates = np.flatnonzero(scores > score_threshold)
+    candidate_scores = scores[candidates]
+    if top_k is not None and len(candidates) > top_k:
+        if top_k <= 0:
+            return candidates[:0]
+
+        kth_score = candidate_scores[np.argpartition(candidate_scores, -top_k)[-top_k:]].min()
+        #  Keep every candidate tied with the k-th score so that ties are broken by index, as a full stable sort would.
+        keep = candidate_scores >= kth_score
+        candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+
+    order = np.lexsort((candidates, -candidate_scores))
+    return candidates[order][:top_k]
+
+
+@attr.s(cmp=False, repr=False)
+class TfIdfIndex:
+    dictionary: corpora.Dictionary = attr.ib()
+    tf_idf: gensim.models.TfidfModel = attr.ib()
+    sim_matrix = attr.ib()
+    #  The normalized TF-IDF vectors of the documents, one row per document, for scoring subsets of the documents
+    #  with the sharded similarity matrix. The sparse similarity matrix holds them already.
+    corpus_matrix: Optional[scipy.sparse.csr_matrix] = attr.ib(default=None)
+
+    _row_subsets: Dict[Hashable, Any] = attr.ib(init=False, factory=dict)
+
+    @classmethod
+    def build(cls, nl_docs: List[str], dirname: str, num_processes: Optional[int] = None,
+              similarity_mode: str = 'sharded') -> 'TfIdfIndex':
+        """
+        Build the index for `nl_docs` and save it to `dirname`.
+        :param nl_docs:
+        :param dirname:
+        :param num_processes: Number of processes used to tokenize `nl_docs`. Defaults to the number of CPUs.
+        :param similarity_mode: One of `SIMILARITY_MODES`.
+        :return:
+        """
+        if similarity_mode not in SIMILARITY_MODES:
+            raise ValueError(f"Arg `similarity_mode` must be one of {SIMILARITY_MODES}")
+
+        tokenized_docs = tokenize_docs(nl_docs, num_processes=num_processes)
+        dictionary = corpora.Dictionary(tokenized_docs)
+        corpus = [dictionary.doc2bow(tok_doc) for tok_doc in tokenized_docs]
+        tf_idf = gensim.models.TfidfModel(corpus)
+        corpus_matrix = None
+        if similarity_mode == 'sharded':
+            sims = gensim.similarities.Similarity(cls._sim_prefix(dirname),
+                                                  tf_idf[corpus],
+                                                  num_features=len(dictionary))
+            #  Normalized like the vectors of the similarity matrix.
+            corpus_matrix = gensim.matutils.corpus2csc((gensim.matutils.unitvec(vec) for vec in tf_idf[corpus]),
+                                                       num_terms=len(dictionary), num_docs=len(corpus),
+                                                       dtype=np.float32).T.tocsr()
+            for name in _CORPUS_MATRIX_ARRAYS:
+                np.save(os.path.join(dirname, f'corpus_{name}.npy'), getattr(corpus_matrix, name))
+        else:
+            sims = gensim.similarities.SparseMatrixSimilarity(tf_idf[corpus],
+                                                              num_features=len(dictionary),
+                                                              num_docs=len(corpus))
+
+        dictionary.save(os.path.join(dirname, 'dictionary'))
+        tf_idf.save(os.path.join(dirname, 'tfidf'))
+        sims.save(os.path.join(dirname, 'similarity'))
+
+        return cls(dictionary, tf_idf, sims, corpus_matrix)
+
+    @classmethod
+    def load(cls, dirname: str, similarity_mode: str = 'sharded') -> 'TfIdfIndex':
+        dictionary = corpora.Dictionary.load(os.path.join(dirname, 'dictionary'))
+        tf_idf = gensim.models.TfidfModel.load(os.path.join(dirname, 'tfidf'), mmap='r')
+        corpus_matrix = None
+        if similarity_mode == 'sharded':
+            sims = gensim.similarities.Similarity.load(os.path.join(dirname, 'similarity'), mmap='r')
+
+            #  The artifact is built in a scratch directory and moved into the store afterwards, so the shard
+            #  locations recorded at build time need to be pointed at the final location.
+            sims.output_prefix = cls._sim_prefix(dirname)
+            sims.check_moved()
+
+            arrays = [np.load(os.path.join(dirname, f'corpus_{name}.npy'), mmap_mode='r')
+                      for name in _CORPUS_MATRIX_ARRAYS]
+            corpus_matrix = scipy.sparse.csr_matrix(tuple(arrays), shape=(len(arrays[2]) - 1, len(dictionary)),
+                                                    copy=False)
+        else:
+            sims = gensim.similarities.SparseMatrixSimilarity.load(os.path.join(dirname, 'similarity'))
+
+        return cls(dictionary, tf_idf, sims, corpus_matrix)
+
+    @classmethod
+    def open_or_build(cls, nl_docs: Callable[[], List[str]],
+                      corpus_hash: Optional[str] = None, temp_dir: Optional[str] = None,
+                      num_processes: Optional[int] = None, similarity_mode: str = 'sharded') -> 'TfIdfIndex':
+        """
+        Open the artifact for `corpus_hash` from the index store, building it if it does not exist.
+        If `corpus_hash` is None, the index is built in `temp_dir` and is not re-usable across instances.
+        `nl_docs` is a callable so that the corpus text is only gathered if a build is actually required.
+        :param nl_docs:
+        :param corpus_hash:
+        :param temp_dir:
+        :param num_processes:
+        :param similarity_mode:
+        :return:
+        """
+        if corpus_hash is None:
+            return cls.build(nl_docs(), temp_dir, num_processes=num_processes, similarity_mode=similarity_mode)
+
+        def build(dirname: str):
+            cls.build(nl_docs(), dirname, num_processes=num_processes, similarity_mode=similarity_mode)
+
+        path = index_store.open_or_build(f"{INDEX_KIND}-{similarity_mode}", INDEX_VERSION, corpus_hash, build)
+        return cls.load(path, similarity_mode=similarity_mode)
+
+    def get_similarities(self, tokens: List[str], rows: Optional[np.ndarray] = None,
+                         rows_key: Optional[Hashable] = None) -> np.ndarray:
+        """
+        Similarities of `tokens` to every document, or only to the documents in `rows` if provided, in which case
+        only those documents are scored. The row subset is remembered under `rows_key`, if provided, so that it is
+        only sliced once.
+        :param tokens:
+        :param rows:
+        :param rows_key:
+        :return:
+        """
+        query_bow = self.dictionary.doc2bow(tokens)
+        query_tf_idf = self.tf_idf[query_bow]
+        if rows is None:
+            return self.sim_matrix[query_tf_idf]
+
+        subset = self._get_row_subset(rows, rows_key)
+        if isinstance(subset, gensim.similarities.SparseMatrixSimilarity):
+            return subset[query_tf_idf]
+
+        query = gensim.matutils.unitvec(gensim.matutils.sparse2full(query_tf_idf, subset.shape[1]))
+        return np.asarray(subset @ query, dtype=np.float32)
+
+    def search(self, tokens: List[str], top_k: Optional[int] = None, score_threshold: float = 0.0,
+               rows: Optional[np.ndarray] = None, rows_key: Optional[Hashable] = None) -> np.ndarray:
+        """
+        Indices of the documents most similar to `tokens`, optionally restricted to the documents in `rows`
+        (which must be sorted). See `top_k_indices` and `get_similarities`.
+        :param tokens:
+        :param top_k:
+        :param score_threshold:
+        :param rows:
+        :param rows_key:
+        :return:
+        """
+        scores = self.get_similarities(tokens, rows=rows, rows_key=rows_key)
+        idxes = top_k_indices(scores, top_k=top_k, score_threshold=score_threshold)
+        return idxes if rows is None else rows[idxes]
+
+    def _get_row_subset(self, rows: np.ndarray, rows_key: Optional[Hashable]):
+        if rows_key is not None and rows_key in self._row_subsets:
+            return self._row_subsets[rows_key]
+
+        if isinstance(self.sim_matrix, gensim.similarities.SparseMatrixSimilarity):
+            subset = copy.copy(self.sim_matrix)
+            subset.index = self.sim_matrix.index[rows]
+        else:
+            subset = self.corpus_matrix[rows]
+
+        if rows_key is not None:
+            self._row_subsets[rows_key] = subset
+
+        return subset
+
+    @staticmethod
+    def _sim_prefix(dirname: str):
+        return os.path.join(dirname, 'sim')
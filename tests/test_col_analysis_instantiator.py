@@ -0,0 +1,56 @@
+import fractions
+import itertools
+
+import numpy as np
+
+from synthesis import col_analysis_instantiator
+from synthesis.col_analysis_instantiator import iter_best_assignments
+
+
+def _enumerate_sorted(candidates_map):
+    #  All the injective assignments in depth-first order, stably sorted by descending score.
+    assignments = []
+    for indices in itertools.product(*(range(len(cands)) for _, cands in candidates_map)):
+        cands = [candidates_map[depth][1][idx] for depth, idx in enumerate(indices)]
+        if len({cand for _, cand in cands}) < len(cands):
+            continue
+
+        total = sum(fractions.Fraction(score) for score, _ in cands)
+        assignments.append((total, {cand: key for (key, _), (_, cand) in zip(candidates_map, cands)}))
+
+    assignments.sort(key=lambda x: -x[0])
+    return [(float(total / len(candidates_map)), asgn) for total, asgn in assignments]
+
+
+def test_assignments_come_out_in_sorted_order():
+    rng = np.random.RandomState(0)
+    for _ in range(50):
+        num_keys = rng.randint(1, 5)
+        cols = [f"col{i}" for i in range(rng.randint(num_keys, 6))]
+        #  Few distinct scores, so there are many ties.
+        candidates_map = [(f"key{k}", [(float(rng.choice([0, 1.1, 1.6, 2.1])), col) for col in cols])
+                          for k in range(num_keys)]
+        assert list(iter_best_assignments(candidates_map)) == _enumerate_sorted(candidates_map)
+
+
+def test_no_assignments():
+    assert list(iter_best_assignments([])) == [(0.0, {})]
+    assert list(iter_best_assignments([('key', [])])) == []
+
+
+def test_first_assignment_with_tied_scores_is_found_quickly(monkeypatch):
+    num_pushes = 0
+    heappush = col_analysis_instantiator.heapq.heappush
+
+    def counting_heappush(heap, item):
+        nonlocal num_pushes
+        num_pushes += 1
+        heappush(heap, item)
+
+    monkeypatch.setattr(col_analysis_instantiator.heapq, 'heappush', counting_heappush)
+    num_cols = 8
+    cols = [f"col{i}" for i in range(num_cols)]
+    candidates_map = [(f"key{k}", [(1.1, col) for col in cols]) for k in range(num_cols)]
+    score, asgn = next(iter_best_assignments(candidates_map))
+    assert asgn == {col: f"key{k}" for k, col in enumerate(cols)}
+    assert num_pushes <= num_cols ** 2
@@ -0,0 +1,45 @@
+import decimal
+import itertools
+
+import numpy as np
+
+from synthesis.col_compat import DtypeVocabulary, encode_columns, compute_compatibility_scores, \
+    get_col_args_dtypes
+
+
+def _get_reference_score(column, col_arg):
+    #  The scalar column-compatibility score that the bitmask encoding replaces.
+    hl_dtype, ll_dtype, has_null = column
+    o_hl_dtype, o_ll_dtype, o_has_null = col_arg
+    if not set(hl_dtype.split('/')) & set(o_hl_dtype.split('/')):
+        return 0.0
+
+    score = 1.0
+    if len(ll_dtype) > 0 or len(o_ll_dtype) > 0:
+        score += len(ll_dtype & o_ll_dtype) / len(ll_dtype | o_ll_dtype)
+    if has_null == o_has_null:
+        score += 0.1
+
+    return score
+
+
+def _get_dtypes(high_level, low_level):
+    low_level_sets = [frozenset(c) for n in range(len(low_level) + 1) for c in itertools.combinations(low_level, n)]
+    return list(itertools.product(high_level, low_level_sets, [False, True]))
+
+
+def test_scores_match_reference_on_all_dtype_combinations():
+    col_args = _get_dtypes(['categorical', 'quantitative', 'categorical/quantitative', 'nominal/id', 'temporal'],
+                           [int, float, str, 'array'])
+    #  Query columns also have dtypes that are not in the vocabulary of the col args.
+    columns = _get_dtypes(['categorical', 'quantitative/id', 'categorical/nominal', 'temporal', 'unknown'],
+                          [int, float, str, 'array', decimal.Decimal])
+
+    metadata_col_args = {('df', i): {'high_level_dtype': hl, 'low_level_dtype': ll, 'has_null': null}
+                         for i, (hl, ll, null) in enumerate(col_args)}
+    vocabulary = DtypeVocabulary.from_col_args_metadata([metadata_col_args])
+    scores = compute_compatibility_scores(encode_columns(columns, vocabulary),
+                                          encode_columns(get_col_args_dtypes(metadata_col_args), vocabulary))
+
+    expected = np.array([[_get_reference_score(column, col_arg) for col_arg in col_args] for column in columns])
+    np.testing.assert_array_equal(scores, expected)
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+from utilities.df_utils import SamplingConfig, get_sample_positions, check_if_id_like, compute_df_metadata, \
+    get_cached_df_metadata, clear_metadata_cache
+
+
+def test_sample_positions_are_evenly_spaced():
+    df = pd.DataFrame({'serial': np.arange(250000)})
+    positions = get_sample_positions(df, SamplingConfig(max_rows=100000))
+    assert len(positions) == 100000
+    assert len(set(np.diff(positions))) == 1
+    assert positions[-1] < len(df)
+
+
+def test_sampled_serial_column_is_id_like():
+    df = pd.DataFrame({'serial': np.arange(250000)})
+    sample = df.iloc[get_sample_positions(df, SamplingConfig(max_rows=100000))]
+    #  A cardinality too low for the column to count as almost all unique, so only the spacing makes it id-like.
+    assert check_if_id_like(sample, {'serial': 1000}, 'serial', num_rows=len(df))
+
+    metadata = compute_df_metadata(df, sampling=SamplingConfig(max_rows=100000))
+    assert metadata['high_level_data_types']['serial'] == 'id'
+
+
+def test_metadata_of_temporary_frame():
+    df = pd.DataFrame({'a': np.arange(1000), 'b': list('xy') * 500})
+    assert compute_df_metadata(df.copy())['high_level_data_types']['a'] == 'id'
+    assert compute_df_metadata(df[['b']])['cardinality']['b'] == 2
+
+    clear_metadata_cache()
+    assert get_cached_df_metadata(df.copy())['cardinality']['b'] == 2
+    #  The cached metadata is reused for a new dataframe with the same contents.
+    metadata = get_cached_df_metadata(df.copy())
+    assert metadata['cardinality']['b'] == 2
+    assert metadata['high_level_data_types']['a'] == 'id'
+
+
+def _make_mixed_frame(num_rows):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({
+        'serial_id': np.arange(num_rows),
+        'category': rng.choice(list('abcd'), num_rows),
+        'value': rng.rand(num_rows),
+        'count': pd.array(np.where(rng.rand(num_rows) < 0.1, None, rng.randint(0, 10, num_rows)), dtype='Int64'),
+        'objects': pd.Series(rng.choice(['x', 'yy', 'zzz'], num_rows), dtype=object),
+    })
+
+
+def _assert_same_metadata(metadata, expected, columns):
+    for field in ('cardinality', 'high_level_data_types', 'low_level_data_types', 'has_null'):
+        for column in columns:
+            assert metadata[field][column] == expected[field][column], (field, column)
+
+
+def test_incremental_metadata_matches_full_metadata():
+    clear_metadata_cache()
+    df = _make_mixed_frame(3000)
+    columns = list(df.columns)
+    for num_rows in (1000, 2000, 3000):
+        metadata = get_cached_df_metadata(df.iloc[:num_rows], incremental=True)
+        metadata.compute_columns()
+        _assert_same_metadata(metadata, compute_df_metadata(df.iloc[:num_rows]), columns)
+
+
+def test_incremental_metadata_counts_objects_with_equal_hashes():
+    assert hash(-1) == hash(-2)
+    clear_metadata_cache()
+    df = pd.DataFrame({'x': pd.Series([-1, -1, -2, -2], dtype=object)})
+    assert get_cached_df_metadata(df.iloc[:2], incremental=True)['cardinality']['x'] == 1
+    assert get_cached_df_metadata(df, incremental=True)['cardinality']['x'] == 2
+
+
+def test_incremental_metadata_of_nullable_integers():
+    clear_metadata_cache()
+    df = pd.DataFrame({'x': pd.array(list(range(1000)) + [None] + list(range(1000, 2000)), dtype='Int64')})
+    metadata = get_cached_df_metadata(df, incremental=True)
+    _assert_same_metadata(metadata, compute_df_metadata(df), ['x'])
+    assert metadata['high_level_data_types']['x'] == 'id'
@@ -0,0 +1,91 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+pytest.importorskip('matplotlib')
+pytest.importorskip('seaborn')
+
+from utilities.matplotlib_utils import serialize_fig  # noqa: E402
+from utilities.render_pool import RenderPool  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLOT_CODE = '''
+def visualization(values):
+    import matplotlib.pyplot as plt
+    plt.plot(values)
+'''
+
+HUNG_CODE = '''
+def visualization():
+    while True:
+        pass
+'''
+
+ORPHAN_SCRIPT = f'''
+import sys
+sys.path.insert(0, {REPO_DIR!r})
+
+from utilities.render_pool import RenderPool
+
+if __name__ == '__main__':
+    pool = RenderPool(preload_modules=())
+    pool._idle[0].wait_until_ready()
+    print(pool._idle[0].process.pid, flush=True)
+    pool.run({{'code': {HUNG_CODE!r}, 'args': {{}}}})
+'''
+
+
+def is_running(pid: int) -> bool:
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            #  Exited workers of a killed parent may linger as zombies if nothing reaps them.
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        return False
+
+
+@pytest.fixture
+def pool():
+    pool = RenderPool(preload_modules=())
+    yield pool
+    pool.close()
+
+
+def test_run(pool):
+    png = pool.run({'code': PLOT_CODE, 'args': {'values': [1, 3, 2]}, 'serializer': serialize_fig})
+    assert png.startswith(b'\x89PNG')
+
+
+def test_timeout_replaces_worker(pool):
+    worker = pool._idle[0]
+    assert pool.run({'code': HUNG_CODE, 'args': {}}, timeout=1) is None
+    assert not worker.is_alive()
+    assert pool._idle and pool._idle[0] is not worker
+    png = pool.run({'code': PLOT_CODE, 'args': {'values': [1, 3, 2]}, 'serializer': serialize_fig})
+    assert png.startswith(b'\x89PNG')
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason="Needs /proc")
+def test_hung_worker_exits_with_parent(tmp_path):
+    script = tmp_path / 'orphan.py'
+    script.write_text(ORPHAN_SCRIPT)
+    parent = subprocess.Popen([sys.executable, str(script)], stdout=subprocess.PIPE, text=True)
+    try:
+        worker_pid = int(parent.stdout.readline())
+        #  Give the worker time to pick up the task.
+        time.sleep(1)
+        assert is_running(worker_pid)
+    finally:
+        parent.send_signal(signal.SIGKILL)
+        parent.wait()
+
+    deadline = time.monotonic() + 10
+    while is_running(worker_pid) and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    assert not is_running(worker_pid)
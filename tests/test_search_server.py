@@ -0,0 +1,107 @@
+import os
+import tempfile
+import threading
+from multiprocessing.connection import Listener
+
+import pytest
+
+from synthesis import search_server
+from synthesis.query import Query
+from synthesis.search_server import RemoteSearcher
+
+VIZ_FUNCTIONS = [{'uid': i} for i in range(5)]
+
+
+class FakeConnection:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.sent = []
+        self.closed = False
+
+    def send(self, obj):
+        self.sent.append(obj)
+
+    def poll(self, timeout=None):
+        return not self.responses or self.responses[0] is not None
+
+    def recv(self):
+        response = self.responses.pop(0)
+        if isinstance(response, BaseException):
+            raise response
+
+        return response
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSearcher:
+    def search(self, query):
+        return VIZ_FUNCTIONS[:1]
+
+
+def make_searcher(conn, address='/nonexistent/search-server.sock', timeout=0.1):
+    return RemoteSearcher('nl', VIZ_FUNCTIONS, 'hash', address, b'key', fallback_factory=FakeSearcher,
+                          timeout=timeout, conn=conn)
+
+
+def make_query():
+    return Query('histogram', [None], [None])
+
+
+def test_answered_by_server():
+    conn = FakeConnection([('ok', [3, 1])])
+    searcher = make_searcher(conn)
+    assert searcher.search(make_query()) == [VIZ_FUNCTIONS[3], VIZ_FUNCTIONS[1]]
+    assert conn.sent == [('search', 'nl', 'histogram', 1, 1)]
+    assert not conn.closed
+
+
+@pytest.mark.parametrize('response', [
+    ('error', 'ValueError: boom'),
+    EOFError(),
+    ConnectionResetError(),
+    #  The server never answers.
+    None,
+])
+def test_falls_back_in_process(response):
+    conn = FakeConnection([response])
+    searcher = make_searcher(conn)
+    with pytest.warns(UserWarning, match='searching in-process'):
+        assert searcher.search(make_query()) == VIZ_FUNCTIONS[:1]
+
+    if not isinstance(response, tuple):
+        assert conn.closed
+
+    #  Later searches do not go to the server anymore.
+    assert searcher.search(make_query()) == VIZ_FUNCTIONS[:1]
+    assert len(conn.sent) == 1
+
+
+def test_hung_server_times_out():
+    address = os.path.join(tempfile.mkdtemp(), 'search.sock')
+    listener = Listener(address, family='AF_UNIX', authkey=b'key')
+    accepted = []
+    thread = threading.Thread(target=lambda: accepted.append(listener.accept()), daemon=True)
+    thread.start()
+    try:
+        searcher = make_searcher(None, address=address)
+        with pytest.warns(UserWarning, match='TimeoutError'):
+            assert searcher.search(make_query()) == VIZ_FUNCTIONS[:1]
+
+        thread.join()
+        #  The client hung up on the stuck server.
+        assert accepted[0].recv() == ('search', 'nl', 'histogram', 1, 1)
+        with pytest.raises(EOFError):
+            accepted[0].recv()
+
+    finally:
+        listener.close()
+
+
+def test_ping_times_out(monkeypatch):
+    conn = FakeConnection([None])
+    monkeypatch.setattr(search_server, '_read_authkey', lambda address: b'key')
+    monkeypatch.setattr(search_server, 'Client', lambda *args, **kwargs: conn)
+    assert search_server._ping('/nonexistent/search-server.sock', timeout=0.1) is None
+    assert conn.closed
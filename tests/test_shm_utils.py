@@ -0,0 +1,104 @@
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utilities.shm_utils import SharedDataFrame, attach_args
+
+
+def make_df(num_rows: int = 50) -> pd.DataFrame:
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({
+        'int': rng.randint(0, 100, num_rows),
+        'float': rng.rand(num_rows),
+        'str': [f'value_{i % 7}' for i in range(num_rows)],
+        'bool': rng.rand(num_rows) > 0.5,
+        'date': pd.date_range('2020-01-01', periods=num_rows),
+        'cat': pd.Categorical(['a', 'b'] * (num_rows // 2)),
+        'int2': rng.randint(0, 5, num_rows),
+    }, index=pd.Index(np.arange(num_rows) * 2, name='idx'))
+
+
+@pytest.fixture
+def published():
+    df = make_df()
+    handle = SharedDataFrame.publish(df)
+    yield df, handle
+    handle.close()
+
+
+def test_round_trip(published):
+    df, handle = published
+    assert handle.shm_name is not None
+    attached = pickle.loads(pickle.dumps(handle)).attach()
+    pd.testing.assert_frame_equal(attached, df)
+
+
+def test_round_trip_other_process(published):
+    df, handle = published
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        attached = executor.submit(SharedDataFrame.attach, handle).result()
+
+    pd.testing.assert_frame_equal(attached, df)
+
+
+def test_copy_on_write(published):
+    df, handle = published
+    first = pickle.loads(pickle.dumps(handle)).attach()
+    first.iloc[0, 0] = -1
+    first['float'].values[:] = 0
+    assert first.iloc[0, 0] == -1 and (first['float'] == 0).all()
+
+    second = pickle.loads(pickle.dumps(handle)).attach()
+    pd.testing.assert_frame_equal(second, df)
+    assert df.iloc[0, 0] != -1
+
+
+def test_take_columns(published):
+    df, handle = published
+    subset = pickle.loads(pickle.dumps(handle.take_columns(['str', 'float', 'int2'])))
+    pd.testing.assert_frame_equal(subset.attach(), df[['str', 'float', 'int2']])
+    #  Only the object block holding 'str' is pickled with the handle.
+    assert len(subset.pickled_blocks) == 1
+
+    pd.testing.assert_frame_equal(subset.take_columns(['int2', 'str']).attach(), df[['int2', 'str']])
+
+
+def test_not_shared():
+    #  Nothing to place in shared memory, the whole frame is pickled with the handle.
+    df = pd.DataFrame({'a': ['x', 'y'], 'b': ['z', 'w']})
+    handle = SharedDataFrame.publish(df)
+    assert handle.shm_name is None and handle.frame is not None
+    pd.testing.assert_frame_equal(pickle.loads(pickle.dumps(handle)).attach(), df)
+    pd.testing.assert_frame_equal(handle.take_columns(['b']).attach(), df[['b']])
+
+    empty = pd.DataFrame()
+    pd.testing.assert_frame_equal(SharedDataFrame.publish(empty).attach(), empty)
+
+
+def test_attach_args(published):
+    df, handle = published
+    args = attach_args({'df': pickle.loads(pickle.dumps(handle)), 'col': 'int'})
+    assert args['col'] == 'int'
+    pd.testing.assert_frame_equal(args['df'], df)
+
+
+def test_close(published):
+    df, handle = published
+    copy = pickle.loads(pickle.dumps(handle))
+    attached = copy.attach()
+
+    #  Closing an unpickled copy does not release the segment.
+    copy.close()
+    pd.testing.assert_frame_equal(copy.attach(), df)
+
+    handle.close()
+    pd.testing.assert_frame_equal(attached, df)
+    with pytest.raises(FileNotFoundError):
+        copy.attach()
+
+    #  Closing twice is fine.
+    handle.close()
@@ -0,0 +1,44 @@
+import pandas as pd
+
+from synthesis.static_profile import compute_static_profile, check_static_profile
+
+
+def _get_accessors(code):
+    return [(u['df_arg'], u['col_arg'], u['accessors']) for u in compute_static_profile(code)['col_accessors']]
+
+
+def test_accessor_on_column_arg():
+    code = "def visualization(df, col):\n    return df[col].dt.year\n"
+    assert _get_accessors(code) == [('df', 'col', ['dt'])]
+
+    args = {'df': pd.DataFrame({'a': ['2021-01-01']}), 'col': 'a'}
+    assert check_static_profile(compute_static_profile(code), args) is not None
+
+
+def test_accessor_after_column_is_converted():
+    code = ("def visualization(df, col):\n"
+            "    df[col] = pd.to_datetime(df[col])\n"
+            "    return df[col].dt.year\n")
+    assert _get_accessors(code) == []
+
+    args = {'df': pd.DataFrame({'a': ['2021-01-01']}), 'col': 'a'}
+    assert check_static_profile(compute_static_profile(code), args) is None
+
+
+def test_accessor_after_dataframe_is_modified():
+    codes = [
+        "def visualization(df, col):\n    df.loc[:, col] = 1\n    return df[col].str.len()\n",
+        "def visualization(df, col):\n    df.iloc[0] += 1\n    return df[col].str.len()\n",
+        "def visualization(df, col):\n    df[col].fillna('', inplace=True)\n    return df[col].str.len()\n",
+        "def visualization(df, col):\n    data = df\n    data[col] = 1\n    return df[col].str.len()\n",
+    ]
+    for code in codes:
+        assert _get_accessors(code) == [], code
+
+
+def test_accessor_on_converted_series():
+    code = "def visualization(df, col):\n    return df[col].astype(str).str.len()\n"
+    assert _get_accessors(code) == []
+
+    args = {'df': pd.DataFrame({'a': [1, 2]}), 'col': 'a'}
+    assert check_static_profile(compute_static_profile(code), args) is None
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('gensim')
+
+from synthesis import tfidf_index  # noqa: E402
+from synthesis.arity_index import ArityIndex  # noqa: E402
+from synthesis.tfidf_index import TfIdfIndex  # noqa: E402
+
+DOCS = [
+    'histogram of a column',
+    'scatter plot of two columns',
+    'bar chart of counts per category',
+    'line plot of a time series',
+    'box plot of a column per category',
+    'heatmap of the correlations between columns',
+    'histogram of two columns side by side',
+    'pie chart of the counts of a category',
+    'scatter plot with a regression line',
+    'violin plot of a column per category',
+]
+
+
+@pytest.fixture(params=tfidf_index.SIMILARITY_MODES)
+def index(request, tmp_path, monkeypatch):
+    #  Whitespace tokenization, so the tests do not depend on NLTK data.
+    monkeypatch.setattr(tfidf_index, 'tokenize_docs', lambda docs, num_processes=None: [d.split() for d in docs])
+    TfIdfIndex.build(DOCS, str(tmp_path), similarity_mode=request.param)
+    return TfIdfIndex.load(str(tmp_path), similarity_mode=request.param)
+
+
+class _NoFullScoring:
+    def __getitem__(self, item):
+        raise AssertionError("The whole corpus was scored")
+
+
+def test_row_subset_similarities_match_full_similarities(index):
+    rows = np.array([0, 3, 4, 6, 9])
+    for tokens in (['histogram', 'column'], ['plot', 'category'], ['unknown']):
+        full = index.get_similarities(tokens)
+        np.testing.assert_allclose(index.get_similarities(tokens, rows=rows, rows_key='bucket'), full[rows],
+                                   rtol=1e-5, atol=1e-6)
+
+
+def test_row_subset_only_scores_the_subset(index):
+    rows = np.array([1, 2, 8])
+    expected = index.search(['scatter', 'plot'], rows=rows)
+    if not isinstance(index.sim_matrix, tfidf_index.gensim.similarities.SparseMatrixSimilarity):
+        index.sim_matrix = _NoFullScoring()
+
+    assert list(index.search(['scatter', 'plot'], rows=rows, rows_key='other')) == list(expected)
+    assert list(expected) == [1, 8]
+
+
+def test_search_within_arity_bucket(index):
+    viz_functions = [{'df_args': {'df': {}}, 'col_args': {f'c{j}': {} for j in range(i % 3)}} for i in range(len(DOCS))]
+    arity_index = ArityIndex.build(viz_functions)
+    for num_cols in range(3):
+        rows = arity_index.get_candidates(1, num_cols)
+        assert list(rows) == [i for i in range(len(DOCS)) if i % 3 == num_cols]
+
+        tokens = ['plot', 'column']
+        full_order = [i for i in index.search(tokens) if i in set(rows)]
+        assert list(index.search(tokens, rows=rows, rows_key=(1, num_cols))) == full_order
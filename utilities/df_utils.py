@@ -1,24 +1,138 @@
-from typing import Dict
+import collections
+import concurrent.futures
+import copy
+import functools
+import hashlib
+import itertools
+import multiprocessing
+import os
+import threading
+import weakref
+from collections.abc import Mapping
+from typing import Dict, FrozenSet, Optional, Union, Hashable, Iterator, Iterable, Callable, Any
 
+import attr
+import numpy as np
 import pandas as pd
 
+from utilities.hll import HyperLogLog, hash_series
+from utilities.mp_utils import get_num_cores_share
 
-def check_if_id_like(df, cardinalities, attribute):
+#  Kinds of dtypes whose non-null values all have the same Python type when iterated over.
+_UNIFORM_DTYPE_KINDS = frozenset('biufcmM')
+
+#  Number of rows whose values go into the fingerprint of a dataframe.
+FINGERPRINT_ROWS = 1024
+METADATA_CACHE_SIZE = 32
+
+_metadata_cache: 'collections.OrderedDict[Hashable, Dict]' = collections.OrderedDict()
+_metadata_cache_lock = threading.Lock()
+
+#  Columns are profiled in parallel when at least this many of them are requested at once, in a process pool if
+#  they hold at least `PROCESS_POOL_MIN_CELLS` profiled values in total and in a thread pool otherwise.
+PARALLEL_MIN_COLUMNS = 8
+PROCESS_POOL_MIN_CELLS = 10000000
+
+#  Incremental metadata counts distinct values exactly up to this many of them, and with a sketch beyond.
+EXACT_CARDINALITY_LIMIT = 1 << 20
+
+_INDEX_COLUMN_NAME = '__index'
+_COLUMN_FIELDS = ('cardinality', 'unique_values', 'high_level_data_types', 'low_level_data_types', 'has_null')
+
+
+@attr.s(frozen=True)
+class SamplingConfig:
+    """
+    Controls the sampling of large dataframes when computing their metadata. Dataframes with more than `max_rows`
+    rows are profiled on a systematic sample of `max_rows` rows, chosen with a random offset drawn using `seed`.
+    If `stratify_by` is a column name, every distinct value of that column is represented in the sample in
+    proportion to its frequency (at least one row each).
+    """
+    max_rows: int = attr.ib(default=100000)
+    seed: int = attr.ib(default=0)
+    stratify_by: Optional[Hashable] = attr.ib(default=None)
+
+
+def _get_systematic_positions(num_rows: int, sample_size: int, rng: np.random.RandomState) -> np.ndarray:
+    #  An integer stride keeps the positions exactly evenly spaced. A fractional one would alternate between gaps
+    #  of floor(step) and ceil(step), which makes serial ids look unevenly spaced to `check_if_id_like`.
+    step = num_rows // sample_size
+    if step == 0:
+        return np.arange(num_rows)
+
+    offset = rng.randint(0, step)
+    return offset + step * np.arange(sample_size, dtype=np.int64)
+
+
+def get_sample_positions(df: pd.DataFrame, sampling: SamplingConfig) -> Optional[np.ndarray]:
+    """
+    The sorted positions of the rows of `df` to profile under `sampling`, or None if all of them should be.
+    Systematic samples take every k-th row for a whole number k, so they preserve the spacing of evenly spaced
+    columns, which `check_if_id_like` relies on.
+    :param df:
+    :param sampling:
+    :return:
+    """
+    num_rows = len(df)
+    if num_rows <= sampling.max_rows:
+        return None
+
+    rng = np.random.RandomState(sampling.seed)
+    if sampling.stratify_by is not None:
+        groups = df.groupby(sampling.stratify_by, sort=False, dropna=False).indices
+        if len(groups) <= sampling.max_rows:
+            positions = []
+            for group_positions in groups.values():
+                group_size = min(len(group_positions),
+                                 max(1, round(sampling.max_rows * len(group_positions) / num_rows)))
+                positions.append(group_positions[_get_systematic_positions(len(group_positions), group_size, rng)])
+
+            return np.sort(np.concatenate(positions))
+
+    return _get_systematic_positions(num_rows, sampling.max_rows, rng)
+
+
+def estimate_cardinality(sample: pd.Series, num_rows: int) -> int:
+    """
+    Estimate the number of distinct values in a column of `num_rows` rows from the (uniform) sample `sample`
+    using the first-order jackknife estimator of Haas et al. (VLDB 1995), which is exact for columns of all-distinct
+    values (e.g. ids) and for columns whose values all repeat within the sample. Exact if the sample is the column.
+    :param sample:
+    :param num_rows:
+    :return:
+    """
+    counts = sample.value_counts(dropna=False).values
+    num_distinct = len(counts)
+    sample_size = len(sample)
+    if sample_size >= num_rows or num_distinct == 0:
+        return num_distinct
+
+    num_singletons = int((counts == 1).sum())
+    sampling_fraction = sample_size / num_rows
+    estimate = num_distinct / (1 - (1 - sampling_fraction) * num_singletons / sample_size)
+    return int(min(num_rows, max(num_distinct, round(estimate))))
+
+
+def check_if_id_like(df, cardinalities, attribute, num_rows: int = None):
     """
     Adopted from the Lux Project:
     https://github.com/lux-org/lux/blob/952d3c59389c83eb20eff80e9ff93cdd58a542af/lux/utils/utils.py#L74
     :param df:
     :param cardinalities:
     :param attribute:
+    :param num_rows: The number of rows in the full dataframe if `df` is a sample of it
     :return:
     """
     import re
 
+    if num_rows is None:
+        num_rows = len(df)
+
     # Strong signals
     # so that aggregated reset_index fields don't get misclassified
     high_cardinality = cardinalities[attribute] > 500
     attribute_contain_id = re.search(r"id|ID|iD|Id", str(attribute)) is not None
-    almost_all_vals_unique = cardinalities[attribute] >= 0.98 * len(df)
+    almost_all_vals_unique = cardinalities[attribute] >= 0.98 * num_rows
     is_string = pd.api.types.is_string_dtype(df[attribute])
     if is_string:
         #  For string IDs, usually serial numbers or codes with alphanumerics have a consistent length (eg.,
@@ -35,140 +149,769 @@ def check_if_id_like(df, cardinalities, attribute):
                 and str_length_uniformity
         )
     else:
-        if len(df) >= 2:
-            series = df[attribute]
+        series = df[attribute]
+        if pd.api.types.is_integer_dtype(series.dtype):
+            #  Nulls of nullable integer columns make the comparisons below ambiguous.
+            series = series.dropna()
+        if len(series) >= 2:
             diff = series.diff()
             evenly_spaced = all(diff.iloc[1:] == diff.iloc[1])
         else:
             evenly_spaced = True
         if attribute_contain_id:
-            almost_all_vals_unique = cardinalities[attribute] >= 0.75 * len(df)
+            almost_all_vals_unique = cardinalities[attribute] >= 0.75 * num_rows
         return high_cardinality and (almost_all_vals_unique or evenly_spaced)
 
 
-def compute_df_metadata(df) -> Dict:
+@functools.lru_cache(maxsize=None)
+def _classify_raw_type(dtype: type) -> Optional[Union[type, str]]:
+    """
+    The low-level data type of values of type `dtype`, or None if it depends on the value itself.
+    :param dtype:
+    :return:
+    """
+    if pd.api.types.is_float_dtype(dtype):
+        return float
+    elif pd.api.types.is_integer_dtype(dtype):
+        return int
+    elif pd.api.types.is_string_dtype(dtype):
+        return str
+    elif pd.api.types.is_bool_dtype(dtype):
+        return bool
+
+    return None
+
+
+def _classify_raw_value(val) -> Union[type, str]:
+    raw_dtype = _classify_raw_type(type(val))
+    if raw_dtype is not None:
+        return raw_dtype
+    elif pd.api.types.is_array_like(val):
+        return 'array'
+
+    return type(val)
+
+
+def compute_low_level_data_types(series: pd.Series) -> FrozenSet:
+    """
+    The set of low-level data types (float, int, str, bool, 'array' or the type itself) of the non-null values in
+    `series`. Values are classified per distinct type rather than per value, and columns with a non-object numpy
+    dtype are classified from a single value.
+    :param series:
+    :return:
+    """
+    not_null = series.notnull().values
+    if not not_null.any():
+        return frozenset()
+
+    if series.dtype.kind in _UNIFORM_DTYPE_KINDS:
+        return frozenset([_classify_raw_value(next(itertools.compress(series, not_null)))])
+
+    if pd.api.types.infer_dtype(series, skipna=True) == 'string':
+        return frozenset([_classify_raw_type(str)])
+
+    raw_dtypes = set()
+    value_dependent = set()
+    for dtype in set(map(type, itertools.compress(series, not_null))):
+        raw_dtype = _classify_raw_type(dtype)
+        if raw_dtype is None:
+            value_dependent.add(dtype)
+        else:
+            raw_dtypes.add(raw_dtype)
+
+    if value_dependent:
+        for val in itertools.compress(series, not_null):
+            if type(val) in value_dependent:
+                raw_dtypes.add(_classify_raw_value(val))
+
+    return frozenset(raw_dtypes)
+
+
+def classify_high_level_data_type(dtype, attr, cardinality: int, num_rows: int,
+                                  is_id_like: Callable[[], bool],
+                                  get_integral_cardinality: Callable[[], Optional[int]]) -> str:
     """
     Adopted from the Lux Project:
-    https://github.com/lux-org/lux/blob/2525d7115b9e6fa2de537dcbd088ab7c8990f904/lux/executor/PandasExecutor.py#L404
-    and
     https://github.com/lux-org/lux/blob/2525d7115b9e6fa2de537dcbd088ab7c8990f904/lux/executor/PandasExecutor.py#L514
-    :param df:
+    The high-level data type of the column `attr` from its statistics. The statistics that are expensive to compute
+    are only requested when the rules need them.
+    :param dtype:
+    :param attr:
+    :param cardinality:
+    :param num_rows: The number of rows in the full dataframe
+    :param is_id_like: Computes `check_if_id_like` for the column
+    :param get_integral_cardinality: Computes the number of distinct values of a float column if all of them are
+        integral (i.e. the column is convertible to an integer one), and None otherwise
     :return:
     """
     from pandas.api.types import is_datetime64_any_dtype as is_datetime
 
-    # precompute statistics
-    unique_values = {}
-    cardinality = {}
-    data_types = {}
-    raw_data_types = {}
-    has_null = {}
-
-    for attribute in df.columns:
-        if isinstance(attribute, pd._libs.tslibs.timestamps.Timestamp):
-            # If timestamp, make the dictionary keys the _repr_ (e.g., TimeStamp('2020-04-05 00.000')--> '2020-04-05')
-            attribute_repr = str(attribute._date_repr)
+    if is_datetime(dtype):
+        return "temporal"
+    elif isinstance(attr, pd._libs.tslibs.timestamps.Timestamp):
+        return "temporal"
+    elif pd.api.types.is_float_dtype(dtype):
+        # int columns gets coerced into floats if contain NaN
+        integral_cardinality = get_integral_cardinality()
+        if (
+                integral_cardinality is not None
+                and cardinality != num_rows
+                and integral_cardinality < 20
+        ):
+            if num_rows < 20:
+                return "categorical/quantitative"
+            else:
+                return "categorical"
         else:
-            attribute_repr = attribute
-
-        if df.dtypes[attribute] != "float64" or df[attribute].isnull().values.any():
-            try:
-                unique_values[attribute_repr] = list(df[attribute].unique())
-            except TypeError:
-                unique_values[attribute_repr] = list(df[attribute])
+            return "quantitative"
 
-            cardinality[attribute_repr] = len(unique_values[attribute])
-        else:
-            cardinality[attribute_repr] = 999  # special value for non-numeric attribute
-
-    if not pd.api.types.is_integer_dtype(df.index):
-        index_column_name = '__index'
-        unique_values[index_column_name] = list(df.index)
-        cardinality[index_column_name] = len(df.index)
-
-    for attr in list(df.columns):
-        if is_datetime(df[attr]):
-            data_types[attr] = "temporal"
-        elif isinstance(attr, pd._libs.tslibs.timestamps.Timestamp):
-            data_types[attr] = "temporal"
-        elif pd.api.types.is_float_dtype(df.dtypes[attr]):
-            # int columns gets coerced into floats if contain NaN
-            convertible2int = pd.api.types.is_integer_dtype(df[attr].convert_dtypes())
-            if (
-                    convertible2int
-                    and cardinality[attr] != len(df)
-                    and (len(df[attr].convert_dtypes().unique()) < 20)
-            ):
-                if len(df) < 20:
-                    data_types[attr] = "categorical/quantitative"
-                else:
-                    data_types[attr] = "categorical"
+    elif pd.api.types.is_integer_dtype(dtype):
+        # See if integer value is quantitative or nominal by checking if the ratio of cardinality/data size is
+        # less than 0.4 and if there are less than 10 unique values
+        if cardinality / num_rows < 0.25:
+            if cardinality <= 5:
+                data_type = "categorical"
             else:
-                data_types[attr] = "quantitative"
-
-        elif pd.api.types.is_integer_dtype(df.dtypes[attr]):
-            # See if integer value is quantitative or nominal by checking if the ratio of cardinality/data size is
-            # less than 0.4 and if there are less than 10 unique values
-            if cardinality[attr] / len(df) < 0.25:
-                if cardinality[attr] <= 5:
-                    data_types[attr] = "categorical"
-                else:
-                    data_types[attr] = "categorical/quantitative"
-            elif cardinality[attr] < 20:
-                if check_if_id_like(df, cardinality, attr):
-                    data_types[attr] = "categorical/quantitative/id"
-                else:
-                    data_types[attr] = "categorical/quantitative"
-            elif check_if_id_like(df, cardinality, attr):
-                data_types[attr] = "id"
+                data_type = "categorical/quantitative"
+        elif cardinality < 20:
+            if is_id_like():
+                data_type = "categorical/quantitative/id"
             else:
-                data_types[attr] = "quantitative"
-
-            if check_if_id_like(df, cardinality, attr):
-                data_types[attr] = "id"
-        # Eliminate this clause because a single NaN value can cause the dtype to be object
-        elif pd.api.types.is_string_dtype(df.dtypes[attr]):
-            if cardinality[attr] / len(df) < 0.25:
-                data_types[attr] = "categorical"
-            elif cardinality[attr] < 20:
-                if check_if_id_like(df, cardinality, attr):
-                    data_types[attr] = "categorical/nominal/id"
-                else:
-                    data_types[attr] = "categorical/nominal"
+                data_type = "categorical/quantitative"
+        elif is_id_like():
+            data_type = "id"
+        else:
+            data_type = "quantitative"
+
+        if is_id_like():
+            data_type = "id"
+
+        return data_type
+    # Eliminate this clause because a single NaN value can cause the dtype to be object
+    elif pd.api.types.is_string_dtype(dtype):
+        if cardinality / num_rows < 0.25:
+            data_type = "categorical"
+        elif cardinality < 20:
+            if is_id_like():
+                data_type = "categorical/nominal/id"
+            else:
+                data_type = "categorical/nominal"
+        else:
+            data_type = "nominal"
+        if is_id_like():
+            data_type = "id"
+
+        return data_type
+    # check if attribute is any type of datetime dtype
+    elif pd.api.types.is_datetime64_any_dtype(dtype) or pd.api.types.is_period_dtype(dtype):
+        return "temporal"
+    else:
+        return "nominal"
+
+
+def compute_high_level_data_type(df, attr, cardinality: Dict, num_rows: int) -> str:
+    """
+    The high-level data type of the column `attr` of `df`. See `classify_high_level_data_type`.
+    :param df:
+    :param attr:
+    :param cardinality:
+    :param num_rows: The number of rows in the full dataframe if `df` is a sample of it
+    :return:
+    """
+    def get_integral_cardinality():
+        converted = df[attr].convert_dtypes()
+        if not pd.api.types.is_integer_dtype(converted):
+            return None
+
+        return len(converted.unique())
+
+    return classify_high_level_data_type(df.dtypes[attr], attr, cardinality[attr], num_rows,
+                                         is_id_like=lambda: check_if_id_like(df, cardinality, attr, num_rows),
+                                         get_integral_cardinality=get_integral_cardinality)
+
+
+def compute_cardinality(series: pd.Series, approximate_above: int = None) -> int:
+    """
+    The number of distinct values (counting nulls as one) in `series`, computed without building a list of them.
+    If `series` has more than `approximate_above` values, the count is estimated with a HyperLogLog sketch instead,
+    which takes constant memory. Raises a TypeError if the values are not hashable.
+    :param series:
+    :param approximate_above:
+    :return:
+    """
+    if approximate_above is not None and len(series) > approximate_above:
+        sketch = HyperLogLog()
+        sketch.add_series(series)
+        return min(len(series), sketch.count())
+
+    return int(series.nunique(dropna=False))
+
+
+def compute_column_metadata(series: pd.Series, num_rows: int,
+                            include_unique_values: bool = False,
+                            approximate_cardinality_above: int = None) -> Dict:
+    """
+    Adopted from the Lux Project:
+    https://github.com/lux-org/lux/blob/2525d7115b9e6fa2de537dcbd088ab7c8990f904/lux/executor/PandasExecutor.py#L404
+    Compute the metadata of the column `series`, which is a sample of a column of `num_rows` rows if shorter.
+    :param series:
+    :param num_rows:
+    :param include_unique_values: Also record the list of distinct values as 'unique_values'
+    :param approximate_cardinality_above: See `compute_cardinality`. Only applies to unsampled columns
+    :return:
+    """
+    attribute = series.name
+    column_metadata = {}
+    has_null = series.isnull().values.any()
+    if series.dtype != "float64" or has_null:
+        try:
+            if len(series) < num_rows:
+                column_metadata['cardinality'] = estimate_cardinality(series, num_rows)
             else:
-                data_types[attr] = "nominal"
-            if check_if_id_like(df, cardinality, attr):
-                data_types[attr] = "id"
-        # check if attribute is any type of datetime dtype
-        elif pd.api.types.is_datetime64_any_dtype(df.dtypes[attr]) or pd.api.types.is_period_dtype(df.dtypes[attr]):
-            data_types[attr] = "temporal"
+                column_metadata['cardinality'] = compute_cardinality(series, approximate_cardinality_above)
+
+            if include_unique_values:
+                column_metadata['unique_values'] = list(series.unique())
+
+        except TypeError:
+            #  Unhashable values, consider all of them distinct.
+            column_metadata['cardinality'] = num_rows
+            if include_unique_values:
+                column_metadata['unique_values'] = list(series)
+    else:
+        column_metadata['cardinality'] = 999  # special value for non-numeric attribute
+
+    column_metadata['high_level_data_types'] = compute_high_level_data_type(
+        series.to_frame(), attribute, {attribute: column_metadata['cardinality']}, num_rows)
+    column_metadata['low_level_data_types'] = compute_low_level_data_types(series)
+    column_metadata['has_null'] = has_null
+    return column_metadata
+
+
+class DataFrameMetadata(Mapping):
+    """
+    The metadata of a dataframe, with the same fields as the dictionary the Lux-based profiling used to produce:
+    'cardinality', 'unique_values', 'high_level_data_types', 'low_level_data_types' and 'has_null' map columns
+    to their statistics, while 'sampled', 'sample_size' and 'num_rows' describe the rows that were profiled.
+    'unique_values' is empty unless `include_unique_values` is True.
+    Columns are profiled the first time one of their statistics is looked up, so the cost of the metadata
+    depends on the columns that are used rather than on the width of the dataframe. Iterating over a per-column
+    field profiles every column, in parallel for wide dataframes (see `compute_columns`).
+    The metadata keeps the dataframe alive, except for the metadata held by the cache of `get_cached_df_metadata`
+    (created with `weak=True`), which only hands out copies bound to a dataframe (see `bound`).
+    """
+
+    def __init__(self, df: pd.DataFrame, sampling: SamplingConfig = None,
+                 include_unique_values: bool = False, approximate_cardinality_above: int = None,
+                 weak: bool = False):
+        self._weak = weak
+        self._set_df(df)
+        self.include_unique_values = include_unique_values
+        self.approximate_cardinality_above = approximate_cardinality_above
+        self.columns = list(df.columns)
+        self._column_set = set(self.columns)
+        self.num_rows = len(df)
+        self._positions = get_sample_positions(df, sampling) if sampling is not None else None
+        self.sampled = self._positions is not None
+        self.sample_size = len(self._positions) if self.sampled else self.num_rows
+
+        self._has_index_column = not pd.api.types.is_integer_dtype(df.index)
+        self._column_metadata: Dict[Hashable, Dict] = {}
+        self._fields = {field: _ColumnFieldView(self, field) for field in _COLUMN_FIELDS}
+        self._lock = threading.Lock()
+
+    def bound(self, df: pd.DataFrame) -> 'DataFrameMetadata':
+        """
+        A copy of the metadata that profiles columns from `df`, which must have the same contents, and keeps it
+        alive. Columns profiled through either of them are shared with the other.
+        :param df:
+        :return:
+        """
+        metadata = copy.copy(self)
+        metadata._weak = False
+        metadata._set_df(df)
+        metadata._fields = {field: _ColumnFieldView(metadata, field) for field in _COLUMN_FIELDS}
+        return metadata
+
+    def _set_df(self, df: pd.DataFrame):
+        if self._weak:
+            self._df, self._df_ref = None, weakref.ref(df)
         else:
-            data_types[attr] = "nominal"
-
-        raw_dtypes = set()
-        for val in df[attr]:
-            if pd.isnull(val) is not True:
-                dtype = type(val)
-                if pd.api.types.is_float_dtype(dtype):
-                    raw_dtypes.add(float)
-                elif pd.api.types.is_integer_dtype(dtype):
-                    raw_dtypes.add(int)
-                elif pd.api.types.is_string_dtype(dtype):
-                    raw_dtypes.add(str)
-                elif pd.api.types.is_bool_dtype(dtype):
-                    raw_dtypes.add(bool)
-                elif pd.api.types.is_array_like(val):
-                    raw_dtypes.add('array')
+            self._df, self._df_ref = df, None
+
+    def get_column_metadata(self, column: Hashable) -> Dict:
+        """
+        The statistics of `column`, computed on first access. The pseudo-column '__index' describes the index
+        if it is not an integer index.
+        :param column:
+        :return:
+        """
+        if column in self._column_metadata:
+            return self._column_metadata[column]
+
+        with self._lock:
+            if column not in self._column_metadata:
+                self._column_metadata[column] = self._compute_column_metadata(column)
+
+        return self._column_metadata[column]
+
+    def compute_columns(self, columns: Iterable[Hashable] = None, max_workers: int = None):
+        """
+        Profile `columns` (all of them by default) ahead of their first access. If there are at least
+        `PARALLEL_MIN_COLUMNS` of them left to profile, they are spread across a pool of `max_workers` workers:
+        processes for large profiled data, where profiling is dominated by Python-level work that holds the GIL, and
+        threads otherwise, where shipping the columns to other processes would cost more than it saves.
+        Unknown columns are ignored.
+        :param columns:
+        :param max_workers: Defaults to the share of the available cores of this process, see
+            `utilities.mp_utils.get_num_cores_share`
+        :return:
+        """
+        columns = self.columns if columns is None else columns
+        pending = list(dict.fromkeys(c for c in columns if c in self._column_set and c not in self._column_metadata))
+        if max_workers is None:
+            max_workers = get_num_cores_share()
+
+        if len(pending) < PARALLEL_MIN_COLUMNS or max_workers <= 1:
+            for column in pending:
+                self.get_column_metadata(column)
+
+            return
+
+        df = self._get_df()
+        series_list = [self._get_profiled_series(df, column) for column in pending]
+        if sum(map(len, series_list)) >= PROCESS_POOL_MIN_CELLS:
+            #  Forking a process with live threads (a Jupyter kernel, the thread pool path) can deadlock the children.
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                              mp_context=multiprocessing.get_context('spawn'))
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+        with executor:
+            results = executor.map(compute_column_metadata, series_list,
+                                   itertools.repeat(self.num_rows),
+                                   itertools.repeat(self.include_unique_values),
+                                   itertools.repeat(self.approximate_cardinality_above))
+            for column, column_metadata in zip(pending, results):
+                with self._lock:
+                    self._column_metadata.setdefault(column, column_metadata)
+
+    def iter_columns(self, field: str) -> Iterator[Hashable]:
+        yield from self.columns
+        if self._has_index_column and field in ('cardinality', 'unique_values'):
+            yield _INDEX_COLUMN_NAME
+
+    def _get_df(self) -> pd.DataFrame:
+        df = self._df if self._df_ref is None else self._df_ref()
+        if df is None:
+            raise ReferenceError("The dataframe of this metadata no longer exists")
+
+        return df
+
+    def _get_profiled_series(self, df: pd.DataFrame, column: Hashable) -> pd.Series:
+        return df[column] if self._positions is None else df[column].iloc[self._positions]
+
+    def _compute_column_metadata(self, column: Hashable) -> Dict:
+        df = self._get_df()
+        if column == _INDEX_COLUMN_NAME and self._has_index_column and column not in self._column_set:
+            index = df.index if self._positions is None else df.index[self._positions]
+            if self.include_unique_values:
+                return {'unique_values': list(index), 'cardinality': self.num_rows}
+
+            return {'cardinality': self.num_rows}
+
+        if column not in self._column_set:
+            raise KeyError(column)
+
+        return compute_column_metadata(self._get_profiled_series(df, column), self.num_rows,
+                                       include_unique_values=self.include_unique_values,
+                                       approximate_cardinality_above=self.approximate_cardinality_above)
+
+    def __getitem__(self, field: str):
+        if field in self._fields:
+            return self._fields[field]
+        elif field == 'sampled':
+            return self.sampled
+        elif field == 'sample_size':
+            return self.sample_size
+        elif field == 'num_rows':
+            return self.num_rows
+
+        raise KeyError(field)
+
+    def __iter__(self):
+        yield from _COLUMN_FIELDS
+        yield from ('sampled', 'sample_size', 'num_rows')
+
+    def __len__(self):
+        return len(_COLUMN_FIELDS) + 3
+
+
+class _ColumnFieldView(Mapping):
+    """
+    A read-only mapping from the columns of a `DataFrameMetadata` to one of their statistics.
+    """
+
+    __slots__ = ('metadata', 'field')
+
+    def __init__(self, metadata: DataFrameMetadata, field: str):
+        self.metadata = metadata
+        self.field = field
+
+    def __getitem__(self, column: Hashable):
+        column_metadata = self.metadata.get_column_metadata(column)
+        if self.field not in column_metadata:
+            raise KeyError(column)
+
+        return column_metadata[self.field]
+
+    def __iter__(self):
+        self.metadata.compute_columns()
+        for column in self.metadata.iter_columns(self.field):
+            if self.field in self.metadata.get_column_metadata(column):
+                yield column
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class _NeedsRecompute(Exception):
+    pass
+
+
+class _IncrementalColumnStats:
+    """
+    The statistics of a column that `classify_high_level_data_type` and `check_if_id_like` depend on, maintained
+    as rows are appended to the column: distinct values (as a set of the values for object columns and a sorted
+    array of value hashes otherwise, or a HyperLogLog sketch past `EXACT_CARDINALITY_LIMIT` of them), null presence, low-level data types, whether float values are all
+    integral, and whether integer values are evenly spaced.
+    """
+
+    def __init__(self, name: Hashable, dtype):
+        self.name = name
+        self.dtype = dtype
+        self.num_rows = 0
+        self.has_null = False
+        self.low_level_data_types: FrozenSet = frozenset()
+        self.unhashable = False
+        self.all_integral = True
+
+        #  Python hashes of distinct objects can be equal (hash(-1) == hash(-2)), so objects are only counted by
+        #  hash in the sketch. Nulls are counted once per type, like `hash_series` does.
+        self._values: Optional[set] = set() if dtype == object else None
+        self._nulls: Dict[type, Any] = {}
+        self._hashes: Optional[np.ndarray] = np.empty(0, dtype=np.uint64) if dtype != object else None
+        self._sketch: Optional[HyperLogLog] = None
+
+        self._step = None
+        self._last_value = None
+        self._evenly_spaced = True
+
+    def absorb(self, series: pd.Series):
+        if len(series) == 0:
+            return
+
+        self.has_null = self.has_null or bool(series.isnull().values.any())
+        self.low_level_data_types = self.low_level_data_types | compute_low_level_data_types(series)
+
+        if not self.unhashable:
+            try:
+                if self._values is not None:
+                    self._add_values(series)
                 else:
-                    raw_dtypes.add(type(val))
-
-        raw_data_types[attr] = frozenset(raw_dtypes)
-        has_null[attr] = df[attr].isnull().values.any()
-
-    return {
-        'cardinality': cardinality,
-        'unique_values': unique_values,
-        'high_level_data_types': data_types,
-        'low_level_data_types': raw_data_types,
-        'has_null': has_null
-    }
+                    self._add_hashes(hash_series(series))
+            except TypeError:
+                self.unhashable = True
+                self._values = self._hashes = self._sketch = None
+
+        if pd.api.types.is_float_dtype(self.dtype) and self.all_integral:
+            self.all_integral = pd.api.types.is_integer_dtype(series.convert_dtypes())
+
+        if pd.api.types.is_integer_dtype(self.dtype):
+            #  Nulls of nullable integer columns are skipped, comparisons with them are ambiguous.
+            values = series.dropna().to_numpy(dtype=np.int64)
+            if self._last_value is not None:
+                values = np.concatenate([[self._last_value], values])
+
+            diffs = np.diff(values)
+            if len(diffs) > 0:
+                if self._step is None:
+                    self._step = diffs[0]
+
+                self._evenly_spaced = self._evenly_spaced and bool(np.all(diffs == self._step))
+
+            if len(values) > 0:
+                self._last_value = values[-1]
+
+        self.num_rows += len(series)
+
+    def _add_values(self, series: pd.Series):
+        if self._sketch is not None:
+            self._sketch.add_hashes(hash_series(series))
+            return
+
+        not_null = series.notnull().values
+        self._values.update(series.values[not_null])
+        self._nulls.update((type(null), null) for null in series.values[~not_null])
+        if len(self._values) + len(self._nulls) > EXACT_CARDINALITY_LIMIT:
+            values = np.empty(len(self._values) + len(self._nulls), dtype=object)
+            for i, value in enumerate(itertools.chain(self._values, self._nulls.values())):
+                values[i] = value
+
+            self._sketch = HyperLogLog()
+            self._sketch.add_hashes(hash_series(pd.Series(values, dtype=object)))
+            self._values = None
+
+    def _add_hashes(self, hashes: np.ndarray):
+        if self._sketch is not None:
+            self._sketch.add_hashes(hashes)
+            return
+
+        hashes = np.unique(hashes)
+        positions = np.searchsorted(self._hashes, hashes)
+        known = positions < len(self._hashes)
+        known[known] = self._hashes[positions[known]] == hashes[known]
+        self._hashes = np.insert(self._hashes, positions[~known], hashes[~known])
+        if len(self._hashes) > EXACT_CARDINALITY_LIMIT:
+            self._sketch = HyperLogLog()
+            self._sketch.add_hashes(self._hashes)
+            self._hashes = None
+
+    def get_distinct_count(self) -> int:
+        if self._sketch is not None:
+            return min(self.num_rows, self._sketch.count())
+        elif self._values is not None:
+            return len(self._values) + len(self._nulls)
+
+        return len(self._hashes)
+
+    def to_column_metadata(self) -> Optional[Dict]:
+        """
+        The metadata of the column as computed by `compute_column_metadata`, or None if it cannot be derived from
+        the statistics alone: when the id-like check needs to look at the values, or when an approximate distinct
+        count is too close to one of the classification thresholds.
+        :return:
+        """
+        num_rows = self.num_rows
+        distinct_count = num_rows if self.unhashable else self.get_distinct_count()
+        if self._sketch is not None:
+            margin = 3 * 1.04 / np.sqrt(self._sketch.num_registers) * distinct_count
+            thresholds = (5, 20, 500, 0.25 * num_rows, 0.75 * num_rows, 0.98 * num_rows, num_rows)
+            if any(abs(distinct_count - t) <= margin for t in thresholds):
+                return None
+
+        if self.dtype != "float64" or self.has_null:
+            cardinality = distinct_count
+        else:
+            cardinality = 999  # special value for non-numeric attribute
+
+        try:
+            high_level_data_type = classify_high_level_data_type(
+                self.dtype, self.name, cardinality, num_rows,
+                is_id_like=lambda: self._check_if_id_like(cardinality),
+                get_integral_cardinality=lambda: distinct_count if self.all_integral else None)
+        except _NeedsRecompute:
+            return None
+
+        return {
+            'cardinality': cardinality,
+            'high_level_data_types': high_level_data_type,
+            'low_level_data_types': self.low_level_data_types,
+            'has_null': self.has_null,
+        }
+
+    def _check_if_id_like(self, cardinality: int) -> bool:
+        #  Mirrors `check_if_id_like`.
+        import re
+
+        high_cardinality = cardinality > 500
+        attribute_contain_id = re.search(r"id|ID|iD|Id", str(self.name)) is not None
+        almost_all_vals_unique = cardinality >= 0.98 * self.num_rows
+        if pd.api.types.is_string_dtype(self.dtype):
+            if high_cardinality and (attribute_contain_id or almost_all_vals_unique):
+                #  Depends on the uniformity of the lengths of a sample of the values.
+                raise _NeedsRecompute()
+
+            return False
+        else:
+            if attribute_contain_id:
+                almost_all_vals_unique = cardinality >= 0.75 * self.num_rows
+            return high_cardinality and (almost_all_vals_unique or self._evenly_spaced)
+
+
+class IncrementalDataFrameMetadata(DataFrameMetadata):
+    """
+    Metadata of a dataframe that rows keep getting appended to. Alongside the metadata of each profiled column,
+    statistics of the column are maintained so that `extend` only needs to look at the appended rows. Columns
+    whose classification cannot be derived from the statistics (see `_IncrementalColumnStats.to_column_metadata`)
+    or whose dtype changed are profiled again in full.
+    All rows are profiled, and columns are profiled one at a time.
+    """
+
+    def __init__(self, df: pd.DataFrame, weak: bool = False):
+        super().__init__(df, weak=weak)
+        self._stats: Dict[Hashable, _IncrementalColumnStats] = {}
+
+    def compute_columns(self, columns: Iterable[Hashable] = None, max_workers: int = None):
+        super().compute_columns(columns, max_workers=1)
+
+    def extend(self, df: pd.DataFrame):
+        """
+        Update the metadata for `df`, which must consist of the rows profiled so far followed by new rows.
+        :param df:
+        :return:
+        """
+        if list(df.columns) != self.columns or len(df) < self.num_rows:
+            raise ValueError("Arg `df` must extend the rows of the profiled dataframe")
+
+        new_rows = df.iloc[self.num_rows:]
+        with self._lock:
+            #  Copies bound to the rows profiled so far (see `bound`) keep describing them.
+            self._column_metadata = dict(self._column_metadata)
+            self._stats = dict(self._stats)
+            self._set_df(df)
+            self.num_rows = self.sample_size = len(df)
+            self._has_index_column = not pd.api.types.is_integer_dtype(df.index)
+            if _INDEX_COLUMN_NAME not in self._column_set:
+                self._column_metadata.pop(_INDEX_COLUMN_NAME, None)
+
+            for column, stats in list(self._stats.items()):
+                if df[column].dtype != stats.dtype:
+                    del self._stats[column]
+                    del self._column_metadata[column]
+                    continue
+
+                stats.absorb(new_rows[column])
+                self._column_metadata[column] = self._get_metadata_from_stats(df, column)
+
+    def _compute_column_metadata(self, column: Hashable) -> Dict:
+        if column not in self._column_set:
+            return super()._compute_column_metadata(column)
+
+        df = self._get_df()
+        stats = _IncrementalColumnStats(column, df[column].dtype)
+        stats.absorb(df[column])
+        self._stats[column] = stats
+        return self._get_metadata_from_stats(df, column)
+
+    def _get_metadata_from_stats(self, df: pd.DataFrame, column: Hashable) -> Dict:
+        column_metadata = self._stats[column].to_column_metadata()
+        if column_metadata is None:
+            column_metadata = compute_column_metadata(df[column], self.num_rows)
+
+        return column_metadata
+
+
+def compute_df_metadata(df, sampling: SamplingConfig = None,
+                        include_unique_values: bool = False,
+                        approximate_cardinality_above: int = None) -> DataFrameMetadata:
+    """
+    The (lazily computed) metadata of `df`. If `sampling` is provided and `df` has more than `sampling.max_rows`
+    rows, the statistics are computed on a sample of `df`, with cardinalities estimated for the full dataframe.
+    :param df:
+    :param sampling:
+    :param include_unique_values: Record the lists of distinct values of the columns as 'unique_values'
+    :param approximate_cardinality_above: Count distinct values approximately for columns with more profiled rows
+    :return:
+    """
+    return DataFrameMetadata(df, sampling=sampling,
+                             include_unique_values=include_unique_values,
+                             approximate_cardinality_above=approximate_cardinality_above)
+
+
+def compute_df_fingerprint(df: pd.DataFrame) -> Hashable:
+    """
+    A cheap fingerprint of the contents of `df`: its shape, column names, dtypes and a hash of the values (and
+    index labels) of up to `FINGERPRINT_ROWS` evenly spaced rows. Dataframes with at most `FINGERPRINT_ROWS` rows
+    are hashed in full; for larger ones, in-place edits to rows outside the hashed ones go unnoticed.
+    :param df:
+    :return:
+    """
+    num_rows = len(df)
+    if num_rows > FINGERPRINT_ROWS:
+        rows = df.iloc[np.linspace(0, num_rows - 1, FINGERPRINT_ROWS).astype(np.int64)]
+    else:
+        rows = df
+
+    try:
+        row_hashes = pd.util.hash_pandas_object(rows, index=True).values
+    except TypeError:
+        #  Unhashable values such as lists.
+        row_hashes = pd.util.hash_pandas_object(rows.astype(str), index=True).values
+
+    return (
+        df.shape,
+        tuple(map(repr, df.columns)),
+        tuple(map(str, df.dtypes)),
+        hashlib.sha1(row_hashes.tobytes()).hexdigest(),
+    )
+
+
+def get_cached_df_metadata(df: pd.DataFrame, sampling: SamplingConfig = None,
+                           include_unique_values: bool = False,
+                           approximate_cardinality_above: int = None,
+                           incremental: bool = False) -> DataFrameMetadata:
+    """
+    `compute_df_metadata`, memoized process-wide in an LRU cache of `METADATA_CACHE_SIZE` entries keyed by the
+    fingerprint of `df` and the profiling options. The cache only holds weak references to the dataframes, and the
+    returned metadata, bound to `df`, shares the profiled columns with the other queries over the same contents.
+    If `incremental` is True, the other options are ignored and `IncrementalDataFrameMetadata` is used instead: if
+    `df` is a cached dataframe with rows appended to it, its metadata is extended rather than computed again.
+    :param df:
+    :param sampling:
+    :param include_unique_values:
+    :param approximate_cardinality_above:
+    :param incremental:
+    :return:
+    """
+    fingerprint = compute_df_fingerprint(df)
+    if incremental:
+        key = (fingerprint, 'incremental')
+    else:
+        key = (fingerprint, sampling, include_unique_values, approximate_cardinality_above)
+
+    with _metadata_cache_lock:
+        if key in _metadata_cache:
+            _metadata_cache.move_to_end(key)
+            return _metadata_cache[key].bound(df)
+
+    if incremental:
+        metadata = _extend_cached_metadata(df)
+        if metadata is None:
+            metadata = IncrementalDataFrameMetadata(df, weak=True)
+    else:
+        metadata = DataFrameMetadata(df, sampling=sampling,
+                                     include_unique_values=include_unique_values,
+                                     approximate_cardinality_above=approximate_cardinality_above,
+                                     weak=True)
+    with _metadata_cache_lock:
+        _metadata_cache[key] = metadata
+        while len(_metadata_cache) > METADATA_CACHE_SIZE:
+            _metadata_cache.popitem(last=False)
+
+    return metadata.bound(df)
+
+
+def _extend_cached_metadata(df: pd.DataFrame) -> Optional[IncrementalDataFrameMetadata]:
+    columns = list(df.columns)
+    with _metadata_cache_lock:
+        candidates = [(key, metadata) for key, metadata in _metadata_cache.items()
+                      if isinstance(metadata, IncrementalDataFrameMetadata)
+                      and metadata.columns == columns and metadata.num_rows < len(df)]
+
+    for key, metadata in candidates:
+        #  The fingerprint of the rows profiled so far is unchanged if rows were only appended.
+        if compute_df_fingerprint(df.iloc[:metadata.num_rows]) == key[0]:
+            with _metadata_cache_lock:
+                if _metadata_cache.pop(key, None) is None:
+                    continue
+
+            metadata.extend(df)
+            return metadata
+
+    return None
+
+
+def clear_metadata_cache():
+    with _metadata_cache_lock:
+        _metadata_cache.clear()
@@ -1,9 +1,7 @@
 import io
-from concurrent.futures import TimeoutError
 from typing import Dict, Any, Optional, Callable
 
 from matplotlib import pyplot as plt
-from pebble import concurrent
 
 
 def serialize_fig(fig: plt.Figure, format: str = 'png', tight: bool = True):
@@ -98,17 +96,21 @@ def run_viz_code_matplotlib_mp(code: str, args: Dict[str, Any],
                                disable_seaborn_randomization: bool = True,
                                serializer: Callable[[plt.Figure], Any] = None,
                                timeout: Optional[int] = None):
-
-    func = concurrent.process(timeout=timeout)(run_viz_code_matplotlib)
-    future = func(code=code, args=args, func_name=func_name, other_globals=other_globals,
-                  disable_seaborn_randomization=disable_seaborn_randomization, serializer=serializer)
-
-    try:
-        result = future.result()
-        return result
-
-    except TimeoutError:
-        return None
+    """
+    Run `run_viz_code_matplotlib` in a worker of the render pool of this process. The arguments, the serializer and
+    the result must be picklable. Dataframes can be passed as `utilities.shm_utils.SharedDataFrame` handles.
+    Returns None if the code does not finish within `timeout` seconds.
+    """
+    from utilities.render_pool import get_render_pool
+
+    return get_render_pool().run({
+        'code': code,
+        'args': args,
+        'func_name': func_name,
+        'other_globals': other_globals,
+        'disable_seaborn_randomization': disable_seaborn_randomization,
+        'serializer': serializer,
+    }, timeout=timeout)
 
 
 def turn_off_multiple_open_figure_warning():
@@ -10,6 +10,39 @@ from typing import Callable, Dict, Any, Hashable
 
 import tqdm
 
+#  Number of processes sharing the available cores with this one, see `set_core_share`.
+_num_core_sharers = 1
+
+
+def get_num_available_cores() -> int:
+    """
+    The number of cores this process may run on, which can be fewer than the cores of the machine.
+    :return:
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+def set_core_share(num_processes: int):
+    """
+    Record that this process is one of `num_processes` worker processes running side by side, so that the parallel
+    work it starts itself only uses its share of the available cores (see `get_num_cores_share`).
+    :param num_processes:
+    :return:
+    """
+    global _num_core_sharers
+    _num_core_sharers = max(1, num_processes)
+
+
+def get_num_cores_share() -> int:
+    """
+    The number of available cores this process should use for parallel work, at least 1.
+    :return:
+    """
+    return max(1, get_num_available_cores() // _num_core_sharers)
+
 
 def fault_tolerant_imap_unordered(func: Callable,
                                   task_dict: Dict[Hashable, Any],
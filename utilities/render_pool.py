@@ -0,0 +1,280 @@
+"""
+A pool of persistent worker processes for rendering viz code.
+
+Starting a process per render means paying for the process start-up and the imports of matplotlib, seaborn and
+friends for every candidate. Workers in a `RenderPool` are started ahead of time, import the plotting libraries
+once, and then render tasks sent to them over a pipe. A worker is killed and replaced if a task exceeds its timeout,
+and retired after a number of tasks or once its resident memory grows past a threshold, so state leaked by viz code
+does not accumulate. Workers exit by themselves if the process that started them goes away, even in the middle of
+a task.
+"""
+import atexit
+import importlib
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+from multiprocessing.connection import Connection
+from typing import Dict, Any, Optional, List, Tuple
+
+import attr
+
+#  Imported by every worker on start-up. The ones that are not installed are skipped.
+PRELOAD_MODULES = ('matplotlib.pyplot', 'seaborn', 'wordcloud', 'yellowbrick')
+DEFAULT_MAX_TASKS_PER_WORKER = 100
+DEFAULT_MAX_RSS_BYTES = 1 << 30
+
+#  How long to wait for a worker to finish its imports, in seconds.
+_STARTUP_TIMEOUT = 120
+
+_default_pool: Optional['RenderPool'] = None
+_default_pool_lock = threading.Lock()
+
+
+def _get_rss_bytes() -> Optional[int]:
+    """
+    The resident memory of the current process, or None if it cannot be determined (i.e. outside of Linux).
+    :return:
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _preload(modules: Tuple[str, ...]):
+    import matplotlib
+
+    #  Workers never display anything, figures are only serialized or sent back.
+    matplotlib.use('Agg')
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            pass
+
+
+def _exit_with_parent():
+    #  Runs in a daemon thread, so the worker also goes away while it is stuck in a task.
+    multiprocessing.connection.wait([multiprocessing.parent_process().sentinel])
+    os._exit(1)
+
+
+def _worker_main(conn: Connection, preload_modules: Tuple[str, ...]):
+    threading.Thread(target=_exit_with_parent, daemon=True).start()
+    _preload(preload_modules)
+
+    from matplotlib import pyplot as plt
+    from utilities.matplotlib_utils import run_viz_code_matplotlib
+    from utilities.shm_utils import attach_args
+
+    conn.send(('ready', None, _get_rss_bytes()))
+    while True:
+        try:
+            task = conn.recv()
+        except (OSError, EOFError):
+            return
+
+        if task is None:
+            return
+
+        try:
+            #  Dataframes in shared memory are attached copy-on-write, so viz code cannot modify them for other tasks.
+            response = ('ok', run_viz_code_matplotlib(**{**task, 'args': attach_args(task['args'])}))
+        except Exception as e:
+            response = ('error', e)
+        finally:
+            plt.close('all')
+
+        try:
+            conn.send((*response, _get_rss_bytes()))
+        except Exception as e:
+            #  The result or the exception could not be pickled.
+            conn.send(('error', RuntimeError(f"{type(e).__name__}: {e}"), _get_rss_bytes()))
+
+
+def _get_context():
+    #  Pools are started from processes that run other threads (e.g. the synthesis workers), which is not safe to
+    #  fork. The fork server is a single-threaded process, so it is cheaper than spawning a fresh interpreter.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+
+    return multiprocessing.get_context('spawn')
+
+
+@attr.s(cmp=False, repr=False)
+class _RenderWorker:
+    process: multiprocessing.Process = attr.ib()
+    conn: Connection = attr.ib()
+
+    ready: bool = attr.ib(init=False, default=False)
+    num_tasks: int = attr.ib(init=False, default=0)
+    rss_bytes: Optional[int] = attr.ib(init=False, default=None)
+
+    @classmethod
+    def start(cls, preload_modules: Tuple[str, ...]) -> '_RenderWorker':
+        context = _get_context()
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=_worker_main, args=(child_conn, preload_modules), daemon=True)
+        process.start()
+        child_conn.close()
+        return cls(process, conn)
+
+    def wait_until_ready(self):
+        if self.ready:
+            return
+
+        if not self.conn.poll(_STARTUP_TIMEOUT):
+            raise RuntimeError("Render worker did not start in time")
+
+        _, _, self.rss_bytes = self.conn.recv()
+        self.ready = True
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+@attr.s(cmp=False, repr=False)
+class RenderPool:
+    """
+    Runs `utilities.matplotlib_utils.run_viz_code_matplotlib` in `num_workers` persistent worker processes.
+    Safe to use from multiple threads; tasks wait for an idle worker.
+    """
+    num_workers: int = attr.ib(default=1)
+    #  Workers are replaced after this many tasks, or once their resident memory exceeds `max_rss_bytes`.
+    #  Set to None to disable either.
+    max_tasks_per_worker: Optional[int] = attr.ib(default=DEFAULT_MAX_TASKS_PER_WORKER)
+    max_rss_bytes: Optional[int] = attr.ib(default=DEFAULT_MAX_RSS_BYTES)
+    preload_modules: Tuple[str, ...] = attr.ib(default=PRELOAD_MODULES)
+
+    _idle: List[_RenderWorker] = attr.ib(init=False, factory=list)
+    _busy: List[_RenderWorker] = attr.ib(init=False, factory=list)
+    _cond: threading.Condition = attr.ib(init=False, factory=threading.Condition)
+    _closed: bool = attr.ib(init=False, default=False)
+    #  The workers can only be used by the process that started them.
+    owner_pid: int = attr.ib(init=False, factory=os.getpid)
+
+    def __attrs_post_init__(self):
+        if self.num_workers < 1:
+            raise ValueError("Arg `num_workers` must be at least 1")
+
+        #  Start all the workers right away so they do their imports while the caller is still busy.
+        self._idle = [_RenderWorker.start(self.preload_modules) for _ in range(self.num_workers)]
+
+    def run(self, task: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """
+        Run `run_viz_code_matplotlib(**task)` in a worker. Exceptions raised by the viz code are re-raised.
+        :param task: Keyword arguments for `run_viz_code_matplotlib`
+        :param timeout: In seconds. The worker is killed and replaced if the task does not finish in time.
+        :return: The result of `run_viz_code_matplotlib`, or None if the task timed out
+        """
+        worker = self._acquire()
+        try:
+            worker.wait_until_ready()
+            worker.conn.send(task)
+            if not worker.conn.poll(timeout):
+                worker.kill()
+                return None
+
+            status, payload, worker.rss_bytes = worker.conn.recv()
+
+        except (OSError, EOFError):
+            worker.kill()
+            raise RuntimeError(f"Render worker exited unexpectedly with code {worker.process.exitcode}")
+
+        finally:
+            worker.num_tasks += 1
+            self._release(worker)
+
+        if status == 'error':
+            raise payload
+
+        return payload
+
+    def close(self):
+        if os.getpid() != self.owner_pid:
+            return
+
+        with self._cond:
+            self._closed = True
+            workers = self._idle + self._busy
+            self._idle = []
+            self._busy = []
+            self._cond.notify_all()
+
+        for worker in workers:
+            worker.stop()
+
+    def _acquire(self) -> _RenderWorker:
+        with self._cond:
+            while not self._idle:
+                if self._closed:
+                    raise RuntimeError("Render pool is closed")
+
+                self._cond.wait()
+
+            worker = self._idle.pop()
+            self._busy.append(worker)
+            return worker
+
+    def _needs_replacement(self, worker: _RenderWorker) -> bool:
+        if not worker.is_alive():
+            return True
+        if self.max_tasks_per_worker is not None and worker.num_tasks >= self.max_tasks_per_worker:
+            return True
+        if self.max_rss_bytes is not None and worker.rss_bytes is not None and worker.rss_bytes > self.max_rss_bytes:
+            return True
+
+        return False
+
+    def _release(self, worker: _RenderWorker):
+        if self._needs_replacement(worker):
+            if worker.is_alive():
+                worker.stop()
+            else:
+                worker.kill()
+
+            worker_to_add = None if self._closed else _RenderWorker.start(self.preload_modules)
+        else:
+            worker_to_add = worker
+
+        with self._cond:
+            self._busy.remove(worker)
+            if worker_to_add is not None and not self._closed:
+                self._idle.append(worker_to_add)
+                self._cond.notify()
+            elif worker_to_add is not None:
+                worker_to_add.stop()
+
+
+def get_render_pool() -> RenderPool:
+    """
+    The render pool of the current process, started on first use and closed when the process exits.
+    :return:
+    """
+    global _default_pool
+    with _default_pool_lock:
+        #  A forked child cannot talk to the workers of its parent, so it gets its own pool.
+        if _default_pool is None or _default_pool.owner_pid != os.getpid():
+            _default_pool = RenderPool()
+            atexit.register(_default_pool.close)
+
+        return _default_pool
@@ -0,0 +1,249 @@
+"""
+Sharing dataframes with worker processes through shared memory.
+
+`SharedDataFrame.publish` copies the numeric and datetime blocks of a dataframe into a single shared memory segment,
+once. The handle it returns is small and cheap to pickle: it only holds the layout of the blocks, the axes, and the
+remaining (object, categorical, ...) columns, which have to be pickled anyway. `SharedDataFrame.attach` rebuilds the
+dataframe in another process on top of a private, copy-on-write mapping of the segment, so nothing is copied unless
+the code using the dataframe writes to it, and such writes are never seen by other processes or other attachments.
+
+Falls back to pickling the whole dataframe with the handle if shared memory is not available or lacks the room.
+"""
+import mmap
+import os
+from typing import List, Optional, Tuple, Any, Hashable
+
+import attr
+import numpy as np
+import pandas as pd
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+try:
+    import _posixshmem
+except ImportError:  # Windows
+    _posixshmem = None
+
+#  Dtype kinds of numpy blocks that are placed in shared memory: bool, (unsigned) int, float, complex and datetime.
+_SHARED_DTYPE_KINDS = 'biufcmM'
+_ALIGNMENT = 64
+_SHM_DIR = '/dev/shm'
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _has_room(size: int) -> bool:
+    #  Writing past the capacity of the tmpfs backing shared memory kills the process with a SIGBUS.
+    if not os.path.isdir(_SHM_DIR):
+        return True
+
+    stats = os.statvfs(_SHM_DIR)
+    return stats.f_bavail * stats.f_frsize >= size
+
+
+def _open_private_mapping(name: str, size: int):
+    """
+    A copy-on-write mapping of the shared memory segment `name`. On Windows, the segment is copied instead.
+    :param name:
+    :param size:
+    :return:
+    """
+    #  The segment is opened directly rather than through `shared_memory.SharedMemory`, which would register it with
+    #  the resource tracker of this process and have it unlinked when this process exits, although the process that
+    #  published it still owns it.
+    path = os.path.join(_SHM_DIR, name.lstrip('/'))
+    if os.path.exists(path):
+        fd = os.open(path, os.O_RDONLY)
+    elif _posixshmem is not None:
+        fd = _posixshmem.shm_open('/' + name.lstrip('/'), os.O_RDONLY, mode=0o600)
+    else:
+        #  Segments are not tracked on Windows.
+        shm = shared_memory.SharedMemory(name)
+        try:
+            return bytearray(shm.buf[:size])
+        finally:
+            shm.close()
+
+    try:
+        return mmap.mmap(fd, size, access=mmap.ACCESS_COPY)
+    finally:
+        os.close(fd)
+
+
+def _get_blocks(df: pd.DataFrame) -> Optional[List[Tuple[Any, np.ndarray]]]:
+    mgr = getattr(df, '_mgr', None)
+    if mgr is None or not hasattr(mgr, 'blocks'):
+        return None
+
+    return [(blk.values, np.asarray(blk.mgr_locs.as_array)) for blk in mgr.blocks]
+
+
+def _frame_from_blocks(blocks: List[Tuple[Any, np.ndarray]], columns: pd.Index, index: pd.Index) -> pd.DataFrame:
+    #  Building the block manager directly is the only way to create a dataframe without consolidating (copying)
+    #  its columns.
+    from pandas.core.internals import BlockManager
+    try:
+        from pandas.core.internals.api import make_block
+    except ImportError:  # pandas < 1.3
+        from pandas.core.internals import make_block
+
+    mgr = BlockManager([make_block(values, placement=placement, ndim=2) for values, placement in blocks],
+                       [columns, index])
+    if hasattr(pd.DataFrame, '_from_mgr'):
+        return pd.DataFrame._from_mgr(mgr, axes=mgr.axes)
+
+    return pd.DataFrame(mgr)
+
+
+def _is_shareable(values: Any) -> bool:
+    return isinstance(values, np.ndarray) and values.dtype.kind in _SHARED_DTYPE_KINDS and values.dtype.isnative
+
+
+@attr.s(cmp=False, repr=False)
+class SharedDataFrame:
+    """
+    A handle to a dataframe published in shared memory. Only the handle returned by `publish` owns the segment and
+    should be closed; unpickled copies of it only attach to the segment.
+    """
+    columns: pd.Index = attr.ib()
+    index: Any = attr.ib()
+    #  (offset, shape, dtype, column positions) of the blocks in the shared memory segment.
+    shared_blocks: List[Tuple[int, Tuple[int, ...], str, np.ndarray]] = attr.ib(factory=list)
+    #  (values, column positions) of the blocks that are pickled with the handle.
+    pickled_blocks: List[Tuple[Any, np.ndarray]] = attr.ib(factory=list)
+    shm_name: Optional[str] = attr.ib(default=None)
+    size: int = attr.ib(default=0)
+    #  The whole dataframe, if it could not be published.
+    frame: Optional[pd.DataFrame] = attr.ib(default=None)
+    #  Positions of the columns to attach, if only a subset of them should be.
+    selection: Optional[List[int]] = attr.ib(default=None)
+
+    _shm: Any = attr.ib(default=None)
+
+    @classmethod
+    def publish(cls, df: pd.DataFrame) -> 'SharedDataFrame':
+        blocks = _get_blocks(df)
+        if shared_memory is None or blocks is None:
+            return cls(df.columns, df.index, frame=df)
+
+        shared = [(values, placement) for values, placement in blocks if _is_shareable(values)]
+        pickled_blocks = [(values, placement) for values, placement in blocks if not _is_shareable(values)]
+
+        #  Share the index too if it is a plain numeric one.
+        index = df.index
+        index_values = index.values if not isinstance(index, (pd.RangeIndex, pd.MultiIndex)) else None
+        share_index = _is_shareable(index_values) and index_values.dtype.kind in 'iuf'
+        if share_index:
+            shared.append((index_values, None))
+
+        layout = []
+        size = 0
+        for values, placement in shared:
+            offset = _align(size)
+            layout.append((offset, values.shape, values.dtype.str, placement))
+            size = offset + values.nbytes
+
+        if size == 0 or not _has_room(size):
+            return cls(df.columns, df.index, frame=df)
+
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        for (offset, shape, dtype, _), (values, _) in zip(layout, shared):
+            np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = values
+
+        if share_index:
+            offset, shape, dtype, _ = layout.pop()
+            index = (offset, shape, dtype, index.name)
+
+        return cls(df.columns, index, shared_blocks=layout, pickled_blocks=pickled_blocks,
+                   shm_name=shm.name, size=size, shm=shm)
+
+    def take_columns(self, columns: List[Hashable]) -> 'SharedDataFrame':
+        """
+        A handle attaching to the columns `columns` only, like `df[columns]`. Columns must be unique.
+        :param columns:
+        :return:
+        """
+        if self.selection is None:
+            positions = [self.columns.get_loc(col) for col in columns]
+        else:
+            positions = [self.selection[self.columns[self.selection].get_loc(col)] for col in columns]
+
+        #  Only pickle the blocks holding selected columns along with the handle.
+        selected = set(positions)
+        pickled_blocks = [(values, placement) for values, placement in self.pickled_blocks
+                          if selected.intersection(placement.tolist())]
+        return attr.evolve(self, pickled_blocks=pickled_blocks, selection=positions, shm=None)
+
+    def attach(self) -> pd.DataFrame:
+        """
+        The dataframe, backed by a private copy-on-write mapping of the shared memory segment.
+        :return:
+        """
+        if self.frame is not None:
+            return self.frame if self.selection is None else self.frame.iloc[:, self.selection]
+
+        buf = _open_private_mapping(self.shm_name, self.size) if self.shm_name is not None else None
+
+        def get_shared_array(offset: int, shape: Tuple[int, ...], dtype: str) -> np.ndarray:
+            dtype = np.dtype(dtype)
+            return np.frombuffer(buf, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+        index = self.index
+        if isinstance(index, tuple):
+            offset, shape, dtype, name = index
+            index = pd.Index(get_shared_array(offset, shape, dtype), name=name, copy=False)
+
+        blocks = [(get_shared_array(offset, shape, dtype), placement)
+                  for offset, shape, dtype, placement in self.shared_blocks]
+        blocks.extend(self.pickled_blocks)
+        if self.selection is None:
+            return _frame_from_blocks(blocks, self.columns, index)
+
+        #  One block per selected column, each a view of the row of the block holding it.
+        locations = {}
+        for values, placement in blocks:
+            for row, position in enumerate(placement):
+                locations[position] = (values, row)
+
+        selected_blocks = []
+        for new_position, position in enumerate(self.selection):
+            values, row = locations[position]
+            if getattr(values, 'ndim', 1) == 2:
+                values = values[row:row + 1]
+
+            selected_blocks.append((values, np.array([new_position])))
+
+        return _frame_from_blocks(selected_blocks, self.columns[self.selection], index)
+
+    def close(self):
+        """
+        Release the shared memory segment. Processes that are attached keep their mappings.
+        :return:
+        """
+        if self._shm is not None:
+            self._shm.close()
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+            self._shm = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shm'] = None
+        return state
+
+
+def attach_args(args: dict) -> dict:
+    """
+    Replace the `SharedDataFrame` handles among the values of `args` with the dataframes they refer to.
+    :param args:
+    :return:
+    """
+    return {k: v.attach() if isinstance(v, SharedDataFrame) else v for k, v in args.items()}